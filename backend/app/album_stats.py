@@ -0,0 +1,88 @@
+"""
+相册统计字段（photo_count、total_bytes）的增量维护
+
+这两个字段只统计未删除的照片。上传、软删除、恢复和删除照片时都调用这里的函数，
+在同一个事务里用 UPDATE ... SET photo_count = photo_count + ? 更新计数，
+相册列表直接读取字段，不再逐个相册执行 COUNT。按拍摄时间分组的时间线计数
+（timeline.py）也在这里一并更新。计数出现偏差时运行 reconcile_album_stats.py
+按照片表重新计算。
+"""
+from collections import defaultdict
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Album, Photo
+from .album_versions import touch_albums
+from . import timeline
+
+
+async def adjust_album_stats(db: AsyncSession, photos: Iterable[Photo], sign: int):
+    """按相册汇总照片数量和大小，把增量（sign 为 1 或 -1）写入相册"""
+    deltas = defaultdict(lambda: [0, 0])
+    for photo in photos:
+        deltas[photo.album_id][0] += 1
+        deltas[photo.album_id][1] += photo.file_size or 0
+
+    for album_id, (count, size) in deltas.items():
+        await db.execute(
+            update(Album)
+            .where(Album.id == album_id)
+            .values(
+                photo_count=Album.photo_count + sign * count,
+                total_bytes=Album.total_bytes + sign * size,
+                # 计数变化不算编辑相册，保持 updated_at 不变
+                updated_at=Album.updated_at
+            )
+            .execution_options(synchronize_session=False)
+        )
+    touch_albums(db, deltas.keys())
+
+
+async def photos_added(db: AsyncSession, photos: Iterable[Photo]):
+    """照片入库或从回收站恢复后调用（在 commit 之前）"""
+    photos = list(photos)
+    await adjust_album_stats(db, photos, 1)
+    await timeline.photos_added(db, photos)
+
+
+async def photos_removed(db: AsyncSession, photos: Iterable[Photo]):
+    """照片移入回收站或被直接删除后调用（在 commit 之前）"""
+    photos = list(photos)
+    await adjust_album_stats(db, photos, -1)
+    await timeline.photos_removed(db, photos)
+
+
+async def reconcile_album_stats(db: AsyncSession) -> List[Tuple[int, int, int, int, int]]:
+    """
+    按照片表重新计算所有相册的统计字段并提交
+
+    返回被修正的相册 [(相册ID, 原数量, 实际数量, 原大小, 实际大小)]
+    """
+    actual_result = await db.execute(
+        select(Photo.album_id, func.count(Photo.id), func.coalesce(func.sum(Photo.file_size), 0))
+        .where(Photo.is_deleted == False)
+        .group_by(Photo.album_id)
+    )
+    actual = {album_id: (count, size) for album_id, count, size in actual_result.all()}
+
+    albums_result = await db.execute(
+        select(Album.id, Album.photo_count, Album.total_bytes)
+    )
+
+    fixed = []
+    for album_id, photo_count, total_bytes in albums_result.all():
+        count, size = actual.get(album_id, (0, 0))
+        if (photo_count, total_bytes) == (count, size):
+            continue
+        await db.execute(
+            update(Album)
+            .where(Album.id == album_id)
+            .values(photo_count=count, total_bytes=size, updated_at=Album.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        fixed.append((album_id, photo_count, count, total_bytes, size))
+
+    await db.commit()
+    return fixed
@@ -0,0 +1,127 @@
+"""
+相册版本号与条件请求（ETag / If-None-Match）
+
+相册或其中的照片有任何改动时，在同一个事务提交前把相册的 version 字段加一。
+列表接口用它生成弱 ETag：
+- 相册详情、某个相册的照片：W/"album-<相册ID>-<version>"
+- 相册列表、全部照片：所有相册 (id, version) 的摘要，增删改任一相册都会变化
+
+客户端带上 If-None-Match 再次请求时，只查一次版本号，相同就返回 304，
+不查询列表、不序列化。版本号存在数据库中，服务重启或多台服务器之间都一致。
+
+涉及哪些相册：通过 ORM 对象修改 Album、Photo 时在 flush 后自动记录；用
+update()/delete() 语句批量修改时调用 touch_albums 登记。提交后同时通知
+response_cache 使对应的进程内缓存失效。
+"""
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import Album, Photo
+from .response_cache import response_cache, ALL_ALBUMS
+from .media import etag_matches
+
+# session.info 中记录本事务改动过的相册
+PENDING_KEY = "changed_albums"
+
+
+def _pending_albums(session: Session) -> set:
+    return session.info.setdefault(PENDING_KEY, set())
+
+
+def touch_albums(db: AsyncSession, album_ids: Optional[Iterable[int]]):
+    """
+    登记本事务用 update()/delete() 语句修改过的相册（在 commit 之前调用）
+
+    album_ids 为 None 表示无法确定范围，提交时所有相册的版本号都会加一。
+    """
+    pending = _pending_albums(db.sync_session)
+    if album_ids is None:
+        pending.add(ALL_ALBUMS)
+    else:
+        pending.update(album_id for album_id in album_ids if album_id is not None)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_albums(session: Session, flush_context):
+    """记录本次 flush 中新增、修改、删除的相册和照片所属的相册"""
+    changed = session.new | session.dirty | session.deleted
+    if not changed:
+        return
+    pending = _pending_albums(session)
+    for obj in changed:
+        if isinstance(obj, Album):
+            pending.add(obj.id)
+        elif isinstance(obj, Photo):
+            pending.add(obj.album_id)
+            # 照片移到其他相册时，原相册也要更新
+            pending.update(inspect(obj).attrs.album_id.history.deleted or ())
+    pending.discard(None)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_versions(session: Session):
+    """在同一个事务里递增版本号，版本号和数据一起提交"""
+    session.flush()
+    pending = session.info.get(PENDING_KEY)
+    if not pending:
+        return
+    query = update(Album).values(
+        version=Album.version + 1,
+        # 版本号变化不算编辑相册，保持 updated_at 不变
+        updated_at=Album.updated_at
+    )
+    if ALL_ALBUMS not in pending:
+        query = query.where(Album.id.in_(pending))
+    session.execute(query.execution_options(synchronize_session=False))
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_response_cache(session: Session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        response_cache.bump(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session):
+    session.info.pop(PENDING_KEY, None)
+
+
+# ---------- ETag ----------
+
+async def album_etag(db: AsyncSession, album_id: int) -> Optional[str]:
+    """单个相册的 ETag，相册不存在时返回 None"""
+    result = await db.execute(select(Album.version).where(Album.id == album_id))
+    version = result.scalar_one_or_none()
+    if version is None:
+        return None
+    return f'W/"album-{album_id}-{version}"'
+
+
+async def catalog_etag(db: AsyncSession) -> str:
+    """全部相册的 ETag，任一相册被创建、删除或版本号变化时都会改变"""
+    result = await db.execute(select(Album.id, Album.version).order_by(Album.id))
+    digest = hashlib.sha1()
+    count = 0
+    for album_id, version in result:
+        digest.update(f"{album_id}:{version};".encode())
+        count += 1
+    return f'W/"albums-{count}-{digest.hexdigest()[:16]}"'
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    # no-cache：客户端可以保存响应，但每次使用前都要带 If-None-Match 确认
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """请求的 If-None-Match 与 ETag 一致时返回 304 响应，否则返回 None"""
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
@@ -0,0 +1,208 @@
+"""
+相册打包下载：边读边发送的 ZIP64 压缩包
+
+照片都是已经压缩过的 JPEG、PNG 等，按 stored（不压缩）方式写入，每个文件的大小和
+CRC32 在入库时就已记录（Photo.file_size、Photo.content_crc32），因此压缩包的布局可以
+在发送前完全确定：
+- 每个文件的本地文件头、数据和中央目录都写在固定的位置，总长度预先算出，响应带
+  Content-Length；
+- 同一个相册版本（albums.version）生成的压缩包逐字节相同，可以用 Range 从任意位置
+  继续下载，ETag 由相册版本得出；
+- 文件数据从存储后端按块读取后直接发送，不写临时文件，内存占用只与照片数量有关
+  （每个条目保存一个文件头），与文件大小无关。
+
+超过 ZIP 格式 4GB / 65535 个条目限制的部分使用 ZIP64 扩展字段，其他情况写普通的
+ZIP 结构，兼容不支持 ZIP64 的解压工具。
+"""
+import struct
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .database import AsyncSessionLocal, Photo
+from .derivatives import photo_key
+from .storage import get_storage
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ENTRY_LIMIT = 0xFFFF
+
+# 通用标志位：第 11 位表示文件名是 UTF-8
+UTF8_FLAG = 0x0800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+
+# (文件名, 存储键, 大小, CRC32, 修改时间)
+ArchiveEntry = Tuple[str, str, int, int, datetime]
+
+
+def dos_datetime(value: Optional[datetime]) -> Tuple[int, int]:
+    """ZIP 使用的 MS-DOS 日期时间，早于 1980 年的按 1980-01-01 处理"""
+    if value is None or value.year < 1980:
+        value = datetime(1980, 1, 1)
+    if value.year > 2107:
+        value = datetime(2107, 12, 31, 23, 59, 58)
+    time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return time, date
+
+
+def zip64_extra(values: Iterable[int]) -> bytes:
+    values = list(values)
+    if not values:
+        return b""
+    return struct.pack("<HH", 0x0001, 8 * len(values)) + struct.pack(f"<{len(values)}Q", *values)
+
+
+def local_header(name: bytes, size: int, crc32: int, modified: datetime) -> bytes:
+    zip64 = size >= ZIP32_LIMIT
+    extra = zip64_extra([size, size]) if zip64 else b""
+    stored_size = ZIP32_LIMIT if zip64 else size
+    time, date = dos_datetime(modified)
+    return struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034B50, VERSION_ZIP64 if zip64 else VERSION_DEFAULT, UTF8_FLAG, 0, time, date,
+        crc32, stored_size, stored_size, len(name), len(extra)
+    ) + name + extra
+
+
+def central_header(name: bytes, size: int, crc32: int, modified: datetime, offset: int) -> bytes:
+    overflow = []
+    if size >= ZIP32_LIMIT:
+        overflow += [size, size]
+    if offset >= ZIP32_LIMIT:
+        overflow.append(offset)
+    extra = zip64_extra(overflow)
+    version = VERSION_ZIP64 if overflow else VERSION_DEFAULT
+    stored_size = min(size, ZIP32_LIMIT)
+    time, date = dos_datetime(modified)
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014B50, version, version, UTF8_FLAG, 0, time, date,
+        crc32, stored_size, stored_size, len(name), len(extra), 0, 0, 0, 0, min(offset, ZIP32_LIMIT)
+    ) + name + extra
+
+
+def end_records(count: int, directory_offset: int, directory_size: int) -> bytes:
+    """中央目录结束记录，超出限制时前面加上 ZIP64 结束记录和定位器"""
+    records = b""
+    if count >= ENTRY_LIMIT or directory_offset >= ZIP32_LIMIT or directory_size >= ZIP32_LIMIT:
+        zip64_offset = directory_offset + directory_size
+        records += struct.pack(
+            "<IQHHIIQQQQ",
+            0x06064B50, 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+            count, count, directory_size, directory_offset
+        )
+        records += struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+    records += struct.pack(
+        "<IHHHHIIH",
+        0x06054B50, 0, 0, min(count, ENTRY_LIMIT), min(count, ENTRY_LIMIT),
+        min(directory_size, ZIP32_LIMIT), min(directory_offset, ZIP32_LIMIT), 0
+    )
+    return records
+
+
+def archive_names(filenames: Iterable[str]) -> List[str]:
+    """压缩包内的文件名：去掉路径分隔符，重名的加上 (2)、(3) 等后缀（不区分大小写）"""
+    names = []
+    used = set()
+    for filename in filenames:
+        name = filename.replace("/", "_").replace("\\", "_").strip() or "photo"
+        if name.strip(".") == "":
+            name = "photo"
+        stem, dot, ext = name.rpartition(".")
+        if not dot:
+            stem, ext = name, ""
+        candidate, number = name, 1
+        while candidate.lower() in used:
+            number += 1
+            candidate = f"{stem} ({number}){dot}{ext}"
+        used.add(candidate.lower())
+        names.append(candidate)
+    return names
+
+
+async def fill_crc32(photos: List[Photo]):
+    """
+    补算缺少 CRC32 的照片（迁移 8 之前上传、还没有运行 migrate.py hash-uploads 的照片）
+
+    下载接口使用只读会话，补算的结果在单独的写会话中用 update() 语句写回，不经过
+    ORM flush，不会改变相册版本号（内容没有变化）。
+    """
+    storage = get_storage()
+    missing = [photo for photo in photos if photo.content_crc32 is None]
+    if not missing:
+        return
+    async with AsyncSessionLocal() as session:
+        for photo in missing:
+            crc32 = 0
+            async for chunk in storage.stream(photo_key(photo)):
+                crc32 = zlib.crc32(chunk, crc32)
+            await session.execute(update(Photo).where(Photo.id == photo.id).values(content_crc32=crc32))
+            set_committed_value(photo, "content_crc32", crc32)
+        await session.commit()
+    print(f"[打包下载] 补算了 {len(missing)} 张照片的 CRC32")
+
+
+def album_entries(photos: List[Photo]) -> List[ArchiveEntry]:
+    """照片按传入的顺序写入压缩包，修改时间取拍摄时间（没有时取上传时间）"""
+    names = archive_names(photo.original_filename for photo in photos)
+    return [
+        (name, photo_key(photo), photo.file_size, photo.content_crc32, photo.taken_at or photo.created_at)
+        for name, photo in zip(names, photos)
+    ]
+
+
+class AlbumArchive:
+    """
+    预先算好布局的 ZIP 压缩包
+
+    parts 是按偏移排列的片段 [(偏移, 长度, 内容)]，内容为 bytes（文件头、中央目录）
+    或存储键（照片数据，发送时从存储后端读取）。
+    """
+
+    def __init__(self, entries: List[ArchiveEntry]):
+        self.parts: List[Tuple[int, int, Union[bytes, str]]] = []
+        directory = []
+        offset = 0
+        for name, key, size, crc32, modified in entries:
+            encoded = name.encode("utf-8")
+            header = local_header(encoded, size, crc32, modified)
+            directory.append(central_header(encoded, size, crc32, modified, offset))
+            self.parts.append((offset, len(header), header))
+            offset += len(header)
+            self.parts.append((offset, size, key))
+            offset += size
+
+        directory_bytes = b"".join(directory)
+        tail = directory_bytes + end_records(len(entries), offset, len(directory_bytes))
+        self.parts.append((offset, len(tail), tail))
+        self.size = offset + len(tail)
+        self.offsets = [part[0] for part in self.parts]
+
+    async def stream(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """按顺序发送 [start, end]（含 end）范围的内容"""
+        end = self.size - 1 if end is None else end
+        storage = get_storage()
+        index = max(bisect_right(self.offsets, start) - 1, 0)
+        for offset, length, content in self.parts[index:]:
+            if offset > end:
+                break
+            if length == 0:
+                continue
+            low = max(start, offset) - offset
+            high = min(end, offset + length - 1) - offset
+            if isinstance(content, bytes):
+                yield content[low:high + 1]
+                continue
+
+            sent = 0
+            async for chunk in storage.stream(content, low, high):
+                sent += len(chunk)
+                yield chunk
+            if sent != high - low + 1:
+                # 文件缺失或大小与记录不符，继续发送会得到错位的压缩包，直接中断连接
+                raise IOError(f"照片文件 {content} 读取到 {sent} 字节，应为 {high - low + 1} 字节")
@@ -0,0 +1,130 @@
+"""
+按内容去重的照片文件（blobs 表）
+
+上传时边写盘边计算 SHA-256（见 ingest.stream_upload_to_path）。内容已经存在时删除
+刚写入的文件，新照片直接指向已有的原图和衍生图，省去解码和生成缩略图。
+blobs.ref_count 是引用同一份文件的照片数（包括回收站中的），永久删除照片时减一，
+降为 0 才删除文件。
+
+- find_blob：入库前按哈希查找已有文件
+- attach_blobs：新照片写入数据库时登记引用，与照片在同一个事务中。用
+  INSERT ... ON CONFLICT 原子地新增或递增，两个请求同时上传相同内容时，后提交的
+  一方改为指向先入库的文件，并返回自己多写的文件，提交后删除
+- release_blobs：永久删除照片时释放引用，返回可以删除文件的照片
+
+没有 content_sha256 的旧照片不参与去重，删除时直接删除文件；可以用
+migrate.py hash-uploads 补算哈希并合并重复的文件。
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Blob, Photo, ReadSessionLocal
+
+# 同一份文件在照片和 blobs 表中都保存的字段
+FILE_FIELDS = (
+    "filename", "file_path", "file_size", "width", "height", "variants", "variants_version", "dhash",
+    "taken_at", "camera_make", "camera_model", "lens_model", "orientation",
+)
+
+
+async def find_blob(content_sha256: str) -> Optional[Blob]:
+    """按内容哈希查找已入库的文件"""
+    async with ReadSessionLocal() as session:
+        result = await session.execute(
+            select(Blob).where(Blob.content_sha256 == content_sha256)
+        )
+        return result.scalar_one_or_none()
+
+
+async def stored_filenames(hashes: Iterable[str]) -> Set[str]:
+    """这些哈希在 blobs 表中对应的文件名（入库失败时用来判断文件是否与其他照片共用）"""
+    hashes = {content_sha256 for content_sha256 in hashes if content_sha256}
+    if not hashes:
+        return set()
+    async with ReadSessionLocal() as session:
+        result = await session.execute(
+            select(Blob.filename).where(Blob.content_sha256.in_(hashes))
+        )
+        return set(result.scalars().all())
+
+
+def upsert_blob(dialect_name: str, values: Dict):
+    """新增文件记录，哈希已存在时引用数加一；返回最终记录的文件字段"""
+    insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    statement = insert(Blob).values(ref_count=1, **values)
+    return statement.on_conflict_do_update(
+        index_elements=[Blob.content_sha256],
+        set_={"ref_count": Blob.ref_count + 1}
+    ).returning(*(getattr(Blob, field) for field in FILE_FIELDS))
+
+
+async def attach_blobs(db: AsyncSession, photos: Iterable[Photo]) -> List[Photo]:
+    """
+    为新照片登记文件引用（在 commit 之前调用）
+
+    返回因并发上传而多写的文件（以 Photo 表示，未加入会话），提交后删除。
+    """
+    dialect_name = db.get_bind().dialect.name
+    duplicates = []
+    for photo in photos:
+        if not photo.content_sha256:
+            continue
+        values = {field: getattr(photo, field) for field in FILE_FIELDS}
+        result = await db.execute(
+            upsert_blob(dialect_name, {"content_sha256": photo.content_sha256, **values})
+        )
+        stored = dict(zip(FILE_FIELDS, result.one()))
+        if stored["filename"] != photo.filename:
+            # 相同内容在 find_blob 之后才由其他请求入库：改用已有的文件
+            duplicates.append(Photo(**values))
+            for field, value in stored.items():
+                setattr(photo, field, value)
+    return duplicates
+
+
+async def release_blobs(db: AsyncSession, photos: Iterable[Photo]) -> List[Photo]:
+    """
+    释放即将永久删除的照片对文件的引用（在 commit 之前调用）
+
+    返回不再被引用、可以删除文件的照片（每份文件一张），提交后再删除文件。
+    """
+    unreferenced = []
+    counts: Dict[str, int] = defaultdict(int)
+    representatives: Dict[str, Photo] = {}
+    for photo in photos:
+        if not photo.content_sha256:
+            unreferenced.append(photo)
+            continue
+        counts[photo.content_sha256] += 1
+        representatives.setdefault(photo.content_sha256, photo)
+
+    for content_sha256, count in counts.items():
+        result = await db.execute(
+            update(Blob)
+            .where(Blob.content_sha256 == content_sha256)
+            .values(ref_count=Blob.ref_count - count)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            # 没有登记过的文件，按独占处理
+            unreferenced.append(representatives.pop(content_sha256))
+
+    if representatives:
+        result = await db.execute(
+            select(Blob.content_sha256)
+            .where(Blob.content_sha256.in_(representatives), Blob.ref_count <= 0)
+        )
+        released = result.scalars().all()
+        if released:
+            await db.execute(
+                delete(Blob)
+                .where(Blob.content_sha256.in_(released))
+                .execution_options(synchronize_session=False)
+            )
+        unreferenced.extend(representatives[content_sha256] for content_sha256 in released)
+    return unreferenced
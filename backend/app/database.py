@@ -1,16 +1,100 @@
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, ForeignKey, Index, event
 from datetime import datetime
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
-# 创建异步引擎
-engine = create_async_engine(
-    settings.database_url,
-    echo=settings.debug,
-    future=True
-)
+def async_database_url(url: str) -> str:
+    """PostgreSQL 地址统一使用 asyncpg 驱动，兼容 postgres:// 等常见写法"""
+    for prefix in ("postgres://", "postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+database_url = async_database_url(settings.database_url)
+is_sqlite = database_url.startswith("sqlite")
+
+
+def sqlite_pragmas(read_only: bool):
+    """
+    每个新建的 SQLite 连接都执行的 PRAGMA
+
+    WAL 模式下读写互不阻塞，批量上传提交期间相册和照片列表照常可读；
+    synchronous=NORMAL 在 WAL 下只在检查点时 fsync，断电最多丢失最近的事务，
+    不会损坏数据库。
+    """
+    pragmas = [
+        f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}",
+        f"PRAGMA cache_size=-{settings.sqlite_cache_size_kb}",
+        f"PRAGMA mmap_size={settings.sqlite_mmap_size}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+
+def create_engine_for(url: str, read_only: bool):
+    """创建读或写引擎，SQLite 连接建立时设置 PRAGMA"""
+    pool_size = settings.db_read_pool_size if read_only else settings.db_write_pool_size
+    if is_sqlite:
+        # aiosqlite 默认使用 NullPool，每次请求都重新打开文件并执行 PRAGMA，
+        # 页缓存和 mmap 也随连接丢弃；改为常驻的连接池
+        options = {"poolclass": AsyncAdaptedQueuePool, "pool_size": pool_size}
+    else:
+        server_settings = {"application_name": settings.db_application_name}
+        if read_only:
+            server_settings["default_transaction_read_only"] = "on"
+        options = {
+            "pool_size": pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout,
+            "pool_recycle": settings.db_pool_recycle,
+            "pool_pre_ping": True,
+            "connect_args": {
+                # asyncpg 在每个连接上缓存预编译语句，列表等重复查询省去解析和规划；
+                # 经过 pgbouncer 事务池连接时需设为 0
+                "prepared_statement_cache_size": settings.db_statement_cache_size,
+                "server_settings": server_settings,
+            },
+        }
+
+    new_engine = create_async_engine(
+        url,
+        echo=settings.db_echo,
+        future=True,
+        **options
+    )
+
+    if is_sqlite:
+        pragmas = sqlite_pragmas(read_only)
+
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+    return new_engine
+
+
+# 写引擎：所有写操作和迁移
+engine = create_engine_for(database_url, read_only=False)
+
+# 读引擎：只读的列表和详情接口。SQLite 使用同一文件上的只读连接池；
+# PostgreSQL 配置了只读副本时连接副本，否则与写引擎共用连接池
+if is_sqlite:
+    read_engine = create_engine_for(database_url, read_only=True)
+elif settings.database_read_url:
+    read_engine = create_engine_for(async_database_url(settings.database_read_url), read_only=True)
+else:
+    read_engine = engine
 
 # 创建异步会话
 AsyncSessionLocal = async_sessionmaker(
@@ -18,10 +102,25 @@ AsyncSessionLocal = async_sessionmaker(
     expire_on_commit=False
 )
 
+ReadSessionLocal = async_sessionmaker(
+    read_engine,
+    expire_on_commit=False
+)
+
 # 创建基础模型类
 Base = declarative_base()
 
 
+def live_only(is_deleted):
+    """部分索引条件：只索引未删除的行"""
+    return {"sqlite_where": is_deleted == False, "postgresql_where": is_deleted == False}
+
+
+def trash_only(is_deleted):
+    """部分索引条件：只索引回收站中的行"""
+    return {"sqlite_where": is_deleted == True, "postgresql_where": is_deleted == True}
+
+
 # 数据库模型
 class Album(Base):
     """相册模型"""
@@ -32,10 +131,28 @@ class Album(Base):
     description = Column(Text, nullable=True)
     cover_image = Column(String(500), nullable=True)
     sort_order = Column(Integer, default=0)  # 自定义排序
+    photo_count = Column(Integer, default=0, nullable=False)  # 未删除的照片数量，由 album_stats 维护
+    total_bytes = Column(BigInteger, default=0, nullable=False)  # 未删除的照片总大小
+    version = Column(Integer, default=1, nullable=False)  # 相册或其照片每次改动加一，用于 ETag，由 album_versions 维护
     is_deleted = Column(Boolean, default=False)  # 软删除标记
     deleted_at = Column(DateTime, nullable=True)  # 删除时间
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # 索引与列表查询一一对应，新增索引时同时在 migrations.py 中添加迁移，
+    # 并在 query_plans.py 中登记对应的查询
+    __table_args__ = (
+        # 后台相册列表的默认排序
+        Index("ix_albums_live_order", "sort_order", "updated_at", **live_only(is_deleted)),
+        # API 相册列表的默认排序（不区分是否删除）
+        Index("ix_albums_order", "sort_order", "updated_at"),
+        # 后台相册列表的其他排序方式、首页最近更新的相册
+        Index("ix_albums_live_updated", "updated_at", **live_only(is_deleted)),
+        Index("ix_albums_live_created", "created_at", **live_only(is_deleted)),
+        Index("ix_albums_live_name", "name", **live_only(is_deleted)),
+        # 回收站
+        Index("ix_albums_trash", "deleted_at", **trash_only(is_deleted)),
+    )
 
 
 class Photo(Base):
@@ -51,10 +168,143 @@ class Photo(Base):
     width = Column(Integer, nullable=True)
     height = Column(Integer, nullable=True)
     description = Column(Text, nullable=True)
+    variants = Column(String(100), nullable=True)  # 已生成的衍生版本，逗号分隔
+    variants_version = Column(Integer, nullable=True)  # 衍生图的生成方式（见 derivatives.DERIVATIVES_VERSION）
+    content_sha256 = Column(String(64), nullable=True)  # 原图内容的 SHA-256，对应 blobs 表中的文件
+    content_crc32 = Column(BigInteger, nullable=True)  # 原图内容的 CRC32，打包下载时写入 ZIP 文件头
+    dhash = Column(BigInteger, nullable=True)  # 64 位感知哈希，用于查找相似照片（见 similarity.py）
+    # dhash 的 4 段 16 位，分别建索引，设置 dhash 时自动更新
+    dhash_0 = Column(Integer, nullable=True)
+    dhash_1 = Column(Integer, nullable=True)
+    dhash_2 = Column(Integer, nullable=True)
+    dhash_3 = Column(Integer, nullable=True)
+    # 拍摄信息，入库时从 EXIF 读取（见 image_worker.image_exif），旧照片用 migrate.py backfill-exif 补读
+    taken_at = Column(DateTime, nullable=True)  # 拍摄时间（相机本地时间），没有 EXIF 时为上传时间
+    camera_make = Column(String(100), nullable=True)
+    camera_model = Column(String(100), nullable=True)
+    lens_model = Column(String(100), nullable=True)
+    orientation = Column(Integer, nullable=True)  # EXIF 方向（1~8），为空表示还没有读取过 EXIF
     sort_order = Column(Integer, default=0)  # 自定义排序
     is_deleted = Column(Boolean, default=False)  # 软删除标记
     deleted_at = Column(DateTime, nullable=True)  # 删除时间
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # 相册内照片的默认排序，游标分页按这个顺序定位；也用于按相册统计数量
+        Index("ix_photos_album_order", "album_id", "sort_order", "created_at", "id"),
+        # 相册内照片的其他排序方式
+        Index("ix_photos_album_created", "album_id", "created_at", "id"),
+        Index("ix_photos_album_filename", "album_id", "original_filename", "id"),
+        Index("ix_photos_album_size", "album_id", "file_size", "id"),
+        # 不限相册的照片列表
+        Index("ix_photos_order", "sort_order", "created_at", "id"),
+        # 后台照片管理的排序方式、首页最近上传的照片
+        Index("ix_photos_live_created", "created_at", **live_only(is_deleted)),
+        Index("ix_photos_live_filename", "original_filename", **live_only(is_deleted)),
+        Index("ix_photos_live_size", "file_size", **live_only(is_deleted)),
+        # 回收站
+        Index("ix_photos_trash", "deleted_at", **trash_only(is_deleted)),
+        # 按内容查找照片
+        Index("ix_photos_sha256", "content_sha256"),
+        # 相似照片的多索引哈希查找
+        Index("ix_photos_dhash_0", "dhash_0"),
+        Index("ix_photos_dhash_1", "dhash_1"),
+        Index("ix_photos_dhash_2", "dhash_2"),
+        Index("ix_photos_dhash_3", "dhash_3"),
+        # 按拍摄时间浏览、从时间线跳转到某个月份（见 timeline.py）
+        Index("ix_photos_album_taken", "album_id", "taken_at", "id"),
+        Index("ix_photos_taken", "taken_at", "id"),
+        # 按相机筛选
+        Index("ix_photos_camera", "camera_model", "taken_at", "id"),
+    )
+
+
+class Blob(Base):
+    """
+    按内容去重的照片文件（原图及其衍生图），由 blobs.py 维护
+
+    内容相同的照片共用同一份文件，filename、file_path 与这些照片的字段一致；
+    ref_count 是引用它的照片数（包括回收站中的），降为 0 时删除记录和文件。
+    """
+    __tablename__ = "blobs"
+
+    id = Column(Integer, primary_key=True)
+    content_sha256 = Column(String(64), nullable=False)
+    filename = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)
+    file_size = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    variants = Column(String(100), nullable=True)
+    variants_version = Column(Integer, nullable=True)
+    dhash = Column(BigInteger, nullable=True)
+    taken_at = Column(DateTime, nullable=True)  # EXIF 中的拍摄时间，没有时为空
+    camera_make = Column(String(100), nullable=True)
+    camera_model = Column(String(100), nullable=True)
+    lens_model = Column(String(100), nullable=True)
+    orientation = Column(Integer, nullable=True)
+    ref_count = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_blobs_sha256", "content_sha256", unique=True),
+    )
+
+
+class TimelineBucket(Base):
+    """
+    时间线分组：按拍摄时间的年、月、日统计的照片数量和封面，由 timeline.py 增量维护
+
+    album_id 为 0 的行是整个图库的统计；只统计未删除的照片。
+    """
+    __tablename__ = "timeline_buckets"
+
+    album_id = Column(Integer, primary_key=True)
+    level = Column(String(5), primary_key=True)  # year、month 或 day
+    period = Column(String(10), primary_key=True)  # 如 "2023"、"2023-06"、"2023-06-15"
+    photo_count = Column(Integer, default=0, nullable=False)
+    cover_photo_id = Column(Integer, nullable=True)  # 分组内拍摄时间最晚的照片
+    cover_taken_at = Column(DateTime, nullable=True)
+
+
+class Job(Base):
+    """
+    后台任务（生成衍生图、删除文件等），由 jobs.py 调度执行
+
+    status：pending（等待执行，run_after 之前不会被领取）、running（执行中，
+    locked_until 前由领取它的进程续期）、succeeded、failed（重试次数用完）。
+    dedup_key 相同的任务同一时间只有一个处于 pending 或 running。
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    type = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    dedup_key = Column(String(255), nullable=True)
+    status = Column(String(20), default="pending", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=5, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)  # 最近一次开始执行的时间
+    finished_at = Column(DateTime, nullable=True)
+    progress = Column(Integer, nullable=True)  # 处理函数用 report_progress 报告的已完成数量
+    progress_total = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # 领取任务、统计队列长度
+        Index("ix_jobs_queue", "status", "run_after"),
+        # 去重：只约束未完成的任务，同一个键可以在完成后再次入队
+        Index(
+            "ix_jobs_dedup", "dedup_key", unique=True,
+            sqlite_where=status.in_(("pending", "running")),
+            postgresql_where=status.in_(("pending", "running"))
+        ),
+        # 清理成功的任务、列出最近失败的任务
+        Index("ix_jobs_finished", "status", "finished_at"),
+    )
 
 
 class User(Base):
@@ -78,11 +328,21 @@ async def get_db():
             await session.close()
 
 
+async def get_read_db():
+    """获取只读数据库会话（不会被批量上传等写事务阻塞）"""
+    async with ReadSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
 async def init_db():
     """初始化数据库"""
-    async with engine.begin() as conn:
-        # 创建所有表
-        await conn.run_sync(Base.metadata.create_all)
+    from .migrations import run_migrations
+    
+    # 执行未执行的迁移（新数据库会在基线迁移中创建所有表）
+    await run_migrations(engine)
         
     print("[数据库] 数据库初始化完成")
     
@@ -90,6 +350,16 @@ async def init_db():
     await create_sample_data()
 
 
+async def close_db():
+    """关闭连接池；SQLite 在关闭前执行 PRAGMA optimize 更新查询规划器的统计信息"""
+    if is_sqlite:
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("PRAGMA optimize")
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+
 async def create_sample_data():
     """创建示例数据"""
     async with AsyncSessionLocal() as session:
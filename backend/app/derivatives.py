@@ -0,0 +1,155 @@
+"""
+图片衍生版本（缩略图、预览图及其 WebP 副本）的规格与命名，以及上传目录的布局
+
+每张照片在入库时按这里的规格生成衍生图，生成了哪些版本记录在 Photo.variants 中，
+展示层据此直接拼出 URL，无需再去探测文件系统。
+
+上传目录按文件名分片存放（如 uploads/ab/cd/<uuid>.jpg），避免单个目录下有几百万
+个文件。衍生图与原图放在同一个目录，照片的实际位置以 Photo.file_path 为准：
+旧照片在迁移（python migrate.py shard-uploads）完成前仍在 uploads/ 根目录，
+下面的函数对两种布局都适用。
+"""
+import hashlib
+import os
+import re
+from typing import List, Optional, Set, Tuple
+
+from .config import settings
+from .storage import get_storage
+
+# 版本名 -> 文件名前缀
+VARIANT_PREFIXES = {
+    "thumb": "thumb_",
+    "preview": "preview_",
+}
+
+# 旧数据没有 variants 记录，入库时只生成过缩略图
+LEGACY_VARIANTS = {"thumb"}
+
+# 衍生图的生成方式，记录在 Photo.variants_version 中；改变生成方式时加一，
+# migrate.py backfill-variants 重新生成版本较旧的照片。
+# 1（或为空）：旧版本，没有按 EXIF 方向转正；2：按 EXIF 方向转正后缩小
+DERIVATIVES_VERSION = 2
+
+
+def variant_specs() -> List[Tuple[str, int, Optional[str]]]:
+    """
+    按配置返回需要生成的版本列表 [(版本名, 最长边, 输出格式)]
+
+    输出格式为 None 表示沿用原图格式。列表按尺寸从大到小排列，
+    这样小尺寸版本可以从上一个版本继续缩放，减少重复计算。
+    """
+    specs = []
+    for variant, size in (("preview", settings.preview_size), ("thumb", settings.thumbnail_size)):
+        specs.append((variant, size, None))
+        if settings.generate_webp:
+            specs.append((f"{variant}_webp", size, "WEBP"))
+    return specs
+
+
+def variant_filename(filename: str, variant: str) -> str:
+    """返回某个版本的文件名，如 thumb_xxx.jpg、preview_xxx.webp"""
+    if variant.endswith("_webp"):
+        base_variant = variant[:-len("_webp")]
+        stem = os.path.splitext(filename)[0]
+        return f"{VARIANT_PREFIXES[base_variant]}{stem}.webp"
+    return f"{VARIANT_PREFIXES[variant]}{filename}"
+
+
+def all_variant_filenames(filename: str) -> List[str]:
+    """返回一张照片所有可能存在的衍生图文件名（用于删除）"""
+    names = []
+    for variant in VARIANT_PREFIXES:
+        names.append(variant_filename(filename, variant))
+        names.append(variant_filename(filename, f"{variant}_webp"))
+    return names
+
+
+def parse_variants(value: Optional[str]) -> Set[str]:
+    """解析 Photo.variants 字段"""
+    if value is None:
+        return set(LEGACY_VARIANTS)
+    return {item for item in value.split(",") if item}
+
+
+def format_variants(variants) -> str:
+    return ",".join(sorted(variants))
+
+
+# ---------- 上传目录布局 ----------
+
+HEX_NAME = re.compile(r"^[0-9a-f]+$")
+
+
+def base_filename(name: str) -> str:
+    """去掉衍生图前缀，返回原图文件名的主干（thumb_<uuid>.webp -> <uuid>）"""
+    for prefix in VARIANT_PREFIXES.values():
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    return os.path.splitext(name)[0]
+
+
+def shard_dir(filename: str, depth: Optional[int] = None) -> str:
+    """
+    按当前配置返回文件应在的分片子目录（相对上传目录），如 "ab/cd"
+
+    UUID 文件名直接取前几位十六进制字符，其他文件名取 MD5；原图和它的衍生图
+    得到同一个目录。upload_shard_depth 为 0 时返回空字符串（平铺）。
+    """
+    depth = settings.upload_shard_depth if depth is None else depth
+    key = base_filename(filename).replace("-", "").lower()
+    if len(key) < depth * 2 or not HEX_NAME.match(key):
+        key = hashlib.md5(key.encode()).hexdigest()
+    return "/".join(key[level * 2:level * 2 + 2] for level in range(depth))
+
+
+def layout_path(filename: str) -> str:
+    """按当前配置的布局，文件应在的路径"""
+    parts = [part for part in shard_dir(filename).split("/") if part]
+    return os.path.join(settings.upload_dir, *parts, filename)
+
+
+def new_file_path(filename: str) -> str:
+    """新上传文件的存放路径，会创建所在目录"""
+    file_path = layout_path(filename)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    return file_path
+
+
+def photo_file_path(photo, variant: Optional[str] = None) -> str:
+    """照片原图或某个衍生版本的磁盘路径"""
+    if variant is None:
+        return photo.file_path
+    return os.path.join(os.path.dirname(photo.file_path), variant_filename(photo.filename, variant))
+
+
+def photo_file_paths(photo) -> List[str]:
+    """照片原图和所有可能存在的衍生图的磁盘路径（用于删除）"""
+    directory = os.path.dirname(photo.file_path)
+    return [photo.file_path] + [os.path.join(directory, name) for name in all_variant_filenames(photo.filename)]
+
+
+def storage_key(file_path: str) -> str:
+    """本地路径对应的存储键（相对上传目录的路径，如 ab/cd/<uuid>.jpg）"""
+    return os.path.relpath(file_path, settings.upload_dir).replace(os.sep, "/")
+
+
+def photo_key(photo, variant: Optional[str] = None) -> str:
+    """照片原图或某个衍生版本的存储键"""
+    return storage_key(photo_file_path(photo, variant))
+
+
+def photo_keys(photo) -> List[str]:
+    """照片原图和所有可能存在的衍生图的存储键（用于删除）"""
+    return [storage_key(path) for path in photo_file_paths(photo)]
+
+
+def photo_url_path(photo, variant: Optional[str] = None) -> str:
+    """
+    照片原图或某个衍生版本的访问地址
+
+    本地存储为 /uploads/ab/cd/thumb_<uuid>.jpg 这样的路径，对象存储配置了公开地址时
+    为完整 URL。
+    """
+    return get_storage().url(photo_key(photo, variant))
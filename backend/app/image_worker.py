@@ -0,0 +1,285 @@
+"""
+图片处理进程池
+
+Pillow 的解码、缩放和编码都是 CPU 密集的同步操作，直接在 async 路由里调用会卡住
+整个事件循环。这里把它们放到独立的进程池中执行，并按估算的解码内存做准入控制，
+避免多张大图同时解码把内存撑爆。
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageOps
+
+from .config import settings
+from .derivatives import variant_specs, variant_filename
+
+
+# ---------- 以下函数在子进程中执行，必须是模块级函数 ----------
+
+def image_dhash(img: Image.Image) -> int:
+    """
+    64 位 dHash：缩成 9x8 灰度图，逐行比较相邻像素的亮度
+
+    返回有符号整数（数据库 BIGINT 的范围），相似照片的查找见 similarity.py。
+    """
+    small = img.convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def file_dhash(file_path: str) -> int:
+    with Image.open(file_path) as img:
+        img.draft("L", (64, 64))
+        return image_dhash(img)
+
+
+# EXIF 标签
+EXIF_IFD = 0x8769
+TAG_MAKE = 271
+TAG_MODEL = 272
+TAG_ORIENTATION = 274
+TAG_DATETIME = 306
+TAG_DATETIME_ORIGINAL = 36867
+TAG_LENS_MODEL = 42036
+
+
+def exif_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore")
+    text = str(value).replace("\x00", "").strip()
+    return text[:100] or None
+
+
+def exif_datetime(value) -> Optional[datetime]:
+    """解析 "2023:06:15 14:30:00"；相机未设置时间时常写成全 0，按没有处理"""
+    text = exif_text(value)
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def image_exif(img: Image.Image) -> Dict:
+    """
+    读取拍摄时间、相机、镜头和方向，返回照片的 taken_at、camera_make、camera_model、
+    lens_model、orientation 字段
+
+    拍摄时间优先取 DateTimeOriginal，没有时取 DateTime；没有 EXIF 的图片方向为 1（正常）。
+    """
+    exif = img.getexif()
+    details = exif.get_ifd(EXIF_IFD)
+    orientation = exif.get(TAG_ORIENTATION)
+    return {
+        "taken_at": exif_datetime(details.get(TAG_DATETIME_ORIGINAL)) or exif_datetime(exif.get(TAG_DATETIME)),
+        "camera_make": exif_text(exif.get(TAG_MAKE)),
+        "camera_model": exif_text(exif.get(TAG_MODEL)),
+        "lens_model": exif_text(details.get(TAG_LENS_MODEL)),
+        "orientation": orientation if isinstance(orientation, int) and 1 <= orientation <= 8 else 1,
+    }
+
+
+def file_exif(file_path: str) -> Dict:
+    with Image.open(file_path) as img:
+        return image_exif(img)
+
+
+def file_info(file_path: str) -> Dict:
+    """只读取文件头得到的照片字段：width、height 和拍摄信息（不解码图像，入库时同步读取）"""
+    with Image.open(file_path) as img:
+        width, height = img.size
+        return {"width": width, "height": height, **image_exif(img)}
+
+
+def generate_derivatives(file_path: str, outputs: List[Tuple[str, str, int, Optional[str]]]) -> Tuple[List[str], Dict]:
+    """
+    解码一次原图，依次生成各个衍生版本，返回 (实际生成的版本列表, 照片字段)
+
+    照片字段包括 width、height、dhash 以及 image_exif 读取的拍摄信息。
+    衍生图按 EXIF 方向转正后再缩小（保存时不带 EXIF，浏览器无法再据此旋转）；
+    width、height 仍是原图存储的尺寸。
+    outputs 为 [(版本名, 输出路径, 最长边, 输出格式)]，需按尺寸从大到小排列，
+    每个版本都在上一个版本的基础上继续缩小。原图不超过目标尺寸时不生成预览图，
+    直接使用原图；缩略图总是生成。dHash 在最后缩小到的缩略图上计算。
+    """
+    produced = []
+    with Image.open(file_path) as img:
+        width, height = img.size
+        fields = {"width": width, "height": height, **image_exif(img)}
+        # 转正后得到新的图像，方向标签在此之前已经读入 fields
+        if fields["orientation"] != 1:
+            img = ImageOps.exif_transpose(img)
+        for variant, output_path, size, output_format in outputs:
+            if not variant.startswith("thumb") and max(width, height) <= size:
+                continue
+
+            if max(img.size) > size:
+                img.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+            if output_format == "WEBP":
+                frame = img if img.mode in ("RGB", "RGBA") else img.convert("RGBA")
+                frame.save(output_path, "WEBP", quality=80, method=4)
+            else:
+                img.save(output_path, optimize=True, quality=85)
+            produced.append(variant)
+
+        fields["dhash"] = image_dhash(img)
+
+    return produced, fields
+
+
+def render_image(source_path: str, output_path: str, width: int, height: int, fit: str, output_format: str):
+    """
+    把原图缩放到 width x height 写入 output_path
+
+    fit 为 contain 时等比缩放到框内（不放大），为 cover 时等比缩放后居中裁剪，
+    输出尺寸正好是 width x height。带 EXIF 方向的原图先转正再缩放。
+    """
+    with Image.open(source_path) as img:
+        orientation = img.getexif().get(TAG_ORIENTATION, 1)
+        # 方向为 5~8 时转正后宽高互换，按转正前的宽高请求缩小解码
+        draft_size = (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+        # JPEG 解码时直接按 1/2、1/4、1/8 缩小，大图可以省下大部分解码时间和内存
+        img.draft("RGB", draft_size)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        if fit == "cover":
+            img = ImageOps.fit(img, (width, height), Image.Resampling.LANCZOS)
+        else:
+            img.thumbnail((width, height), Image.Resampling.LANCZOS)
+
+        if output_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif output_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        elif output_format == "PNG" and img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+
+        if output_format == "WEBP":
+            img.save(output_path, "WEBP", quality=80, method=4)
+        else:
+            img.save(output_path, output_format, optimize=True, quality=85)
+
+
+# ---------- 以下在主进程中执行 ----------
+
+def estimate_decode_bytes(file_path: str) -> int:
+    """只读取图片头估算解码后占用的内存"""
+    try:
+        with Image.open(file_path) as img:
+            width, height = img.size
+            bands = len(img.getbands())
+        # 缩放时会同时持有原图和中间结果，按两倍估算
+        return width * height * max(bands, 3) * 2
+    except Exception:
+        return os.path.getsize(file_path) * 10
+
+
+class MemoryBudget:
+    """按字节数计量的异步准入控制"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, amount: int) -> int:
+        # 单个超大任务也要能执行，只是需要独占全部额度
+        amount = min(amount, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use + amount <= self.limit)
+            self.in_use += amount
+        return amount
+
+    async def release(self, amount: int):
+        async with self._condition:
+            self.in_use -= amount
+            self._condition.notify_all()
+
+
+class ImageWorker:
+    """图片处理执行器"""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._budget: Optional[MemoryBudget] = None
+
+    @property
+    def max_workers(self) -> int:
+        return settings.image_workers or os.cpu_count() or 1
+
+    def start(self):
+        """启动进程池（重复调用无副作用）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            self._budget = MemoryBudget(settings.image_memory_budget)
+            print(f"[图片] 图片处理进程池已启动，进程数: {self.max_workers}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._budget = None
+
+    async def run(self, cost: int, func, *args):
+        """在进程池中执行 func，执行前先申请 cost 字节的内存额度"""
+        self.start()
+        granted = await self._budget.acquire(cost)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            await self._budget.release(granted)
+
+    async def make_derivatives(
+        self, file_path: str, filename: str, source_path: Optional[str] = None
+    ) -> Tuple[List[str], Dict]:
+        """
+        按配置生成全部衍生版本，返回 (生成的版本列表, 照片字段)，见 generate_derivatives
+
+        衍生图写在 file_path 所在的目录；原图已在对象存储中时，source_path 是下载到本地的副本。
+        """
+        source_path = source_path or file_path
+        directory = os.path.dirname(file_path)
+        outputs = [
+            (variant, os.path.join(directory, variant_filename(filename, variant)), size, output_format)
+            for variant, size, output_format in variant_specs()
+        ]
+        cost = await run_in_threadpool(estimate_decode_bytes, source_path)
+        return await self.run(cost, generate_derivatives, source_path, outputs)
+
+    async def dhash(self, file_path: str) -> int:
+        """计算已有图片的 dHash（旧照片补算时用缩略图即可）"""
+        cost = await run_in_threadpool(estimate_decode_bytes, file_path)
+        return await self.run(cost, file_dhash, file_path)
+
+    async def exif(self, file_path: str) -> Dict:
+        """读取已有图片的拍摄信息（只解析文件头，不解码图像）"""
+        return await self.run(0, file_exif, file_path)
+
+    async def info(self, file_path: str) -> Dict:
+        """读取新上传图片的尺寸和拍摄信息（只解析文件头，见 file_info）"""
+        return await self.run(0, file_info, file_path)
+
+    async def render(self, source_path: str, output_path: str, width: int, height: int, fit: str, output_format: str):
+        """按指定尺寸渲染一张图片"""
+        cost = await run_in_threadpool(estimate_decode_bytes, source_path)
+        await self.run(cost, render_image, source_path, output_path, width, height, fit, output_format)
+
+
+image_worker = ImageWorker()
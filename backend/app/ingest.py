@@ -0,0 +1,425 @@
+"""
+照片入库流程
+
+单张上传、批量上传和管理后台上传共用这里的逻辑：流式写盘、读取尺寸和拍摄信息、
+创建 Photo 记录。批量入库时多个文件并发处理，最后一次性提交数据库。
+
+入库时只读取图片文件头，不解码图像；缩略图、预览图和感知哈希由与照片在同一个
+事务中入队的 derivatives 任务在后台生成（见 jobs.py），生成前照片的 variants 为空、
+展示原图。永久删除照片后的文件删除同样由 delete_files 任务完成。
+
+写盘时同时计算内容的 SHA-256 和 CRC32，与已入库的照片内容相同时不再保存和处理，
+新照片共用已有的文件（见 blobs.py）；CRC32 用于打包下载相册时预先写出 ZIP 文件头
+（见 album_zip.py）。
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import AsyncSessionLocal, ReadSessionLocal, Blob, Photo
+from .derivatives import (
+    DERIVATIVES_VERSION, format_variants, new_file_path, photo_file_paths, photo_keys, storage_key, variant_filename
+)
+from .storage import get_storage
+from .album_stats import photos_added
+from .blobs import FILE_FIELDS, find_blob, stored_filenames, attach_blobs
+from .similarity import dhash_columns
+from .album_versions import touch_albums
+from .image_worker import image_worker
+from .jobs import enqueue, job_handler
+from .render_cache import render_cache
+
+# 衍生图还没有生成的照片的 variants
+PENDING_VARIANTS = ""
+
+
+def validate_file(file: UploadFile) -> None:
+    """验证上传文件"""
+    # 检查文件大小
+    if file.size and file.size > settings.max_file_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"文件大小超过限制 ({settings.max_file_size / 1024 / 1024}MB)"
+        )
+    
+    # 检查文件扩展名
+    if file.filename:
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        if file_ext not in settings.allowed_extensions:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"不支持的文件类型。支持的类型: {', '.join(settings.allowed_extensions)}"
+            )
+
+
+async def stream_upload_to_path(file: UploadFile, file_path: str) -> Tuple[int, str, int]:
+    """
+    以固定大小的块把上传内容写入磁盘，返回 (文件大小, SHA-256, CRC32)
+
+    数据先写入同目录下的临时文件，边写边校验大小并增量计算哈希，
+    全部写完后再原子重命名为目标文件，因此单个上传占用的内存与文件大小无关。
+    """
+    temp_path = os.path.join(
+        os.path.dirname(file_path),
+        f".{os.path.basename(file_path)}.part"
+    )
+    sha256 = hashlib.sha256()
+    crc32 = 0
+    file_size = 0
+
+    buffer = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(settings.upload_chunk_size)
+            if not chunk:
+                break
+
+            file_size += len(chunk)
+            if file_size > settings.max_file_size:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"文件大小超过限制 ({settings.max_file_size / 1024 / 1024}MB)"
+                )
+
+            sha256.update(chunk)
+            crc32 = zlib.crc32(chunk, crc32)
+            await run_in_threadpool(buffer.write, chunk)
+
+        await run_in_threadpool(buffer.close)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        buffer.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return file_size, sha256.hexdigest(), crc32
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(settings.upload_chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def file_digests(path: str) -> Tuple[str, int]:
+    """读取一遍文件，返回 (SHA-256, CRC32)"""
+    sha256 = hashlib.sha256()
+    crc32 = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(settings.upload_chunk_size), b""):
+            sha256.update(chunk)
+            crc32 = zlib.crc32(chunk, crc32)
+    return sha256.hexdigest(), crc32
+
+
+def new_upload_path(original_filename: str) -> Tuple[str, str]:
+    """为新照片生成唯一文件名，返回 (文件名, 路径)"""
+    file_ext = os.path.splitext(original_filename)[1].lower()
+    filename = f"{uuid.uuid4()}{file_ext}"
+    # 按文件名放入分片子目录（目录不存在时自动创建）
+    file_path = new_file_path(filename)
+    
+    return filename, file_path
+
+
+async def process_saved_file(filename: str, file_path: str, original_stored: bool = False) -> Dict:
+    """
+    读取已写入上传目录的原图的尺寸和拍摄信息并交给存储后端，返回照片的 width、height、
+    variants、dhash 以及拍摄信息字段（见 image_worker.file_info）
+
+    衍生图和 dhash 由 add_photos 入队的 derivatives 任务生成，这里 variants 为
+    PENDING_VARIANTS、dhash 为空。original_stored 为 True 表示原图已经在存储后端中
+    （客户端直传），原图的本地副本直接删除。
+    """
+    # 只解析文件头，不解码图像；无法识别的图片不生成衍生图，直接展示原图
+    fields = {"width": None, "height": None}
+    try:
+        fields = await image_worker.info(file_path)
+    except Exception as e:
+        print(f"读取图片信息时出错: {e}")
+    
+    # 本地存储什么都不用做；对象存储上传原图后删除本地副本
+    storage = get_storage()
+    if not original_stored:
+        await storage.publish([storage_key(file_path)])
+    elif not storage.is_local:
+        await run_in_threadpool(remove_local_files, [file_path])
+    
+    return {**fields, "dhash": None, "variants": PENDING_VARIANTS}
+
+
+async def process_or_reuse(
+    filename: str, file_path: str, file_size: int, content_sha256: str, content_crc32: int,
+    original_stored: bool = False
+) -> Dict:
+    """
+    处理刚写入上传目录的原图，返回新照片中与文件有关的字段（blobs.FILE_FIELDS 及 content_sha256、
+    content_crc32）
+
+    内容与已入库的文件相同时删除刚写入的文件（original_stored 时连同存储后端中
+    直传的原图），返回已有文件的信息。
+    """
+    blob = await find_blob(content_sha256)
+    if blob is not None:
+        # 删除文件也放到线程池中执行，不阻塞事件循环
+        await run_in_threadpool(os.remove, file_path)
+        if original_stored:
+            await get_storage().delete(storage_key(file_path))
+        fields = {field: getattr(blob, field) for field in FILE_FIELDS}
+    else:
+        fields = {"filename": filename, "file_path": file_path, "file_size": file_size}
+        fields.update(await process_saved_file(filename, file_path, original_stored))
+    fields["content_sha256"] = content_sha256
+    fields["content_crc32"] = content_crc32
+    return fields
+
+
+async def save_uploaded_file(file: UploadFile) -> Dict:
+    """保存上传的文件并生成衍生图，返回新照片中与文件有关的字段"""
+    filename, file_path = new_upload_path(file.filename)
+    
+    # 分块流式保存文件，同时计算哈希
+    file_size, content_sha256, content_crc32 = await stream_upload_to_path(file, file_path)
+    
+    return await process_or_reuse(filename, file_path, file_size, content_sha256, content_crc32)
+
+
+async def import_local_file(source_path: str, original_filename: str) -> Dict:
+    """
+    把磁盘上已完整的文件（如断点续传会话的数据文件）移入上传目录并生成衍生图，
+    返回值与 save_uploaded_file 相同
+    """
+    filename, file_path = new_upload_path(original_filename)
+    await run_in_threadpool(shutil.move, source_path, file_path)
+    file_size = os.path.getsize(file_path)
+    content_sha256, content_crc32 = await run_in_threadpool(file_digests, file_path)
+    
+    return await process_or_reuse(filename, file_path, file_size, content_sha256, content_crc32)
+
+
+async def add_photos(db: AsyncSession, photos: List[Photo]) -> List[Photo]:
+    """
+    把新照片加入会话，登记文件引用并更新相册统计（在 commit 之前调用）
+
+    返回并发上传相同内容时多写的文件，提交后用 delete_photo_files 删除。
+    """
+    db.add_all(photos)
+    duplicates = await attach_blobs(db, photos)
+    await photos_added(db, photos)
+    await enqueue_derivatives(db, photos)
+    return duplicates
+
+
+async def enqueue_derivatives(db: AsyncSession, photos: List[Photo]):
+    """为衍生图还没有生成的照片入队 derivatives 任务，共用同一份文件的照片只入队一次"""
+    for photo in photos:
+        if photo.variants == PENDING_VARIANTS and photo.width is not None and photo.content_sha256:
+            await enqueue(
+                db, "derivatives",
+                {"filename": photo.filename, "file_path": photo.file_path, "content_sha256": photo.content_sha256},
+                dedup_key=f"derivatives:{photo.filename}"
+            )
+
+
+@job_handler("derivatives", concurrency=lambda: image_worker.max_workers)
+async def generate_derivatives_job(payload: Dict):
+    """
+    生成一份文件的衍生图和 dhash，写回共用这份文件的所有照片和 blobs 记录
+
+    文件在此之前已被永久删除时不做处理；生成期间被删除时删掉刚生成的衍生图。
+    """
+    filename, file_path = payload["filename"], payload["file_path"]
+    if not await file_in_use(payload):
+        return
+
+    storage = get_storage()
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    async with storage.open_local(storage_key(file_path)) as source_path:
+        variants, fields = await image_worker.make_derivatives(file_path, filename, source_path)
+    keys = [storage_key(os.path.join(directory, variant_filename(filename, variant))) for variant in variants]
+    await storage.publish(keys)
+
+    # 用 update() 语句写回：生成期间照片被永久删除时只是更新不到行，不会报错
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Photo)
+            .where(Photo.content_sha256 == payload["content_sha256"], Photo.filename == filename)
+            .values(
+                variants=format_variants(variants), variants_version=DERIVATIVES_VERSION,
+                **dhash_columns(fields["dhash"])
+            )
+            .returning(Photo.album_id)
+            .execution_options(synchronize_session=False)
+        )
+        album_ids = set(result.scalars().all())
+        if not album_ids:
+            await db.rollback()
+            await remove_files([os.path.join(directory, variant_filename(filename, v)) for v in variants], keys)
+            return
+        await db.execute(
+            update(Blob)
+            .where(Blob.content_sha256 == payload["content_sha256"], Blob.filename == filename)
+            .values(variants=format_variants(variants), variants_version=DERIVATIVES_VERSION, dhash=fields["dhash"])
+        )
+        touch_albums(db, album_ids)
+        await db.commit()
+
+
+async def file_in_use(payload: Dict) -> bool:
+    """是否还有照片使用 payload 中的文件（按内容哈希查找，走 ix_photos_sha256）"""
+    async with ReadSessionLocal() as session:
+        result = await session.execute(
+            select(Photo.id).where(
+                Photo.content_sha256 == payload["content_sha256"], Photo.filename == payload["filename"]
+            ).limit(1)
+        )
+        return result.first() is not None
+
+
+# 批次ID -> 进度，只保留最近的若干个批次
+batch_progress: "OrderedDict[str, Dict]" = OrderedDict()
+MAX_TRACKED_BATCHES = 200
+
+
+def start_batch(batch_id: Optional[str], files: List[UploadFile]) -> Dict:
+    """登记一个批次并返回其进度记录"""
+    progress = {
+        "batch_id": batch_id or uuid.uuid4().hex,
+        "status": "processing",
+        "total": len(files),
+        "processed": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "files": [{"filename": file.filename, "status": "pending"} for file in files]
+    }
+    batch_progress[progress["batch_id"]] = progress
+    while len(batch_progress) > MAX_TRACKED_BATCHES:
+        batch_progress.popitem(last=False)
+    return progress
+
+
+def remove_local_files(paths: List[str]):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def remove_files(paths: List[str], keys: List[str]):
+    """删除本地文件（在线程池中执行）和对象存储中的对象"""
+    storage = get_storage()
+    # 本地存储的文件，或对象存储尚未上传的暂存文件
+    await run_in_threadpool(remove_local_files, paths)
+    if not storage.is_local and keys:
+        await storage.delete_many(keys)
+
+
+async def delete_photo_files(photos: List[Photo]):
+    """删除照片的原图及衍生图（入库失败时清理、删除并发上传多写的文件时调用）"""
+    paths, keys = [], []
+    for photo in photos:
+        paths.extend(photo_file_paths(photo))
+        keys.extend(photo_keys(photo))
+    await remove_files(paths, keys)
+
+
+async def enqueue_file_deletion(db: AsyncSession, photos: List[Photo]):
+    """
+    永久删除照片后入队 delete_files 任务删除文件和渲染缓存（在 commit 之前调用，
+    photos 为 release_blobs 返回的不再被引用的文件）
+    """
+    if photos:
+        files = [[photo.filename, photo.file_path, photo.content_sha256] for photo in photos]
+        await enqueue(db, "delete_files", {"files": files})
+
+
+@job_handler("delete_files", concurrency=2)
+async def delete_files_job(payload: Dict):
+    photos = [
+        # 升级前入队的任务没有内容哈希
+        Photo(filename=entry[0], file_path=entry[1], content_sha256=entry[2] if len(entry) > 2 else None)
+        for entry in payload["files"]
+    ]
+    # 释放引用之前 find_blob 读到了这份文件的上传会重新登记它（attach_blobs），
+    # 文件又有照片在用，不能删除；判断方式与 discard_new_files 相同
+    in_use = await stored_filenames(photo.content_sha256 for photo in photos)
+    skipped = [photo.filename for photo in photos if photo.filename in in_use]
+    if skipped:
+        print(f"[删除文件] 跳过重新被引用的文件: {', '.join(skipped)}")
+    photos = [photo for photo in photos if photo.filename not in in_use]
+    await delete_photo_files(photos)
+    for photo in photos:
+        render_cache.discard_photo(photo.filename)
+
+
+async def discard_new_files(photos: List[Photo]):
+    """入库失败时删除新写入的文件，与已入库照片共用的文件保留"""
+    shared = await stored_filenames(photo.content_sha256 for photo in photos)
+    await delete_photo_files([photo for photo in photos if photo.filename not in shared])
+
+
+async def ingest_files(
+    db: AsyncSession,
+    album_id: int,
+    files: List[UploadFile],
+    batch_id: Optional[str] = None
+) -> Tuple[List[Photo], Dict]:
+    """
+    并发处理一批上传文件并一次性写入数据库，返回 (新照片列表, 批次进度)
+
+    同时处理的文件数受 ingest_concurrency 限制，默认为图片处理进程数的两倍，
+    这样一部分文件在写盘时，另一部分正在子进程中解码，CPU 和磁盘都不会闲着。
+    每个文件处理完后立即更新批次进度，可通过 batch_id 查询。
+    """
+    progress = start_batch(batch_id, files)
+    semaphore = asyncio.Semaphore(settings.ingest_concurrency or image_worker.max_workers * 2)
+    photos: List[Optional[Photo]] = [None] * len(files)
+
+    async def ingest_one(index: int, file: UploadFile):
+        async with semaphore:
+            try:
+                validate_file(file)
+                fields = await save_uploaded_file(file)
+                photos[index] = Photo(album_id=album_id, original_filename=file.filename, **fields)
+                progress["files"][index] = {"filename": file.filename, "status": "success"}
+                progress["succeeded"] += 1
+            except Exception as e:
+                progress["files"][index] = {
+                    "filename": file.filename,
+                    "status": "failed",
+                    "error": e.detail if isinstance(e, HTTPException) else str(e)
+                }
+                progress["failed"] += 1
+            progress["processed"] += 1
+
+    await asyncio.gather(*(ingest_one(index, file) for index, file in enumerate(files)))
+
+    # 按上传顺序一次性写入，SQLAlchemy 会把同一张表的插入合并为批量 INSERT
+    new_photos = [photo for photo in photos if photo is not None]
+    duplicates = []
+    try:
+        duplicates = await add_photos(db, new_photos)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await discard_new_files(new_photos + duplicates)
+        progress["status"] = "failed"
+        raise
+
+    await delete_photo_files(duplicates)
+    progress["status"] = "completed"
+    return new_photos, progress
@@ -0,0 +1,535 @@
+"""
+持久化的后台任务队列
+
+生成衍生图、删除文件这类耗时的工作不在请求里完成：请求处理函数在自己的事务中
+调用 enqueue 写入 jobs 表，提交后立即返回，由本进程（或其他开启了 jobs_enabled 的
+进程）中的 JobQueue 领取执行。任务和业务数据在同一个事务中提交，不会出现数据已经
+写入、任务却丢失的情况。
+
+- 注册：@job_handler("类型", concurrency=同时执行数) 装饰一个 async def handler(payload)，
+  payload 是入队时的字典（以 JSON 保存）。按类型限制并发，例如生成衍生图不超过图片
+  处理进程数，不会因为一次批量上传占满所有执行槽
+- 去重：入队时指定 dedup_key，同一个键已有未完成的任务时不再入队（唯一部分索引
+  ix_jobs_dedup + ON CONFLICT DO NOTHING）
+- 重试：handler 抛出异常时按指数退避重新排队（job_retry_base_seconds * 2^(n-1)，
+  不超过 job_retry_max_seconds），job_max_attempts 次后标记为 failed，可以在管理后台重试
+- 崩溃恢复：领取时写入租期 locked_until，执行期间定时续期；进程崩溃后租期过期的
+  任务在下次维护（包括启动时）重新排队。正常关闭时等待执行中的任务完成，超时的
+  直接放回队列
+- 唤醒：本进程提交了新任务后立即唤醒执行循环，其他进程入队的任务每隔
+  job_poll_interval 秒检查一次
+- 进度：耗时较长的处理函数调用 report_progress(已完成, 总数) 写入 jobs 表，
+  页面用 GET /admin/jobs/{id} 轮询显示
+- 定时任务：@on_maintenance 注册的函数在每次维护时调用，用来按时间入队任务
+  （例如按保留期限清理回收站），多个进程同时入队时由 dedup_key 去重
+
+队列长度、等待时间和执行耗时由 stats() 汇总，显示在管理后台首页。
+"""
+import asyncio
+import json
+import time
+import traceback
+from contextvars import ContextVar
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import and_, delete, event, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from .config import settings
+from .database import AsyncSessionLocal, Job
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATUSES = (PENDING, RUNNING)
+
+# 维护（重新排队租期过期的任务、清理旧记录）的间隔
+MAINTENANCE_INTERVAL = 60
+
+# 关闭时等待执行中的任务完成的秒数
+SHUTDOWN_GRACE = 10
+
+# 每种任务保留最近多少次执行的耗时，用于统计
+LATENCY_SAMPLES = 500
+
+# session.info 中记录本事务是否入队了任务
+ENQUEUED_KEY = "jobs_enqueued"
+
+Handler = Callable[[Dict], Awaitable[None]]
+
+# 任务类型 -> (处理函数, 同时执行数)
+_handlers: Dict[str, Tuple[Handler, Union[int, Callable[[], int]]]] = {}
+
+# 每次维护时调用的函数
+_maintenance_hooks: List[Callable[[], Awaitable[None]]] = []
+
+# 当前 asyncio 任务正在执行的后台任务 ID，供 report_progress 使用
+_current_job: ContextVar[Optional[int]] = ContextVar("current_job", default=None)
+
+
+def job_handler(job_type: str, concurrency: Union[int, Callable[[], int]] = 1):
+    """注册任务类型的处理函数；concurrency 可以是函数，启动时再取值"""
+    def decorator(func: Handler) -> Handler:
+        _handlers[job_type] = (func, concurrency)
+        return func
+    return decorator
+
+
+def on_maintenance(func: Callable[[], Awaitable[None]]) -> Callable[[], Awaitable[None]]:
+    """注册在每次维护（约每 MAINTENANCE_INTERVAL 秒，以及 run-jobs 开始时）调用的函数"""
+    _maintenance_hooks.append(func)
+    return func
+
+
+def type_concurrency(job_type: str) -> int:
+    if job_type in settings.job_concurrency:
+        return max(settings.job_concurrency[job_type], 1)
+    concurrency = _handlers[job_type][1]
+    return max(concurrency() if callable(concurrency) else concurrency, 1)
+
+
+def retry_delay(attempts: int) -> float:
+    """第 attempts 次失败后等待的秒数"""
+    return min(settings.job_retry_base_seconds * 2 ** max(attempts - 1, 0), settings.job_retry_max_seconds)
+
+
+async def enqueue(
+    db: AsyncSession, job_type: str, payload: Dict,
+    dedup_key: Optional[str] = None, delay: float = 0, max_attempts: Optional[int] = None
+):
+    """
+    把任务写入当前事务（在 commit 之前调用），提交后唤醒本进程的执行循环
+
+    dedup_key 相同的任务还没有执行完时不再入队。
+    """
+    if job_type not in _handlers:
+        raise ValueError(f"未注册的任务类型: {job_type}")
+    now = datetime.utcnow()
+    values = {
+        "type": job_type,
+        "payload": json.dumps(payload, ensure_ascii=False),
+        "dedup_key": dedup_key,
+        "status": PENDING,
+        "attempts": 0,
+        "max_attempts": max_attempts or settings.job_max_attempts,
+        "run_after": now + timedelta(seconds=delay),
+        "created_at": now,
+    }
+    insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    statement = insert(Job).values(**values)
+    if dedup_key is not None:
+        statement = statement.on_conflict_do_nothing(
+            index_elements=[Job.dedup_key], index_where=Job.status.in_(ACTIVE_STATUSES)
+        )
+    await db.execute(statement)
+    db.sync_session.info[ENQUEUED_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session):
+    if session.info.pop(ENQUEUED_KEY, False):
+        job_queue.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_enqueued(session: Session):
+    session.info.pop(ENQUEUED_KEY, None)
+
+
+async def report_progress(done: int, total: Optional[int] = None):
+    """在处理函数中报告进度；不在后台任务中调用时忽略"""
+    job_id = _current_job.get()
+    if job_id is None:
+        return
+    values = {"progress": done}
+    if total is not None:
+        values["progress_total"] = total
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Job).where(Job.id == job_id, Job.status == RUNNING).values(**values))
+        await db.commit()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class JobQueue:
+    """在当前事件循环中领取并执行任务"""
+
+    def __init__(self):
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wake_event: Optional[asyncio.Event] = None
+        self._stopping = False
+        # 本进程执行中的任务 ID -> asyncio 任务
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._running: Dict[str, int] = defaultdict(int)
+        # 任务类型 -> 最近若干次 (等待秒数, 执行秒数)
+        self._latencies: Dict[str, Deque[Tuple[float, float]]] = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    # ---------- 启动与关闭 ----------
+
+    async def start(self):
+        """启动执行循环（jobs_enabled 为 False 时只入队不执行）"""
+        if not settings.jobs_enabled or self._loop_task is not None:
+            return
+        self._stopping = False
+        self._wake_event = asyncio.Event()
+        recovered = await self.requeue_expired()
+        if recovered:
+            print(f"[任务] 重新排队了 {recovered} 个中断的任务")
+        self._loop_task = asyncio.create_task(self._run_loop())
+        limits = ", ".join(f"{job_type}={type_concurrency(job_type)}" for job_type in sorted(_handlers))
+        print(f"[任务] 后台任务已启动，并发: {limits}")
+
+    async def stop(self):
+        """
+        停止领取新任务，等待执行中的任务完成；超过 SHUTDOWN_GRACE 秒仍未完成的取消后
+        放回队列（不计入重试次数）
+        """
+        if self._loop_task is None:
+            return
+        # 不取消执行循环：正在领取任务时被取消会让连接停在未提交的事务中
+        self._stopping = True
+        self.wake()
+        await asyncio.gather(self._loop_task, return_exceptions=True)
+        self._loop_task = None
+
+        tasks = dict(self._tasks)
+        unfinished = []
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=SHUTDOWN_GRACE)
+            unfinished = [job_id for job_id, task in tasks.items() if task in pending]
+            for job_id in unfinished:
+                tasks[job_id].cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        if not unfinished:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Job)
+                    .where(Job.id.in_(unfinished), Job.status == RUNNING)
+                    .values(status=PENDING, attempts=Job.attempts - 1, locked_until=None, run_after=datetime.utcnow())
+                )
+                await db.commit()
+            print(f"[任务] 已把 {len(unfinished)} 个未完成的任务放回队列")
+        except Exception as e:
+            # 租期过期后会自动重新排队
+            print(f"[任务] 放回未完成的任务失败: {e}")
+
+    def wake(self):
+        if self._wake_event is not None:
+            self._wake_event.set()
+
+    # ---------- 执行循环 ----------
+
+    def free_types(self) -> List[str]:
+        return [job_type for job_type in _handlers if self._running[job_type] < type_concurrency(job_type)]
+
+    async def _run_loop(self):
+        next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+        while not self._stopping:
+            try:
+                if time.monotonic() >= next_maintenance:
+                    next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+                    await self.maintain()
+                types = self.free_types()
+                job = await self.claim(types) if types else None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[任务] 领取任务失败: {e}")
+                job = None
+
+            if job is not None:
+                self._start_job(job)
+                continue
+
+            self._wake_event.clear()
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), timeout=settings.job_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def claim(self, types: List[str]) -> Optional[Job]:
+        """领取一个已到执行时间的任务；多个进程同时领取时只有一个能更新成功"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Job.id)
+                .where(Job.status == PENDING, Job.run_after <= now, Job.type.in_(types))
+                .order_by(Job.run_after, Job.id)
+                .limit(1)
+            )
+            job_id = result.scalar_one_or_none()
+            if job_id is None:
+                return None
+            result = await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == PENDING)
+                .values(
+                    status=RUNNING,
+                    attempts=Job.attempts + 1,
+                    started_at=now,
+                    locked_until=now + timedelta(seconds=settings.job_lease_seconds)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if result.rowcount != 1:
+                return None
+            return await db.get(Job, job_id)
+
+    def _start_job(self, job: Job):
+        self._running[job.type] += 1
+        self._tasks[job.id] = asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: Job):
+        # 结果写回之后才从 _tasks 中移除，stop() 会等到结果写完再关闭连接池
+        try:
+            await self._run_job(job)
+        finally:
+            self._tasks.pop(job.id, None)
+
+    async def _run_job(self, job: Job):
+        handler = _handlers[job.type][0]
+        waited = (job.started_at - max(job.created_at, job.run_after)).total_seconds()
+        started = time.monotonic()
+        done = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, done))
+        error = None
+        _current_job.set(job.id)
+        try:
+            await handler(json.loads(job.payload))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            done.set()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            self._running[job.type] -= 1
+            self.wake()
+
+        elapsed = time.monotonic() - started
+        self._latencies[job.type].append((max(waited, 0.0), elapsed))
+        try:
+            await self._finish(job, error)
+        except Exception as e:
+            # 没能写回结果时任务保持 running，租期过期后会重新执行
+            print(f"[任务] 记录任务 {job.id} 的结果失败: {e}")
+
+    async def _heartbeat(self, job_id: int, done: asyncio.Event):
+        """执行期间定时续租，避免长任务被其他进程当作中断的任务重新领取"""
+        interval = max(settings.job_lease_seconds / 3, 1)
+        while True:
+            try:
+                await asyncio.wait_for(done.wait(), timeout=interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(Job)
+                        .where(Job.id == job_id, Job.status == RUNNING)
+                        .values(locked_until=datetime.utcnow() + timedelta(seconds=settings.job_lease_seconds))
+                    )
+                    await db.commit()
+            except Exception as e:
+                print(f"[任务] 任务 {job_id} 续期失败: {e}")
+
+    async def _finish(self, job: Job, error: Optional[str]):
+        now = datetime.utcnow()
+        if error is None:
+            values = {"status": SUCCEEDED, "finished_at": now, "locked_until": None, "last_error": None}
+            self.succeeded += 1
+        elif job.attempts >= job.max_attempts:
+            values = {"status": FAILED, "finished_at": now, "locked_until": None, "last_error": error}
+            self.failed += 1
+            print(f"[任务] {job.type} 任务 {job.id} 失败 {job.attempts} 次，不再重试: {error}")
+        else:
+            delay = retry_delay(job.attempts)
+            values = {
+                "status": PENDING, "locked_until": None, "last_error": error,
+                "run_after": now + timedelta(seconds=delay)
+            }
+            self.retried += 1
+            print(f"[任务] {job.type} 任务 {job.id} 第 {job.attempts} 次失败，{delay:.0f} 秒后重试: {error}")
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Job).where(Job.id == job.id, Job.status == RUNNING).values(**values))
+            await db.commit()
+
+    # ---------- 维护 ----------
+
+    async def requeue_expired(self) -> int:
+        """租期已过的 running 任务（执行它的进程已经退出）重新排队，重试次数用完的标记为失败"""
+        now = datetime.utcnow()
+        expired = and_(Job.status == RUNNING, Job.locked_until < now)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Job)
+                .where(expired, Job.attempts >= Job.max_attempts)
+                .values(status=FAILED, finished_at=now, locked_until=None, last_error="执行任务的进程已退出")
+            )
+            result = await db.execute(
+                update(Job).where(expired).values(status=PENDING, locked_until=None, run_after=now)
+            )
+            await db.commit()
+            return result.rowcount
+
+    async def maintain(self):
+        recovered = await self.requeue_expired()
+        if recovered:
+            print(f"[任务] 重新排队了 {recovered} 个租期过期的任务")
+        cutoff = datetime.utcnow() - timedelta(hours=settings.job_history_hours)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Job).where(Job.finished_at < cutoff, Job.status == SUCCEEDED))
+            await db.commit()
+        for hook in _maintenance_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                print(f"[任务] 维护函数 {hook.__name__} 执行失败: {e}")
+
+    async def run_until_idle(self, timeout: Optional[float] = None):
+        """
+        在当前进程中执行已到时间的任务，直到队列中没有可执行的任务（命令行工具使用，
+        也可以在 jobs_enabled 为 False 的部署中由定时任务调用）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._wake_event = self._wake_event or asyncio.Event()
+        await self.maintain()
+        while deadline is None or time.monotonic() < deadline:
+            types = self.free_types()
+            job = await self.claim(types) if types else None
+            if job is not None:
+                self._start_job(job)
+                continue
+            if not self._tasks:
+                return
+            await asyncio.wait(list(self._tasks.values()), return_when=asyncio.FIRST_COMPLETED)
+
+    # ---------- 统计 ----------
+
+    async def stats(self, db: AsyncSession) -> Dict:
+        """
+        各类型任务的队列长度、最早一个等待中任务已等待的时间，以及本进程最近执行的
+        任务的等待和执行耗时（平均值与 P95）
+        """
+        now = datetime.utcnow()
+        result = await db.execute(
+            select(Job.type, Job.status, func.count(), func.min(Job.created_at))
+            .where(Job.status.in_((PENDING, RUNNING, FAILED)))
+            .group_by(Job.type, Job.status)
+        )
+        types: Dict[str, Dict] = {
+            job_type: {"type": job_type, PENDING: 0, RUNNING: 0, FAILED: 0, "oldest_pending_seconds": 0}
+            for job_type in _handlers
+        }
+        for job_type, job_status, count, oldest in result:
+            item = types.setdefault(
+                job_type, {"type": job_type, PENDING: 0, RUNNING: 0, FAILED: 0, "oldest_pending_seconds": 0}
+            )
+            item[job_status] = count
+            if job_status == PENDING and oldest:
+                item["oldest_pending_seconds"] = round((now - oldest).total_seconds(), 1)
+
+        for job_type, item in types.items():
+            samples = list(self._latencies.get(job_type, ()))
+            waits = [wait for wait, _ in samples]
+            runs = [run for _, run in samples]
+            item.update({
+                "concurrency": type_concurrency(job_type) if job_type in _handlers else 0,
+                "running_here": self._running.get(job_type, 0),
+                "samples": len(samples),
+                "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "p95_wait_seconds": round(percentile(waits, 0.95), 3),
+                "avg_run_seconds": round(sum(runs) / len(runs), 3) if runs else 0.0,
+                "p95_run_seconds": round(percentile(runs, 0.95), 3),
+            })
+
+        failed_result = await db.execute(
+            select(Job).where(Job.status == FAILED).order_by(Job.finished_at.desc()).limit(10)
+        )
+        recent_failures = [
+            {"id": job.id, "type": job.type, "attempts": job.attempts, "error": job.last_error, "finished_at": job.finished_at}
+            for job in failed_result.scalars().all()
+        ]
+        return {
+            "enabled": settings.jobs_enabled,
+            "queued": sum(item[PENDING] for item in types.values()),
+            "running": sum(item[RUNNING] for item in types.values()),
+            "failed": sum(item[FAILED] for item in types.values()),
+            "succeeded_here": self.succeeded,
+            "retried_here": self.retried,
+            "failed_here": self.failed,
+            "types": sorted(types.values(), key=lambda item: item["type"]),
+            "recent_failures": recent_failures,
+        }
+
+
+async def job_status(db: AsyncSession, job_id: int) -> Optional[Dict]:
+    """任务的状态和进度，页面轮询时使用"""
+    job = await db.get(Job, job_id)
+    if job is None:
+        return None
+    return {
+        "id": job.id,
+        "type": job.type,
+        "status": job.status,
+        "progress": job.progress,
+        "progress_total": job.progress_total,
+        "attempts": job.attempts,
+        "error": job.last_error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+async def active_jobs(db: AsyncSession, job_type: str) -> List[Job]:
+    """某类型尚未完成的任务（按入队顺序）"""
+    result = await db.execute(
+        select(Job).where(Job.status.in_(ACTIVE_STATUSES), Job.type == job_type)
+    )
+    # 未完成的任务很少，在内存中排序，查询只用 ix_jobs_queue
+    return sorted(result.scalars().all(), key=lambda job: job.id)
+
+
+async def retry_job(db: AsyncSession, job_id: int) -> bool:
+    """
+    把失败的任务重新排队（重试次数清零），返回是否找到了该任务；同一个 dedup_key
+    已经有未完成的任务时（失败之后又入队了一次）不能重新排队，抛出 ValueError
+    """
+    active = aliased(Job)
+    duplicate = select(active.id).where(
+        active.dedup_key == Job.dedup_key, active.status.in_(ACTIVE_STATUSES)
+    ).exists()
+    result = await db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == FAILED, ~duplicate)
+        .values(status=PENDING, attempts=0, run_after=datetime.utcnow(), finished_at=None)
+    )
+    if result.rowcount == 1:
+        db.sync_session.info[ENQUEUED_KEY] = True
+        return True
+    job = await db.get(Job, job_id)
+    if job is not None and job.status == FAILED:
+        raise ValueError("相同的任务已经在队列中")
+    return False
+
+
+job_queue = JobQueue()
@@ -0,0 +1,211 @@
+"""
+/uploads 目录的静态文件服务
+
+上传的原图和衍生图都以 UUID 命名，写入后内容不会再变（删除照片时文件一起删除，
+同名文件不会被重新生成为不同内容），因此响应可以标记为永久缓存：浏览器、
+小程序和前面的 CDN 拿到一次之后不再回源确认。
+
+在 Starlette 自带的 StaticFiles 基础上：
+- UUID 命名的文件返回 Cache-Control: public, max-age=一年, immutable，
+  其他文件返回 no-cache，每次使用前用 ETag 确认；
+- ETag 按 RFC 加引号，If-None-Match 支持多个值和弱比较；
+- 支持单段 Range 请求（大图断点续传、视频拖动），多段 Range 返回完整文件；
+- 补齐部分系统 mimetypes 中缺失的 WebP 类型；
+- 上传目录改为分片布局后，旧的平铺 URL（/uploads/<uuid>.jpg，例如相册封面中
+  保存的地址）按 derivatives.shard_dir 到分片子目录中查找。
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Receive, Scope, Send
+
+from .config import settings
+from .derivatives import shard_dir
+from .storage import get_storage
+
+mimetypes.add_type("image/webp", ".webp")
+
+# 原图 <uuid>.<扩展名>，衍生图 thumb_<uuid>.<扩展名>、preview_<uuid>.webp 等
+IMMUTABLE_NAME = re.compile(
+    r"^(?:[a-z]+_)?[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.[a-z0-9]+$"
+)
+
+
+def is_immutable(path: str) -> bool:
+    return IMMUTABLE_NAME.match(os.path.basename(path).lower()) is not None
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析 Range 请求头，返回 (起始位置, 结束位置)（含结束位置）
+
+    格式不支持（非 bytes 单位、多段）时返回 None，按完整文件响应；
+    范围无法满足时抛出 ValueError，调用方返回 416。
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, sep, end_text = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_text == "":
+            # bytes=-500 表示最后 500 字节
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError("empty suffix range")
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """与 Starlette 相同的算法（修改时间 + 大小），但按 RFC 加上引号"""
+    base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return '"{}"'.format(hashlib.md5(base.encode(), usedforsecurity=False).hexdigest())
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 可能包含多个 ETag，按弱比较判断"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == current:
+            return True
+    return False
+
+
+class RangeFileResponse(FileResponse):
+    """只发送文件中 [start, end] 部分的 206 响应"""
+
+    def __init__(self, path: str, start: int, end: int, stat_result: os.stat_result, **kwargs):
+        super().__init__(path, status_code=206, stat_result=stat_result, **kwargs)
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+        self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+        if remaining > 0:
+            # 文件在发送过程中被截断，结束响应
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class MediaFiles(StaticFiles):
+    """带长期缓存和 Range 支持的静态文件服务"""
+
+    def lookup_path(self, path: str):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None and "/" not in path and settings.upload_shard_depth > 0:
+            full_path, stat_result = super().lookup_path(f"{shard_dir(path)}/{path}")
+        return full_path, stat_result
+
+    def cache_control(self, path: str) -> str:
+        if is_immutable(path):
+            return f"public, max-age={settings.media_max_age}, immutable"
+        return "public, no-cache"
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        method = scope["method"]
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+
+        etag = file_etag(stat_result)
+        headers = {
+            "etag": etag,
+            "cache-control": self.cache_control(full_path),
+            "accept-ranges": "bytes",
+        }
+
+        if status_code == 200:
+            if_none_match = request_headers.get("if-none-match")
+            if if_none_match is not None:
+                if etag_matches(if_none_match, etag):
+                    return NotModifiedResponse(Headers(headers=headers))
+            elif self.is_not_modified(
+                Headers(headers={"last-modified": formatdate(stat_result.st_mtime, usegmt=True)}),
+                request_headers
+            ):
+                return NotModifiedResponse(Headers(headers=headers))
+
+            range_header = request_headers.get("range")
+            # If-Range 与当前 ETag 不一致说明客户端手里的部分已过期，返回完整文件
+            if range_header and request_headers.get("if-range", etag) == etag:
+                try:
+                    byte_range = parse_range(range_header, stat_result.st_size)
+                except ValueError:
+                    return Response(
+                        status_code=416,
+                        headers={**headers, "content-range": f"bytes */{stat_result.st_size}"}
+                    )
+                if byte_range is not None:
+                    return RangeFileResponse(
+                        full_path, *byte_range, stat_result=stat_result, method=method, headers=headers
+                    )
+
+        return FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result, method=method, headers=headers
+        )
+
+
+async def redirect_to_storage(key: str):
+    """
+    对象存储没有配置公开地址时 /uploads/<key> 的处理：重定向到限时下载地址
+
+    预签名地址在一半有效期内可以被客户端缓存。
+    """
+    if "/" not in key and settings.upload_shard_depth > 0:
+        key = f"{shard_dir(key)}/{key}"
+    expires = settings.s3_presign_expires
+    return RedirectResponse(
+        get_storage().presign_get(key, expires),
+        status_code=302,
+        headers={"Cache-Control": f"private, max-age={expires // 2}"}
+    )
@@ -0,0 +1,443 @@
+"""
+版本化的数据库迁移
+
+每个迁移有一个递增的版本号，执行过的版本记录在 schema_migrations 表中，启动时
+只执行尚未执行过的迁移。迁移函数接收同步的 SQLAlchemy 连接（通过 run_sync 调用），
+内部操作都写成可重复执行的形式（列或索引已存在时跳过），中途失败后重新运行即可。
+迁移只使用 SQLAlchemy 的表达式和按方言编译的 DDL，SQLite 和 PostgreSQL 都能执行。
+
+建表的迁移使用本文件中的表结构快照（建表当时的字段和索引），不使用 database.py
+中的模型：模型之后新增的字段和索引由各自的迁移添加，迁移的结果不随模型变化。
+
+新增迁移：在文件末尾添加一个带 @migration(版本号, 名称) 的函数，版本号不能复用。
+命令行工具见 backend/migrate.py。
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Integer, String, Text, DateTime, ForeignKey, Index, MetaData, Table,
+    inspect, literal, select, insert, update, func
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import Album, Photo, Blob, Job
+from .timeline import rebuild_timeline
+
+# 迁移记录表不属于业务模型，单独放在一个 MetaData 中
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+# 多台 API 服务器同时启动时，PostgreSQL 上用事务级咨询锁保证只有一台执行迁移
+MIGRATION_LOCK_ID = 5250525
+
+
+def migration(version: int, name: str):
+    """注册一个迁移"""
+    def decorator(func):
+        if any(existing == version for existing, _, _ in MIGRATIONS):
+            raise ValueError(f"迁移版本号重复: {version}")
+        MIGRATIONS.append((version, name, func))
+        return func
+    return decorator
+
+
+# ---------- 迁移辅助函数 ----------
+
+def add_column(conn: Connection, table: Table, column_name: str, default=None) -> bool:
+    """按模型定义为已有的表添加列，列已存在时跳过；返回是否新增了列"""
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    if column_name in existing:
+        return False
+
+    column = table.c[column_name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+    if default is not None:
+        # 按方言渲染默认值，例如布尔值在 SQLite 中是 0，在 PostgreSQL 中是 false
+        rendered = literal(default, column.type).compile(
+            dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+        )
+        ddl += f" DEFAULT {rendered}"
+    if not column.nullable and default is not None:
+        ddl += " NOT NULL"
+
+    conn.exec_driver_sql(ddl)
+    print(f"[数据库] 为 {table.name} 表添加 {column.name} 字段")
+    return True
+
+
+def create_indexes(conn: Connection, table: Table, names: List[str]):
+    """按模型中的定义创建索引，索引已存在时跳过"""
+    indexes = {index.name: index for index in table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+# ---------- 迁移 ----------
+
+# 迁移 1 建立的表：引入迁移时的 albums、photos、users
+baseline_metadata = MetaData()
+
+baseline_albums = Table(
+    "albums",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(255), nullable=False),
+    Column("description", Text, nullable=True),
+    Column("cover_image", String(500), nullable=True),
+    Column("sort_order", Integer),
+    Column("photo_count", Integer, nullable=False),
+    Column("total_bytes", BigInteger, nullable=False),
+    Column("is_deleted", Boolean),
+    Column("deleted_at", DateTime, nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+
+baseline_photos = Table(
+    "photos",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("album_id", Integer, ForeignKey("albums.id"), nullable=False),
+    Column("filename", String(255), nullable=False),
+    Column("original_filename", String(255), nullable=False),
+    Column("file_path", String(500), nullable=False),
+    Column("file_size", Integer, nullable=False),
+    Column("width", Integer, nullable=True),
+    Column("height", Integer, nullable=True),
+    Column("description", Text, nullable=True),
+    Column("variants", String(100), nullable=True),
+    Column("sort_order", Integer),
+    Column("is_deleted", Boolean),
+    Column("deleted_at", DateTime, nullable=True),
+    Column("created_at", DateTime),
+)
+
+baseline_users = Table(
+    "users",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, nullable=False),
+    Column("password_hash", String(255), nullable=False),
+    Column("is_active", Boolean),
+    Column("created_at", DateTime),
+)
+
+
+@migration(1, "baseline")
+def baseline(conn: Connection):
+    """
+    基线：创建缺失的表，并补齐旧版本通过 migrate_add_*.py 脚本添加的字段
+
+    旧数据库可能只执行过其中一部分脚本，这里逐个检查补齐。
+    """
+    baseline_metadata.create_all(conn)
+
+    albums, photos = baseline_albums, baseline_photos
+    add_column(conn, albums, "sort_order", default=0)
+    add_column(conn, photos, "sort_order", default=0)
+    add_column(conn, albums, "is_deleted", default=False)
+    add_column(conn, albums, "deleted_at")
+    add_column(conn, photos, "is_deleted", default=False)
+    add_column(conn, photos, "deleted_at")
+    add_column(conn, photos, "variants")
+    stats_added = add_column(conn, albums, "photo_count", default=0)
+    stats_added = add_column(conn, albums, "total_bytes", default=0) or stats_added
+
+    # 排序和分页依赖这些字段不为 NULL
+    for table in (albums, photos):
+        conn.execute(update(table).where(table.c.sort_order.is_(None)).values(sort_order=0))
+        conn.execute(update(table).where(table.c.is_deleted.is_(None)).values(is_deleted=False))
+
+    if stats_added:
+        live_photos = (photos.c.album_id == albums.c.id) & (photos.c.is_deleted == False)
+        conn.execute(
+            update(albums).values(
+                photo_count=select(func.count(photos.c.id)).where(live_photos).scalar_subquery(),
+                total_bytes=select(func.coalesce(func.sum(photos.c.file_size), 0)).where(live_photos).scalar_subquery()
+            )
+        )
+        print("[数据库] 已回填相册统计字段")
+
+
+@migration(2, "listing_indexes")
+def listing_indexes(conn: Connection):
+    """为各个列表查询添加复合索引和部分索引（对应查询见 query_plans.py）"""
+    # 以 is_deleted 开头的旧索引会让 SQLite 放弃下面按排序列建的部分索引
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_albums_listing")
+    create_indexes(conn, Album.__table__, [
+        "ix_albums_live_order",
+        "ix_albums_order",
+        "ix_albums_live_updated",
+        "ix_albums_live_created",
+        "ix_albums_live_name",
+        "ix_albums_trash",
+    ])
+    create_indexes(conn, Photo.__table__, [
+        "ix_photos_album_order",
+        "ix_photos_album_created",
+        "ix_photos_album_filename",
+        "ix_photos_album_size",
+        "ix_photos_order",
+        "ix_photos_live_created",
+        "ix_photos_live_filename",
+        "ix_photos_live_size",
+        "ix_photos_trash",
+    ])
+
+
+@migration(3, "album_version")
+def album_version(conn: Connection):
+    """相册版本号，用于列表接口的 ETag（见 album_versions.py）"""
+    add_column(conn, Album.__table__, "version", default=1)
+
+
+# 迁移 4 建立的 blobs 表，之后的字段由迁移 5、6 添加
+blobs_metadata = MetaData()
+
+blobs_v4 = Table(
+    "blobs",
+    blobs_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("content_sha256", String(64), nullable=False),
+    Column("filename", String(255), nullable=False),
+    Column("file_path", String(500), nullable=False),
+    Column("file_size", Integer, nullable=False),
+    Column("width", Integer, nullable=True),
+    Column("height", Integer, nullable=True),
+    Column("variants", String(100), nullable=True),
+    Column("ref_count", Integer, nullable=False),
+    Column("created_at", DateTime),
+    Index("ix_blobs_sha256", "content_sha256", unique=True),
+)
+
+
+@migration(4, "content_hash")
+def content_hash(conn: Connection):
+    """按内容去重：照片的 content_sha256 字段和 blobs 表（见 blobs.py）"""
+    blobs_v4.create(conn, checkfirst=True)
+    add_column(conn, Photo.__table__, "content_sha256")
+    create_indexes(conn, Photo.__table__, ["ix_photos_sha256"])
+
+
+@migration(5, "perceptual_hash")
+def perceptual_hash(conn: Connection):
+    """相似照片查找：感知哈希及其分段索引（见 similarity.py），旧照片用 migrate.py backfill-dhash 补算"""
+    photos = Photo.__table__
+    for column_name in ("dhash", "dhash_0", "dhash_1", "dhash_2", "dhash_3"):
+        add_column(conn, photos, column_name)
+    add_column(conn, Blob.__table__, "dhash")
+    create_indexes(conn, photos, ["ix_photos_dhash_0", "ix_photos_dhash_1", "ix_photos_dhash_2", "ix_photos_dhash_3"])
+
+
+# 迁移 6 建立的时间线分组表
+timeline_metadata = MetaData()
+
+timeline_buckets_v6 = Table(
+    "timeline_buckets",
+    timeline_metadata,
+    Column("album_id", Integer, primary_key=True),
+    Column("level", String(5), primary_key=True),
+    Column("period", String(10), primary_key=True),
+    Column("photo_count", Integer, nullable=False),
+    Column("cover_photo_id", Integer, nullable=True),
+    Column("cover_taken_at", DateTime, nullable=True),
+)
+
+
+@migration(6, "exif_timeline")
+def exif_timeline(conn: Connection):
+    """
+    拍摄信息和时间线（见 timeline.py）：旧照片的拍摄时间先按上传时间填充，
+    再按照片表建立时间线分组；EXIF 用 migrate.py backfill-exif 补读
+    """
+    photos = Photo.__table__
+    exif_columns = ("taken_at", "camera_make", "camera_model", "lens_model", "orientation")
+    for column_name in exif_columns:
+        add_column(conn, photos, column_name)
+        add_column(conn, Blob.__table__, column_name)
+    create_indexes(conn, photos, ["ix_photos_album_taken", "ix_photos_taken", "ix_photos_camera"])
+
+    conn.execute(
+        update(photos).where(photos.c.taken_at.is_(None)).values(taken_at=photos.c.created_at)
+    )
+    timeline_buckets_v6.create(conn, checkfirst=True)
+    print(f"[数据库] 已建立时间线分组 {rebuild_timeline(conn)} 个")
+
+
+
+# 全文索引：(表名, 索引的列)，对应的查询见 search.py
+SEARCH_TABLES = (
+    ("photos", ("original_filename", "description")),
+    ("albums", ("name", "description")),
+)
+
+
+def sqlite_search_index(conn: Connection, table: str, columns: Tuple[str, ...]):
+    """FTS5 外部内容表及同步触发器：只保存索引，内容从原表读取"""
+    fts = f"{table}_fts"
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{name}" for name in columns)
+    old_values = ", ".join(f"old.{name}" for name in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    insert_new = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values});"
+
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{names}, content='{table}', content_rowid='id', tokenize='trigram')"
+    )
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert_new} END")
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete_old} END")
+    # 只在索引的列变化时更新，软删除、排序等改动不触发
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete_old} {insert_new} END"
+    )
+    conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def postgresql_search_index(conn: Connection, table: str, columns: Tuple[str, ...]):
+    """tsvector 字段、BEFORE 触发器和 GIN 索引；第一列的权重高于其他列"""
+    vector = " || ".join(
+        f"setweight(to_tsvector('simple', coalesce(NEW.{name}, '')), '{'A' if index == 0 else 'B'}')"
+        for index, name in enumerate(columns)
+    )
+    function = f"{table}_search_vector"
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector")
+    conn.exec_driver_sql(
+        f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$ "
+        f"BEGIN NEW.search_vector := {vector}; RETURN NEW; END $$ LANGUAGE plpgsql"
+    )
+    conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {function} ON {table}")
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER {function} BEFORE INSERT OR UPDATE OF {', '.join(columns)} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION {function}()"
+    )
+    # 触发一次 UPDATE OF 为已有的行计算 search_vector
+    conn.exec_driver_sql(f"UPDATE {table} SET {columns[0]} = {columns[0]}")
+    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING GIN (search_vector)")
+
+
+@migration(7, "search_index")
+def search_index(conn: Connection):
+    """照片文件名、描述和相册名称、描述的全文索引（见 search.py）"""
+    for table, columns in SEARCH_TABLES:
+        if conn.dialect.name == "postgresql":
+            postgresql_search_index(conn, table, columns)
+        else:
+            sqlite_search_index(conn, table, columns)
+
+
+
+@migration(8, "content_crc32")
+def content_crc32(conn: Connection):
+    """原图的 CRC32，用于流式打包下载相册（见 album_zip.py），旧照片用 migrate.py hash-uploads 补算"""
+    add_column(conn, Photo.__table__, "content_crc32")
+
+
+# 迁移 9 建立的 jobs 表，进度字段由迁移 10 添加
+jobs_metadata = MetaData()
+
+jobs_v9 = Table(
+    "jobs",
+    jobs_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("type", String(50), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("dedup_key", String(255), nullable=True),
+    Column("status", String(20), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("max_attempts", Integer, nullable=False),
+    Column("run_after", DateTime, nullable=False),
+    Column("locked_until", DateTime, nullable=True),
+    Column("last_error", Text, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("started_at", DateTime, nullable=True),
+    Column("finished_at", DateTime, nullable=True),
+    Index("ix_jobs_queue", "status", "run_after"),
+    Index("ix_jobs_finished", "status", "finished_at"),
+)
+Index(
+    "ix_jobs_dedup", jobs_v9.c.dedup_key, unique=True,
+    sqlite_where=jobs_v9.c.status.in_(("pending", "running")),
+    postgresql_where=jobs_v9.c.status.in_(("pending", "running"))
+)
+
+
+@migration(9, "jobs")
+def jobs(conn: Connection):
+    """后台任务队列（见 jobs.py）"""
+    jobs_v9.create(conn, checkfirst=True)
+
+
+@migration(10, "job_progress")
+def job_progress(conn: Connection):
+    """后台任务的进度（清空回收站等分批执行的任务）"""
+    add_column(conn, Job.__table__, "progress")
+    add_column(conn, Job.__table__, "progress_total")
+
+
+@migration(11, "variants_version")
+def variants_version(conn: Connection):
+    """
+    衍生图的生成方式（见 derivatives.DERIVATIVES_VERSION）。方向正常（orientation 为 1）
+    的照片转正前后相同，直接记为版本 2；其余已有衍生图的照片由
+    migrate.py backfill-variants 重新生成
+    """
+    for table in (Photo.__table__, Blob.__table__):
+        add_column(conn, table, "variants_version")
+        conn.execute(
+            update(table)
+            .where(table.c.variants_version.is_(None), table.c.variants.isnot(None),
+                   table.c.variants != "", table.c.orientation == 1)
+            .values(variants_version=2)
+        )
+
+
+# ---------- 执行 ----------
+
+def applied_versions(conn: Connection) -> dict:
+    """返回已执行的迁移 {版本号: 执行时间}"""
+    migration_metadata.create_all(conn)
+    rows = conn.execute(select(schema_migrations.c.version, schema_migrations.c.applied_at))
+    return {version: applied_at for version, applied_at in rows}
+
+
+def upgrade(conn: Connection) -> List[Tuple[int, str]]:
+    """执行所有未执行的迁移，返回本次执行的迁移列表"""
+    if conn.dialect.name == "postgresql":
+        # 锁在事务提交时释放，其他服务器拿到锁后会看到迁移已经执行过
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+    applied = applied_versions(conn)
+    executed = []
+    for version, name, apply in sorted(MIGRATIONS):
+        if version in applied:
+            continue
+        apply(conn)
+        conn.execute(
+            insert(schema_migrations).values(version=version, name=name, applied_at=datetime.utcnow())
+        )
+        print(f"[数据库] 已执行迁移 {version:04d}_{name}")
+        executed.append((version, name))
+    return executed
+
+
+async def run_migrations(engine: AsyncEngine) -> List[Tuple[int, str]]:
+    async with engine.begin() as conn:
+        return await conn.run_sync(upgrade)
+
+
+async def migration_status(engine: AsyncEngine) -> List[Tuple[int, str, object]]:
+    """返回 [(版本号, 名称, 执行时间或 None)]"""
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(applied_versions)
+    return [(version, name, applied.get(version)) for version, name, _ in sorted(MIGRATIONS)]
@@ -0,0 +1,163 @@
+"""
+拖动排序：稀疏排序键与批量移动
+
+相册和照片的自定义顺序按 sort_order 倒序显示（越大越靠前，相同时按时间倒序）。
+排序键之间留出 SORT_GAP 的间隔，把一项拖到两项之间时取前后两项排序键的中间值，
+只改写被移动的这一行。每次移动只按主键查出被移动的项和它要排在后面的那一项，
+再用一条走索引的 ORDER BY ... LIMIT 2 查出新位置的下一项，与范围内有多少行无关。
+
+前后两项之间已经没有空位（排序键相邻或相同，例如升级前上传的照片都是 0）时，
+才读出整个范围（未删除的行），按移动后的顺序重新编号、重新留出间隔，之后的
+移动又只改一行。
+
+一次拖动可以包含多个移动（多选拖动），在同一个事务中按顺序执行，只写排序键
+实际变化的行。
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, func, literal, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Album, Photo
+from .album_versions import touch_albums
+
+# 新建相册、重新编号时相邻两项排序键的间隔
+SORT_GAP = 1024
+
+# (被移动的 ID, 移到哪一项的后面；None 表示移到最前面)
+Move = Tuple[int, Optional[int]]
+
+
+class SortScope:
+    """
+    一组按同一顺序排列的行：columns 是显示顺序（倒序）的排序列，第一列是
+    sort_order，最后一列是主键；filters 限定范围，只包含未删除的行
+    """
+
+    def __init__(self, model, columns: List, filters: List, **extra_values):
+        self.model = model
+        self.table = model.__table__
+        self.columns = columns
+        self.filters = filters
+        # 写排序键时一起设置的列（相册的 updated_at 保持不变）
+        self.extra_values = extra_values
+
+    def ordered(self, query):
+        return query.where(*self.filters).order_by(*[column.desc() for column in self.columns])
+
+
+async def new_album_sort_order(db: AsyncSession) -> int:
+    """新建相册的排序键：排在最前面，与原来最大的排序键之间留出 SORT_GAP"""
+    result = await db.execute(select(func.max(Album.sort_order)))
+    return (result.scalar() or 0) + SORT_GAP
+
+
+def place_between(key: int, upper: Optional[int], lower: Optional[int]) -> Optional[int]:
+    """
+    被移动项放到排序键为 upper 和 lower 的两项之间（None 表示没有前一项或后一项）
+    时的新排序键；当前的排序键已经在两者之间时原样返回，没有空位时返回 None
+    """
+    if (upper is None or key < upper) and (lower is None or key > lower):
+        return key
+    if upper is None:
+        return lower + SORT_GAP
+    if lower is None:
+        return upper - SORT_GAP
+    if upper - lower >= 2:
+        return (upper + lower) // 2
+    return None
+
+
+async def _write_keys(db: AsyncSession, scope: SortScope, changed: Dict[int, int]):
+    if not changed:
+        return
+    # executemany：一条语句写回所有变化的排序键
+    table = scope.table
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(sort_order=bindparam("new_key"), **scope.extra_values),
+        [{"row_id": row_id, "new_key": key} for row_id, key in changed.items()]
+    )
+
+
+async def _renumber(db: AsyncSession, scope: SortScope, item_id: int, after_id: Optional[int]) -> Dict[int, int]:
+    """没有空位时读出整个范围，按移动后的顺序重新编号，返回排序键有变化的行"""
+    result = await db.execute(scope.ordered(select(scope.model.id, scope.model.sort_order)))
+    order = [(row_id, sort_order) for row_id, sort_order in result.all() if row_id != item_id]
+    position = 0 if after_id is None else [row_id for row_id, _ in order].index(after_id) + 1
+    order.insert(position, (item_id, None))
+
+    changed = {}
+    for index, (row_id, sort_order) in enumerate(order):
+        renumbered = (len(order) - index) * SORT_GAP
+        if renumbered != sort_order:
+            changed[row_id] = renumbered
+    await _write_keys(db, scope, changed)
+    return changed
+
+
+async def _move(db: AsyncSession, scope: SortScope, item_id: int, after_id: Optional[int]) -> Dict[int, int]:
+    """执行一次移动，返回排序键有变化的 {ID: 新排序键}；ID 不在范围内时抛出 ValueError"""
+    ids = [item_id] if after_id is None else [item_id, after_id]
+    result = await db.execute(
+        select(*scope.columns).where(scope.model.id.in_(ids), *scope.filters)
+    )
+    rows = {row[-1]: row for row in result.all()}
+    if item_id == after_id or len(rows) != len(ids):
+        raise ValueError(f"无效的移动: {item_id} -> {after_id}")
+
+    # 新位置的下一项：排在 after_id 后面（或最前面）的两行中不是被移动项的那一行
+    query = select(scope.model.id, scope.model.sort_order)
+    upper = None
+    if after_id is not None:
+        anchor = rows[after_id]
+        upper = anchor[0] or 0
+        bound = tuple_(*[literal(value, column.type) for column, value in zip(scope.columns, anchor)])
+        query = query.where(tuple_(*scope.columns) < bound)
+    result = await db.execute(scope.ordered(query).limit(2))
+    following = [sort_order or 0 for row_id, sort_order in result.all() if row_id != item_id]
+    lower = following[0] if following else None
+
+    key = rows[item_id][0] or 0
+    new_key = place_between(key, upper, lower)
+    if new_key == key:
+        return {}
+    if new_key is None:
+        return await _renumber(db, scope, item_id, after_id)
+    await _write_keys(db, scope, {item_id: new_key})
+    return {item_id: new_key}
+
+
+async def _apply_moves(db: AsyncSession, scope: SortScope, moves: Sequence[Move]) -> Dict[int, int]:
+    changed: Dict[int, int] = {}
+    for item_id, after_id in moves:
+        changed.update(await _move(db, scope, item_id, after_id))
+    return changed
+
+
+async def reorder_photos(db: AsyncSession, album_id: int, moves: Sequence[Move]) -> Dict[int, int]:
+    """在相册内移动照片（在 commit 之前调用），返回排序键有变化的照片"""
+    scope = SortScope(
+        Photo,
+        [Photo.sort_order, Photo.created_at, Photo.id],
+        [Photo.album_id == album_id, Photo.is_deleted == False]
+    )
+    changed = await _apply_moves(db, scope, moves)
+    if changed:
+        touch_albums(db, [album_id])
+    return changed
+
+
+async def reorder_albums(db: AsyncSession, moves: Sequence[Move]) -> Dict[int, int]:
+    """移动相册（在 commit 之前调用），返回排序键有变化的相册"""
+    scope = SortScope(
+        Album,
+        [Album.sort_order, Album.updated_at, Album.id],
+        [Album.is_deleted == False],
+        # 调整顺序不算编辑相册，保持 updated_at 不变
+        updated_at=Album.__table__.c.updated_at
+    )
+    changed = await _apply_moves(db, scope, moves)
+    touch_albums(db, changed.keys())
+    return changed
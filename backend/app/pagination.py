@@ -0,0 +1,91 @@
+"""
+游标（keyset）分页
+
+OFFSET 分页翻到第 N 页时数据库要先扫描并丢弃前面所有行，越往后越慢。游标分页
+记住上一页最后一行的排序键，下一页直接用 WHERE (排序键) < (上一行的值) 从索引中
+定位，每页的代价与页数无关。
+
+排序键的最后一列必须是主键，保证顺序唯一；同一排序模式下各列的方向相同，
+这样可以用行值比较 (a, b, c) < (x, y, z) 表达“排在后面”。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import DateTime, literal, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def encode_cursor(mode: str, values: Sequence[Any]) -> str:
+    """把排序模式和上一页最后一行的排序键编码为不透明的字符串"""
+    payload = {
+        "m": mode,
+        "v": [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    }
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, mode: str, columns: Sequence) -> List[Any]:
+    """解码游标，排序模式不一致或格式错误时返回 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload["m"] != mode or len(payload["v"]) != len(columns):
+            raise ValueError("cursor mismatch")
+
+        values = []
+        for column, value in zip(columns, payload["v"]):
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            values.append(value)
+        return values
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
+async def keyset_paginate(
+    db: AsyncSession,
+    query,
+    columns: Sequence,
+    descending: bool,
+    size: int,
+    cursor: Optional[str],
+    mode: str,
+    offset: int = 0,
+    scalars: bool = True
+) -> Tuple[list, Optional[str]]:
+    """
+    按 columns 排序取一页数据，返回 (本页数据, 下一页游标)
+
+    多取一行判断是否还有下一页，没有时游标为 None。没有游标时可以指定 offset，
+    用于兼容按页码跳转的旧客户端，返回的游标同样可以继续向后翻页。
+
+    查询同时选出关联表的列（如 select(Photo, Album.name)）时传 scalars=False，
+    返回完整的行，排序键从每行的第一个实体上读取。
+    """
+    if cursor:
+        values = decode_cursor(cursor, mode, columns)
+        # 绑定参数使用列的类型，保证日期时间的格式与库中存储的一致
+        bound = tuple_(*[literal(value, column.type) for column, value in zip(columns, values)])
+        key = tuple_(*columns)
+        query = query.where(key < bound if descending else key > bound)
+    elif offset:
+        query = query.offset(offset)
+
+    order_by = [column.desc() if descending else column.asc() for column in columns]
+    result = await db.execute(query.order_by(*order_by).limit(size + 1))
+    rows = result.scalars().all() if scalars else result.all()
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1] if scalars else rows[-1][0]
+        next_cursor = encode_cursor(mode, [getattr(last, column.key) for column in columns])
+
+    return rows, next_cursor
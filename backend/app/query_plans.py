@@ -0,0 +1,183 @@
+"""
+热点查询的执行计划检查
+
+这里登记各个列表接口实际执行的查询形态，用 EXPLAIN QUERY PLAN 确认它们都能
+走索引：不允许对表做无索引的全表扫描（SCAN 表名），也不允许为 ORDER BY 建临时
+B 树排序。新增列表查询或修改排序方式时，在 hot_queries 中同步登记。
+
+运行方式: python migrate.py check
+"""
+import re
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import select, func, tuple_, literal, or_
+from sqlalchemy.engine import Connection
+
+from .database import Album, Photo, Blob, TimelineBucket, Job
+from .timeline import latest_photo_query
+from .search import sqlite_search, photos_fts, albums_fts
+from .trash import photo_filter
+
+# 执行计划中出现这些内容说明查询没有用上索引
+BAD_PLAN_MARKERS = ("USE TEMP B-TREE FOR ORDER BY",)
+
+
+def hot_queries() -> List[Tuple[str, object]]:
+    """返回 [(说明, 查询)]，参数取任意值即可，只用于生成执行计划"""
+    album_id = 1
+    live_photo = Photo.is_deleted == False
+    live_album = Album.is_deleted == False
+    cursor_key = tuple_(
+        literal(0, Photo.sort_order.type),
+        literal(datetime(2024, 1, 1), Photo.created_at.type),
+        literal(1, Photo.id.type)
+    )
+    admin_photos = select(Photo, Album.name).join(Album, Album.id == Photo.album_id).where(live_photo)
+    trashed_photos = select(func.count(Photo.id)).where(
+        Photo.album_id == Album.id, Photo.is_deleted == True
+    ).correlate(Album).scalar_subquery()
+
+    return [
+        # albums.get_albums
+        ("API 相册列表", select(Album).order_by(Album.sort_order.desc(), Album.updated_at.desc()).limit(10)),
+        # admin.admin_albums
+        ("后台相册列表", select(Album).where(live_album).order_by(Album.sort_order.desc(), Album.updated_at.desc())),
+        ("后台相册列表(名称)", select(Album).where(live_album).order_by(Album.name.asc())),
+        ("后台相册列表(创建时间)", select(Album).where(live_album).order_by(Album.created_at.desc())),
+        ("后台相册列表(更新时间)", select(Album).where(live_album).order_by(Album.updated_at.desc())),
+        # admin.dashboard
+        ("首页最近相册", select(Album).where(live_album).order_by(Album.updated_at.desc()).limit(5)),
+        ("首页相册数量", select(func.count(Album.id)).where(live_album)),
+        ("首页最近照片", select(Photo).where(live_photo).order_by(Photo.created_at.desc()).limit(10)),
+        ("首页照片数量", select(func.count(Photo.id)).where(live_photo)),
+        # photos.get_photos / photos.get_photos_by_album（游标分页）
+        ("相册照片首页", select(Photo).where(Photo.album_id == album_id).order_by(
+            Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(21)),
+        ("相册照片游标翻页", select(Photo).where(
+            Photo.album_id == album_id,
+            tuple_(Photo.sort_order, Photo.created_at, Photo.id) < cursor_key
+        ).order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(21)),
+        ("相册照片(时间)", select(Photo).where(Photo.album_id == album_id).order_by(
+            Photo.created_at.asc(), Photo.id.asc()).limit(21)),
+        ("相册照片(文件名)", select(Photo).where(Photo.album_id == album_id).order_by(
+            Photo.original_filename.asc(), Photo.id.asc()).limit(21)),
+        ("相册照片(大小)", select(Photo).where(Photo.album_id == album_id).order_by(
+            Photo.file_size.desc(), Photo.id.desc()).limit(21)),
+        ("相册照片数量", select(func.count(Photo.id)).where(Photo.album_id == album_id)),
+        ("相册照片(拍摄时间)", select(Photo).where(
+            Photo.album_id == album_id,
+            tuple_(Photo.taken_at, Photo.id) < tuple_(literal(datetime(2023, 7, 1), Photo.taken_at.type), literal(0, Photo.id.type))
+        ).order_by(Photo.taken_at.desc(), Photo.id.desc()).limit(21)),
+        ("全部照片(拍摄时间)", select(Photo).order_by(Photo.taken_at.desc(), Photo.id.desc()).limit(21)),
+        ("按相机筛选照片", select(Photo).where(Photo.camera_model == "X").order_by(
+            Photo.taken_at.desc(), Photo.id.desc()).limit(21)),
+        ("全部照片", select(Photo).order_by(
+            Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(21)),
+        # admin.admin_album_photos（相册详情页，游标分页）
+        ("后台相册详情", select(Photo).where(Photo.album_id == album_id, live_photo).order_by(
+            Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(101)),
+        ("后台相册详情游标翻页", select(Photo).where(
+            Photo.album_id == album_id, live_photo,
+            tuple_(Photo.sort_order, Photo.created_at, Photo.id) < cursor_key
+        ).order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(101)),
+        ("后台相册详情(文件名)", select(Photo).where(Photo.album_id == album_id, live_photo).order_by(
+            Photo.original_filename.asc(), Photo.id.asc()).limit(101)),
+        # admin.admin_photos_page（照片管理页，关联相册名称）
+        ("后台照片管理", admin_photos.order_by(
+            Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(101)),
+        ("后台照片管理游标翻页", admin_photos.where(
+            tuple_(Photo.sort_order, Photo.created_at, Photo.id) < cursor_key
+        ).order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(101)),
+        ("后台照片管理(时间)", admin_photos.order_by(Photo.created_at.desc(), Photo.id.desc()).limit(101)),
+        ("后台照片管理(文件名)", admin_photos.order_by(Photo.original_filename.asc(), Photo.id.asc()).limit(101)),
+        ("后台照片管理(大小)", admin_photos.order_by(Photo.file_size.desc(), Photo.id.desc()).limit(101)),
+        ("后台照片数量", select(func.count(Photo.id)).where(live_photo)),
+        # admin.admin_trash_albums / admin.admin_trash_photos
+        ("回收站相册", select(Album, trashed_photos).where(Album.is_deleted == True).order_by(
+            Album.deleted_at.desc(), Album.id.desc()).limit(101)),
+        ("回收站照片", select(Photo, Album.name).outerjoin(Album, Album.id == Photo.album_id).where(
+            Photo.is_deleted == True).order_by(Photo.deleted_at.desc(), Photo.id.desc()).limit(101)),
+        ("回收站照片游标翻页", select(Photo, Album.name).outerjoin(Album, Album.id == Photo.album_id).where(
+            Photo.is_deleted == True,
+            tuple_(Photo.deleted_at, Photo.id) < tuple_(literal(datetime(2024, 1, 1), Photo.deleted_at.type), literal(1, Photo.id.type))
+        ).order_by(Photo.deleted_at.desc(), Photo.id.desc()).limit(101)),
+        ("回收站数量", select(func.count(Photo.id)).where(Photo.is_deleted == True)),
+        ("恢复相册的照片", select(Photo).where(Photo.album_id == album_id, Photo.is_deleted == True)),
+        # blobs.find_blob / blobs.release_blobs（上传去重、永久删除）
+        ("按内容查找文件", select(Blob).where(Blob.content_sha256 == "0" * 64)),
+        # similarity.similar_photos / similarity.album_duplicate_groups
+        ("相似照片", select(Photo).where(
+            or_(Photo.dhash_0.in_([1, 2]), Photo.dhash_1.in_([1, 2]), Photo.dhash_2.in_([1, 2]), Photo.dhash_3.in_([1, 2])),
+            Photo.id != 1, live_photo)),
+        ("相册内相似照片", select(Photo.id, Photo.dhash).where(
+            Photo.album_id == album_id, live_photo, Photo.dhash.is_not(None))),
+        # photos.get_timeline / timeline.photos_removed
+        ("时间线", select(TimelineBucket).where(
+            TimelineBucket.album_id == 0, TimelineBucket.level == "month",
+            TimelineBucket.period > "2023", TimelineBucket.period < "2023~"
+        ).order_by(TimelineBucket.period.desc())),
+        ("时间线重选封面", latest_photo_query((0, "month", "2023-06"), [1])),
+        ("相册时间线重选封面", latest_photo_query((album_id, "day", "2023-06-15"), [1])),
+        # search.search（SQLite 全文索引）
+        search_query("搜索照片", Photo, photos_fts, ("original_filename", "description"), [live_photo]),
+        search_query("搜索相册内照片", Photo, photos_fts, ("original_filename", "description"),
+                     [live_photo, Photo.album_id == album_id]),
+        search_query("搜索相册", Album, albums_fts, ("name", "description"), [live_album]),
+        # ordering.reorder_photos / reorder_albums（新位置的下一项；没有空位时读出整个范围重新编号）
+        ("拖动排序：照片新位置的下一项", select(Photo.id, Photo.sort_order).where(
+            tuple_(Photo.sort_order, Photo.created_at, Photo.id) < cursor_key,
+            Photo.album_id == album_id, live_photo
+        ).order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc()).limit(2)),
+        ("拖动排序：相册内照片重新编号", select(Photo.id, Photo.sort_order).where(
+            Photo.album_id == album_id, live_photo
+        ).order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc())),
+        ("拖动排序：相册新位置的下一项", select(Album.id, Album.sort_order).where(
+            tuple_(Album.sort_order, Album.updated_at, Album.id) < tuple_(
+                literal(0, Album.sort_order.type), literal(datetime(2024, 1, 1), Album.updated_at.type), literal(1, Album.id.type)),
+            live_album
+        ).order_by(Album.sort_order.desc(), Album.updated_at.desc(), Album.id.desc()).limit(2)),
+        ("拖动排序：相册重新编号", select(Album.id, Album.sort_order).where(live_album).order_by(
+            Album.sort_order.desc(), Album.updated_at.desc(), Album.id.desc())),
+        # jobs.JobQueue
+        ("领取后台任务", select(Job.id).where(
+            Job.status == "pending", Job.run_after <= datetime(2024, 1, 1), Job.type.in_(["derivatives", "delete_files"])
+        ).order_by(Job.run_after, Job.id).limit(1)),
+        ("最近失败的后台任务", select(Job).where(Job.status == "failed").order_by(Job.finished_at.desc()).limit(10)),
+        ("未完成的永久删除任务", select(Job).where(Job.status.in_(["pending", "running"]), Job.type == "purge_trash")),
+        # trash.purge_photo_batch
+        ("清空回收站（每批）", select(Photo).where(*photo_filter(None, datetime(2024, 1, 1))).limit(500)),
+        ("永久删除相册（每批）", select(Photo).where(*photo_filter(album_id, datetime(2024, 1, 1))).limit(500)),
+    ]
+
+
+def search_query(name: str, model, fts, text_columns, filters) -> Tuple[str, object]:
+    query, order_by = sqlite_search(model, fts, text_columns, ["海边日落", "ab"])
+    return name, query.where(*filters).order_by(*order_by).limit(21)
+
+
+def explain(conn: Connection, query) -> List[str]:
+    """返回 SQLite 的执行计划（每个步骤一行）"""
+    sql = str(query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [row[-1] for row in rows]
+
+
+def plan_uses_index(plan: List[str]) -> bool:
+    for step in plan:
+        if any(marker in step for marker in BAD_PLAN_MARKERS):
+            return False
+        # "SCAN photos" 是全表扫描；"SCAN photos USING INDEX ..." 是按索引顺序扫描；
+        # "SCAN photos_fts VIRTUAL TABLE INDEX 32:M2" 是 FTS5 按 MATCH 查找
+        if step.startswith("SCAN ") and " USING " not in step and not re.search(r"VIRTUAL TABLE INDEX \d+:M", step):
+            return False
+    return True
+
+
+def check_query_plans(conn: Connection) -> List[Tuple[str, List[str], bool]]:
+    """返回 [(说明, 执行计划, 是否走索引)]"""
+    results = []
+    for name, query in hot_queries():
+        plan = explain(conn, query)
+        results.append((name, plan, plan_uses_index(plan)))
+    return results
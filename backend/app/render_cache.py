@@ -0,0 +1,138 @@
+"""
+按需渲染图片的磁盘缓存
+
+/api/photos/{id}/render 首次请求某个尺寸时才生成图片，结果写入缓存目录，之后直接
+返回文件。缓存总大小有上限，超出时按最近最少使用（LRU）淘汰；同一个缓存键的并发
+请求只渲染一次，其余请求等待同一个渲染任务的结果。
+"""
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+from .config import settings
+
+
+class RenderCache:
+    """有大小上限的 LRU 磁盘缓存"""
+
+    def __init__(self):
+        # 缓存键 -> 文件大小，按最近使用时间从旧到新排列
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._loaded = False
+
+    @property
+    def directory(self) -> str:
+        return settings.render_cache_dir
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def load(self):
+        """扫描缓存目录重建索引（启动时调用，重复调用无副作用）"""
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.startswith("."):
+                # 上次退出时未写完的临时文件
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        # 重启后无法得知访问顺序，按写入时间近似
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+
+        if files:
+            print(f"[缓存] 渲染缓存: {len(self._entries)} 个文件，{self._total_bytes / 1024 / 1024:.1f}MB")
+
+    def lookup(self, key: str):
+        """命中时返回文件路径并标记为最近使用，未命中返回 None"""
+        self.load()
+        if key not in self._entries:
+            return None
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            self._total_bytes -= self._entries.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return path
+
+    async def get_or_render(self, key: str, render: Callable[[str], Awaitable[None]]) -> str:
+        """
+        返回缓存文件路径，未命中时调用 render(输出路径) 生成
+
+        渲染在独立的任务中执行，发起请求的客户端断开也不会中断渲染，
+        同时到达的相同请求共享这个任务。
+        """
+        path = self.lookup(key)
+        if path:
+            return path
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(key, render))
+            self._pending[key] = task
+        return await asyncio.shield(task)
+
+    async def _render(self, key: str, render: Callable[[str], Awaitable[None]]) -> str:
+        path = self.path_for(key)
+        temp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            await render(temp_path)
+            os.replace(temp_path, path)
+            self._add(key, os.path.getsize(path))
+            return path
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self._pending.pop(key, None)
+
+    def _add(self, key: str, size: int):
+        if key in self._entries:
+            self._total_bytes -= self._entries.pop(key)
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        # 至少保留刚写入的那一个文件
+        while self._total_bytes > settings.render_cache_max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            path = self.path_for(key)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def discard_photo(self, filename: str):
+        """删除某张照片的全部渲染结果（照片被永久删除时调用）"""
+        self.load()
+        prefix = f"{os.path.splitext(filename)[0]}_"
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            self._total_bytes -= self._entries.pop(key)
+            path = self.path_for(key)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stats(self) -> Dict:
+        return {
+            "files": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": settings.render_cache_max_bytes,
+            "pending": len(self._pending)
+        }
+
+
+render_cache = RenderCache()
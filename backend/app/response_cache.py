@@ -0,0 +1,163 @@
+"""
+相册和照片列表接口的进程内响应缓存
+
+相册一天只改几次，列表却被反复读取。这里缓存序列化好的 JSON 字节，缓存键是
+接口名加规范化后的查询参数，命中时不查数据库、也不重新构建 pydantic 模型。
+
+失效靠代数（generation）计数：每个相册一个计数，另有一个全局计数。缓存条目
+记录写入前读到的计数，读取时计数已变化就视为过期。相册或其中的照片有改动时，
+在事务提交之后把该相册的计数和全局计数加一：
+- 按相册查询的接口（相册详情、某个相册的照片）只看该相册的计数，
+  其他相册的改动不影响它们的缓存；
+- 跨相册的接口（相册列表、全部照片）看全局计数。
+
+哪些相册被改动由 album_versions 跟踪，它在提交后调用 bump()。
+
+代数只在当前进程内递增，其他进程或其他服务器上的写入不会通知到这里。因此
+respond() 还要求传入从数据库读出的版本（即接口的 ETag，见 album_versions），
+条目和写入时的版本一起保存，命中时版本不一致也视为过期。这样多进程、多台
+服务器部署时也不会返回比 ETag 更旧的内容；代数只是让本进程的写入立即失效。
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from .config import settings
+
+# 无法确定涉及哪些相册时，让所有缓存失效
+ALL_ALBUMS = "*"
+
+
+def render_json(content: Any) -> bytes:
+    """按 FastAPI JSONResponse 的方式序列化"""
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+class ResponseCache:
+    """有大小上限和 TTL 的 LRU 缓存，按相册代数失效"""
+
+    def __init__(self):
+        # 缓存键 -> (JSON 字节, 过期时间, 写入时的代数, 写入时的数据库版本)
+        self._entries: "OrderedDict[Tuple, Tuple[bytes, float, Tuple[int, int], Optional[str]]]" = OrderedDict()
+        self._total_bytes = 0
+        self._epoch = 0
+        self._global_generation = 0
+        self._album_generations: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict[str, Any]) -> Tuple:
+        """接口名 + 按名称排序的查询参数，值为 None 的参数忽略"""
+        return (endpoint,) + tuple(sorted((name, value) for name, value in params.items() if value is not None))
+
+    def generation(self, album_id: Optional[int] = None) -> Tuple[int, int]:
+        """album_id 为 None 时返回全局代数"""
+        if album_id is None:
+            return self._epoch, self._global_generation
+        return self._epoch, self._album_generations.get(album_id, 0)
+
+    def get(self, key: Tuple, album_id: Optional[int] = None, version: Optional[str] = None) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            body, expires_at, generation, entry_version = entry
+            if (expires_at > time.monotonic() and generation == self.generation(album_id)
+                    and entry_version == version):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple, body: bytes, generation: Tuple[int, int], version: Optional[str] = None):
+        """写入缓存；generation 和 version 必须是查询数据库之前读到的代数和版本"""
+        if len(body) > settings.response_cache_max_bytes // 4:
+            # 单个响应太大时不缓存，避免一次挤掉所有条目
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (body, time.monotonic() + settings.response_cache_ttl_seconds, generation, version)
+        self._total_bytes += len(body)
+        while self._total_bytes > settings.response_cache_max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple):
+        body, _, _, _ = self._entries.pop(key)
+        self._total_bytes -= len(body)
+
+    async def respond(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        build: Callable[[], Awaitable[Any]],
+        album_id: Optional[int] = None,
+        version: Optional[str] = None
+    ) -> Response:
+        """
+        返回缓存的响应，未命中时调用 build() 生成内容并缓存
+
+        album_id 表示结果只依赖这个相册的数据；跨相册的接口传 None。
+        version 是本次请求从数据库读出的版本（接口返回的 ETag），缓存条目的版本
+        与之不同时重新生成，保证响应内容和 ETag 对应。
+        build() 抛出的异常（例如 404）直接向上传递，不会被缓存。
+        """
+        if not settings.response_cache_enabled:
+            return Response(render_json(await build()), media_type="application/json")
+
+        key = self.make_key(endpoint, params)
+        body = self.get(key, album_id, version)
+        if body is not None:
+            return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+        # 先记下代数再查询，查询期间有写入提交时这条缓存一写入就是过期的
+        generation = self.generation(album_id)
+        body = render_json(await build())
+        self.put(key, body, generation, version)
+        return Response(body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+    def bump(self, album_ids: Iterable):
+        """相册的数据已提交修改，使相关缓存失效"""
+        album_ids = set(album_ids)
+        if not album_ids:
+            return
+        self.invalidations += 1
+        if ALL_ALBUMS in album_ids:
+            self._epoch += 1
+            self._entries.clear()
+            self._total_bytes = 0
+            return
+        self._global_generation += 1
+        for album_id in album_ids:
+            self._album_generations[album_id] = self._album_generations.get(album_id, 0) + 1
+
+    def clear(self):
+        self.bump([ALL_ALBUMS])
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": settings.response_cache_enabled,
+            "entries": len(self._entries),
+            "total_bytes": self._total_bytes,
+            "max_bytes": settings.response_cache_max_bytes,
+            "ttl_seconds": settings.response_cache_ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+
+response_cache = ResponseCache()
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Depends, Form, UploadFile, File, HTTPException, Cookie
+from fastapi import APIRouter, Request, Depends, Form, UploadFile, File, HTTPException, Cookie, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -6,14 +6,24 @@ from sqlalchemy import select, func, delete
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
-import os
 import hashlib
 import secrets
 
-from ..database import get_db, Album, Photo
+from ..database import get_db, get_read_db, Album, Photo
 from ..config import settings
-from .upload import save_uploaded_file, validate_file
-from .photos import photo_to_response
+from ..derivatives import photo_url_path
+from ..render_cache import render_cache
+from ..ingest import ingest_files, enqueue_file_deletion
+from ..album_stats import photos_added, photos_removed
+from ..response_cache import response_cache
+from ..album_versions import touch_albums
+from ..blobs import release_blobs
+from ..jobs import job_queue, job_status, retry_job
+from ..trash import enqueue_purge, purge_progress, trash_album
+from ..ordering import new_album_sort_order, reorder_albums, reorder_photos
+from ..similarity import MAX_DISTANCE, album_duplicate_groups, similar_photos, hamming
+from ..pagination import keyset_paginate
+from .photos import photo_to_response, photo_sort_keys, list_photos
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -21,6 +31,10 @@ templates = Jinja2Templates(directory="templates")
 # 存储有效的session tokens（在生产环境中应该使用Redis或数据库）
 valid_sessions = set()
 
+# 相册详情、照片管理、回收站页面的照片由前端按游标分页加载（见 base.html 中的 VirtualGrid），
+# 页面本身只渲染框架和统计数字
+ADMIN_PAGE_SIZE = 100
+
 def generate_session_token() -> str:
     """生成session token"""
     return secrets.token_urlsafe(32)
@@ -52,6 +66,15 @@ class AlbumSortRequest(BaseModel):
     sort_order: int
 
 
+class ReorderMove(BaseModel):
+    id: int
+    after_id: Optional[int] = None  # 移到这一项后面（按显示顺序），为空时移到最前面
+
+
+class ReorderRequest(BaseModel):
+    moves: List[ReorderMove]
+
+
 class PhotoSortRequest(BaseModel):
     sort_order: int
 
@@ -106,7 +129,7 @@ async def admin_logout(admin_session: Optional[str] = Cookie(None)):
 
 
 @router.get("/", response_class=HTMLResponse, summary="管理后台首页")
-async def admin_dashboard(request: Request, db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
+async def admin_dashboard(request: Request, db: AsyncSession = Depends(get_read_db), _: bool = Depends(require_admin_auth)):
     """管理后台首页"""
     # 获取统计数据（只统计未删除的）
     albums_count = await db.execute(select(func.count(Album.id)).where(Album.is_deleted == False))
@@ -130,7 +153,8 @@ async def admin_dashboard(request: Request, db: AsyncSession = Depends(get_db),
         "albums_count": albums_count.scalar() or 0,
         "photos_count": photos_count.scalar() or 0,
         "recent_albums": recent_albums,
-        "recent_photos": recent_photos_data[:6]  # 只显示6张
+        "recent_photos": recent_photos_data[:6],  # 只显示6张
+        "jobs": await job_queue.stats(db)
     })
 
 
@@ -139,7 +163,7 @@ async def admin_albums(
     request: Request, 
     sort_by: str = "default",  # 默认使用自定义排序
     order: str = "desc",  # 默认降序
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     _: bool = Depends(require_admin_auth)
 ):
     """相册管理页面"""
@@ -163,17 +187,11 @@ async def admin_albums(
     )
     albums = albums_result.scalars().all()
     
-    # 为每个相册计算照片数量
-    albums_with_count = []
-    for album in albums:
-        photo_count_result = await db.execute(
-            select(func.count(Photo.id)).where(Photo.album_id == album.id)
-        )
-        photo_count = photo_count_result.scalar() or 0
-        albums_with_count.append({
-            "album": album,
-            "photo_count": photo_count
-        })
+    # 照片数量直接读取相册表中维护的计数
+    albums_with_count = [
+        {"album": album, "photo_count": album.photo_count}
+        for album in albums
+    ]
     
     return templates.TemplateResponse("albums.html", {
         "request": request,
@@ -190,8 +208,8 @@ async def create_album(
     db: AsyncSession = Depends(get_db),
     _: bool = Depends(require_admin_auth)
 ):
-    """创建新相册"""
-    album = Album(name=name, description=description)
+    """创建新相册（排在最前面）"""
+    album = Album(name=name, description=description, sort_order=await new_album_sort_order(db))
     db.add(album)
     await db.commit()
     return RedirectResponse(url="/admin/albums", status_code=303)
@@ -233,21 +251,8 @@ async def delete_album(album_id: int, db: AsyncSession = Depends(get_db), _: boo
     if not album:
         raise HTTPException(status_code=404, detail="相册不存在")
     
-    # 获取该相册下的所有照片
-    photos_result = await db.execute(
-        select(Photo).where(Photo.album_id == album_id, Photo.is_deleted == False)
-    )
-    photos = photos_result.scalars().all()
-    
-    # 软删除相册
-    album.is_deleted = True
-    album.deleted_at = datetime.utcnow()
-    
-    # 软删除该相册下的所有照片
-    for photo in photos:
-        photo.is_deleted = True
-        photo.deleted_at = datetime.utcnow()
-    
+    # 软删除相册和其中的照片
+    await trash_album(db, album)
     await db.commit()
     
     return RedirectResponse(url="/admin/albums?message=相册已移入回收站", status_code=303)
@@ -262,7 +267,7 @@ async def admin_album_detail(
     db: AsyncSession = Depends(get_db),
     _: bool = Depends(require_admin_auth)
 ):
-    """相册详情页面"""
+    """相册详情页面（照片由 /admin/api/album/{album_id}/photos 分页加载）"""
     # 获取相册信息（只显示未删除的）
     album_result = await db.execute(
         select(Album).where(Album.id == album_id, Album.is_deleted == False)
@@ -272,46 +277,48 @@ async def admin_album_detail(
     if not album:
         raise HTTPException(status_code=404, detail="相册不存在")
     
-    # 构建照片排序条件
-    if sort_by == "default":
-        # 默认排序：先按自定义排序，再按创建时间倒序
-        order_by = [Photo.sort_order.desc(), Photo.created_at.desc()]
-    else:
-        # 用户选择的排序
-        sort_column = getattr(Photo, sort_by, Photo.created_at)
-        if order == "asc":
-            order_by = [sort_column.asc()]
-        else:
-            order_by = [sort_column.desc()]
-    
-    # 获取照片列表（只显示未删除的）
-    photos_result = await db.execute(
-        select(Photo)
-        .where(Photo.album_id == album_id, Photo.is_deleted == False)
-        .order_by(*order_by)
-    )
-    photos = photos_result.scalars().all()
-    photos_data = [photo_to_response(photo) for photo in photos]
-    
     # 如果相册没有封面且有照片，自动设置第一张照片为封面
-    if not album.cover_image and photos:
-        first_photo = photos[0]
-        album.cover_image = photo_to_response(first_photo).url
-        await db.commit()
+    if not album.cover_image and album.photo_count:
+        first_result = await db.execute(
+            select(Photo)
+            .where(Photo.album_id == album_id, Photo.is_deleted == False)
+            .order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc())
+            .limit(1)
+        )
+        first_photo = first_result.scalar_one_or_none()
+        if first_photo:
+            album.cover_image = photo_to_response(first_photo).url
+            await db.commit()
     
     return templates.TemplateResponse("album_detail.html", {
         "request": request,
         "album": album,
-        "photos": photos_data,
         "current_sort": sort_by,
         "current_order": order
     })
 
 
+@router.get("/api/album/{album_id}/photos", summary="相册详情页的照片（游标分页）")
+async def admin_album_photos(
+    album_id: int,
+    sort_by: str = "default",
+    order: str = "desc",
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    size: int = Query(ADMIN_PAGE_SIZE, ge=1, le=500, description="每页数量"),
+    db: AsyncSession = Depends(get_read_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """相册中未删除的照片，翻页时传入上一页返回的 next_cursor"""
+    return await list_photos(
+        db, [Photo.album_id == album_id, Photo.is_deleted == False], sort_by, order, 1, size, cursor, False
+    )
+
+
 @router.post("/album/{album_id}/upload", summary="上传照片到相册")
 async def upload_photos_to_album(
     album_id: int,
     files: List[UploadFile] = File(...),
+    batch_id: Optional[str] = Form(None),
     db: AsyncSession = Depends(get_db),
     _: bool = Depends(require_admin_auth)
 ):
@@ -325,30 +332,12 @@ async def upload_photos_to_album(
     if not album:
         raise HTTPException(status_code=404, detail="相册不存在")
     
-    uploaded_count = 0
-    for file in files:
-        try:
-            validate_file(file)
-            filename, file_path, file_size, width, height = await save_uploaded_file(file)
-            
-            photo = Photo(
-                album_id=album_id,
-                filename=filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                file_size=file_size,
-                width=width,
-                height=height
-            )
-            
-            db.add(photo)
-            uploaded_count += 1
-            
-        except Exception as e:
-            print(f"上传 {file.filename} 失败: {e}")
-            continue
+    # 并发处理所有文件，最后一次性写入数据库
+    photos, progress = await ingest_files(db, album_id, files, batch_id)
+    for item in progress["files"]:
+        if item["status"] == "failed":
+            print(f"上传 {item['filename']} 失败: {item['error']}")
     
-    await db.commit()
     return RedirectResponse(url=f"/admin/album/{album_id}", status_code=303)
 
 
@@ -357,40 +346,45 @@ async def admin_photos(
     request: Request, 
     sort_by: str = "default",  # 默认使用自定义排序
     order: str = "desc",  # 默认降序
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     _: bool = Depends(require_admin_auth)
 ):
-    """照片管理页面"""
-    # 构建排序条件
-    if sort_by == "default":
-        # 默认排序：先按自定义排序，再按创建时间倒序
-        order_by = [Photo.sort_order.desc(), Photo.created_at.desc()]
-    else:
-        # 用户选择的排序
-        sort_column = getattr(Photo, sort_by, Photo.created_at)
-        if order == "asc":
-            order_by = [sort_column.asc()]
-        else:
-            order_by = [sort_column.desc()]
-    
-    # 只显示未删除的照片
-    photos_result = await db.execute(
-        select(Photo)
-        .where(Photo.is_deleted == False)
-        .order_by(*order_by)
-        .limit(50)
-    )
-    photos = photos_result.scalars().all()
-    photos_data = [photo_to_response(photo) for photo in photos]
+    """照片管理页面（照片由 /admin/api/photos 分页加载）"""
+    photos_count = await db.execute(select(func.count(Photo.id)).where(Photo.is_deleted == False))
     
     return templates.TemplateResponse("photos.html", {
         "request": request,
-        "photos": photos_data,
+        "total_photos": photos_count.scalar() or 0,
         "current_sort": sort_by,
         "current_order": order
     })
 
 
+@router.get("/api/photos", summary="照片管理页的照片（游标分页）")
+async def admin_photos_page(
+    sort_by: str = "default",
+    order: str = "desc",
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    size: int = Query(ADMIN_PAGE_SIZE, ge=1, le=500, description="每页数量"),
+    db: AsyncSession = Depends(get_read_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """所有未删除的照片，连同所在相册的名称一起查出"""
+    mode, columns, descending = photo_sort_keys(sort_by, order)
+    rows, next_cursor = await keyset_paginate(
+        db,
+        select(Photo, Album.name).join(Album, Album.id == Photo.album_id).where(Photo.is_deleted == False),
+        columns, descending, size, cursor, mode, scalars=False
+    )
+    
+    items = []
+    for photo, album_name in rows:
+        item = photo_to_response(photo).model_dump()
+        item["album_name"] = album_name
+        items.append(item)
+    return {"items": items, "next_cursor": next_cursor, "has_more": next_cursor is not None}
+
+
 @router.post("/photo/{photo_id}/delete", summary="删除照片")
 async def delete_photo(photo_id: int, db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
     """删除单张照片（移入回收站）"""
@@ -406,6 +400,7 @@ async def delete_photo(photo_id: int, db: AsyncSession = Depends(get_db), _: boo
         # 软删除照片
         photo.is_deleted = True
         photo.deleted_at = datetime.utcnow()
+        await photos_removed(db, [photo])
         await db.commit()
         
         return RedirectResponse(url=f"/admin/album/{album_id}?message=照片已移入回收站", status_code=303)
@@ -417,6 +412,7 @@ async def delete_photo(photo_id: int, db: AsyncSession = Depends(get_db), _: boo
 async def batch_delete_photos(
     photo_ids: str = Form(...),  # 逗号分隔的照片ID
     album_id: int = Form(None),  # 相册ID，用于重定向
+    redirect_to: str = Form(None),  # 完成后返回的后台页面（如相似照片页）
     db: AsyncSession = Depends(get_db),
     _: bool = Depends(require_admin_auth)
 ):
@@ -446,10 +442,14 @@ async def batch_delete_photos(
             photo.is_deleted = True
             photo.deleted_at = datetime.utcnow()
             deleted_count += 1
+        await photos_removed(db, photos)
         
         await db.commit()
         
-        # 重定向到相册页面或照片管理页面
+        # 重定向到指定页面、相册页面或照片管理页面
+        if redirect_to and redirect_to.startswith("/admin/"):
+            separator = "&" if "?" in redirect_to else "?"
+            return RedirectResponse(url=f"{redirect_to}{separator}message=已将{deleted_count}张照片移入回收站", status_code=303)
         if redirect_album_id:
             return RedirectResponse(url=f"/admin/album/{redirect_album_id}?message=已将{deleted_count}张照片移入回收站", status_code=303)
         else:
@@ -485,8 +485,63 @@ async def edit_photo(
     return RedirectResponse(url=f"/admin/album/{photo.album_id}", status_code=303)
 
 
+@router.get("/duplicates", response_class=HTMLResponse, summary="相似照片页面")
+async def admin_duplicates(
+    request: Request,
+    album_id: Optional[int] = None,
+    photo_id: Optional[int] = None,
+    max_distance: int = settings.similar_max_distance,
+    db: AsyncSession = Depends(get_read_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """相似照片审核：按相册分组，或查找某张照片的相似照片"""
+    max_distance = max(0, min(max_distance, MAX_DISTANCE))
+    albums_result = await db.execute(
+        select(Album.id, Album.name).where(Album.is_deleted == False).order_by(Album.name.asc())
+    )
+    albums = [{"id": row.id, "name": row.name} for row in albums_result.all()]
+
+    groups = []
+    target = None
+    if photo_id is not None:
+        photo_result = await db.execute(select(Photo).where(Photo.id == photo_id))
+        photo = photo_result.scalar_one_or_none()
+        if not photo:
+            raise HTTPException(status_code=404, detail="照片不存在")
+        target = photo_to_response(photo)
+        matches = await similar_photos(db, photo, max_distance)
+        if matches:
+            groups.append([{"photo": target, "distance": 0}] + [
+                {"photo": photo_to_response(match), "distance": distance} for match, distance in matches
+            ])
+    elif album_id is not None:
+        for members in await album_duplicate_groups(db, album_id, max_distance):
+            first = members[0]
+            groups.append([
+                {"photo": photo_to_response(member), "distance": hamming(first.dhash, member.dhash)}
+                for member in members
+            ])
+
+    # 未计算感知哈希的照片不参与查找
+    pending_result = await db.execute(
+        select(func.count(Photo.id)).where(Photo.dhash.is_(None), Photo.is_deleted == False)
+    )
+
+    return templates.TemplateResponse("duplicates.html", {
+        "request": request,
+        "albums": albums,
+        "album_id": album_id,
+        "target": target,
+        "groups": groups,
+        "max_distance": max_distance,
+        "max_distance_limit": MAX_DISTANCE,
+        "pending_count": pending_result.scalar(),
+        "current_url": str(request.url.path) + (f"?{request.url.query}" if request.url.query else "")
+    })
+
+
 @router.get("/upload", response_class=HTMLResponse, summary="批量上传页面")
-async def admin_upload(request: Request, db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
+async def admin_upload(request: Request, db: AsyncSession = Depends(get_read_db), _: bool = Depends(require_admin_auth)):
     """批量上传页面"""
     # 获取所有相册（只显示未删除的）
     albums_result = await db.execute(
@@ -535,6 +590,39 @@ async def set_album_cover(
     return {"message": "封面设置成功", "album_id": album_id, "cover_photo_id": cover_data.cover_photo_id}
 
 
+@router.post("/albums/reorder", summary="批量调整相册顺序")
+async def reorder_albums_admin(
+    reorder: ReorderRequest,
+    db: AsyncSession = Depends(get_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """拖动排序：在一个事务中执行所有移动，通常只改写被移动的相册"""
+    try:
+        changed = await reorder_albums(db, [(move.id, move.after_id) for move in reorder.moves])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    
+    return {"message": "排序更新成功", "sort_orders": changed}
+
+
+@router.post("/album/{album_id}/photos/reorder", summary="批量调整照片顺序")
+async def reorder_photos_admin(
+    album_id: int,
+    reorder: ReorderRequest,
+    db: AsyncSession = Depends(get_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """拖动排序：在一个事务中执行相册内的所有移动，通常只改写被移动的照片"""
+    try:
+        changed = await reorder_photos(db, album_id, [(move.id, move.after_id) for move in reorder.moves])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db.commit()
+    
+    return {"message": "排序更新成功", "album_id": album_id, "sort_orders": changed}
+
+
 @router.put("/album/{album_id}/sort", summary="更新相册排序")
 async def update_album_sort_admin(
     album_id: int,
@@ -579,75 +667,138 @@ async def update_photo_sort_admin(
     return {"message": "排序更新成功", "photo_id": photo_id, "sort_order": sort_data.sort_order}
 
 
+@router.get("/cache/stats", summary="缓存统计")
+async def cache_stats(_: bool = Depends(require_admin_auth)):
+    """列表接口响应缓存和渲染缓存的命中情况"""
+    return {
+        "response_cache": response_cache.stats(),
+        "render_cache": render_cache.stats()
+    }
+
+
+@router.get("/jobs/stats", summary="后台任务统计")
+async def job_stats(db: AsyncSession = Depends(get_read_db), _: bool = Depends(require_admin_auth)):
+    """各类型后台任务的队列长度、等待时间和执行耗时"""
+    return await job_queue.stats(db)
+
+
+@router.get("/jobs/{job_id}", summary="后台任务状态")
+async def get_job_status(job_id: int, db: AsyncSession = Depends(get_read_db), _: bool = Depends(require_admin_auth)):
+    """任务的状态和进度（回收站页面轮询永久删除的进度）"""
+    job = await job_status(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@router.post("/jobs/{job_id}/retry", summary="重试失败的后台任务")
+async def retry_failed_job(job_id: int, db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
+    """把失败的任务重新排队"""
+    try:
+        found = await retry_job(db, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="任务不存在或没有失败")
+    await db.commit()
+    return RedirectResponse(url="/admin/", status_code=303)
+
+
+@router.post("/cache/clear", summary="清空响应缓存")
+async def clear_response_cache(_: bool = Depends(require_admin_auth)):
+    """直接修改数据库后，用于立即清空列表接口的响应缓存"""
+    response_cache.clear()
+    return {"message": "响应缓存已清空"}
+
+
 # 回收站相关路由
 @router.get("/trash", response_class=HTMLResponse, summary="回收站页面")
-async def admin_trash(request: Request, db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
-    """回收站页面"""
-    # 获取已删除的相册
-    deleted_albums_result = await db.execute(
-        select(Album)
-        .where(Album.is_deleted == True)
-        .order_by(Album.deleted_at.desc())
+async def admin_trash(request: Request, db: AsyncSession = Depends(get_read_db), _: bool = Depends(require_admin_auth)):
+    """回收站页面（相册和照片由 /admin/api/trash/albums、/admin/api/trash/photos 分页加载）"""
+    albums_count = await db.execute(select(func.count(Album.id)).where(Album.is_deleted == True))
+    photos_count = await db.execute(select(func.count(Photo.id)).where(Photo.is_deleted == True))
+    
+    return templates.TemplateResponse("trash.html", {
+        "request": request,
+        "total_albums": albums_count.scalar() or 0,
+        "total_photos": photos_count.scalar() or 0,
+        "purges": await purge_progress(db),
+        "retention_days": settings.trash_retention_days,
+        "message": request.query_params.get("message")
+    })
+
+
+# 回收站按删除时间倒序，最后一列是主键，保证游标分页的顺序唯一
+TRASH_ALBUM_KEYS = [Album.deleted_at, Album.id]
+TRASH_PHOTO_KEYS = [Photo.deleted_at, Photo.id]
+
+
+@router.get("/api/trash/albums", summary="回收站中的相册（游标分页）")
+async def admin_trash_albums(
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    size: int = Query(ADMIN_PAGE_SIZE, ge=1, le=500, description="每页数量"),
+    db: AsyncSession = Depends(get_read_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """已删除的相册，照片数量（回收站中属于该相册的照片）由关联子查询在同一条语句中统计"""
+    trashed_photos = (
+        select(func.count(Photo.id))
+        .where(Photo.album_id == Album.id, Photo.is_deleted == True)
+        .correlate(Album)
+        .scalar_subquery()
+    )
+    rows, next_cursor = await keyset_paginate(
+        db,
+        select(Album, trashed_photos).where(Album.is_deleted == True),
+        TRASH_ALBUM_KEYS, True, size, cursor, "trash_albums", scalars=False
     )
-    deleted_albums = deleted_albums_result.scalars().all()
     
-    # 获取已删除的照片
-    deleted_photos_result = await db.execute(
-        select(Photo)
-        .where(Photo.is_deleted == True)
-        .order_by(Photo.deleted_at.desc())
+    items = [
+        {
+            "id": album.id,
+            "name": album.name,
+            "description": album.description,
+            "cover_image": album.cover_image,
+            "photo_count": photo_count,
+            "deleted_at": album.deleted_at,
+            "created_at": album.created_at
+        }
+        for album, photo_count in rows
+    ]
+    return {"items": items, "next_cursor": next_cursor, "has_more": next_cursor is not None}
+
+
+@router.get("/api/trash/photos", summary="回收站中的照片（游标分页）")
+async def admin_trash_photos(
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    size: int = Query(ADMIN_PAGE_SIZE, ge=1, le=500, description="每页数量"),
+    db: AsyncSession = Depends(get_read_db),
+    _: bool = Depends(require_admin_auth)
+):
+    """已删除的照片，相册名称通过关联查询一起查出"""
+    rows, next_cursor = await keyset_paginate(
+        db,
+        select(Photo, Album.name).outerjoin(Album, Album.id == Photo.album_id).where(Photo.is_deleted == True),
+        TRASH_PHOTO_KEYS, True, size, cursor, "trash_photos", scalars=False
     )
-    deleted_photos = deleted_photos_result.scalars().all()
     
-    # 为已删除的照片获取相册名称
-    photos_data = []
-    for photo in deleted_photos:
-        album_result = await db.execute(
-            select(Album).where(Album.id == photo.album_id)
-        )
-        album = album_result.scalar_one_or_none()
-        album_name = album.name if album else "未知相册"
-        
-        photos_data.append({
+    items = [
+        {
             "id": photo.id,
             "album_id": photo.album_id,
-            "album_name": album_name,
+            "album_name": album_name or "未知相册",
             "filename": photo.filename,
             "original_filename": photo.original_filename,
             "file_size": photo.file_size,
             "description": photo.description,
             "deleted_at": photo.deleted_at,
-            "url": f"/uploads/{photo.filename}",
-            "thumbnail_url": f"/uploads/thumb_{photo.filename}",
+            "url": photo_url_path(photo),
+            "thumbnail_url": photo_url_path(photo, "thumb"),
             "created_at": photo.created_at
-        })
-    
-    # 统计相册中的照片数量
-    albums_data = []
-    for album in deleted_albums:
-        photo_count_result = await db.execute(
-            select(func.count(Photo.id))
-            .where(Photo.album_id == album.id, Photo.is_deleted == True)
-        )
-        photo_count = photo_count_result.scalar()
-        
-        albums_data.append({
-            "id": album.id,
-            "name": album.name,
-            "description": album.description,
-            "cover_image": album.cover_image,
-            "photo_count": photo_count,
-            "deleted_at": album.deleted_at,
-            "created_at": album.created_at
-        })
-    
-    return templates.TemplateResponse("trash.html", {
-        "request": request,
-        "albums": albums_data,
-        "photos": photos_data,
-        "total_albums": len(albums_data),
-        "total_photos": len(photos_data)
-    })
+        }
+        for photo, album_name in rows
+    ]
+    return {"items": items, "next_cursor": next_cursor, "has_more": next_cursor is not None}
 
 
 @router.post("/trash/album/{album_id}/restore", summary="恢复相册")
@@ -675,6 +826,7 @@ async def restore_album(album_id: int, db: AsyncSession = Depends(get_db), _: bo
     for photo in photos:
         photo.is_deleted = False
         photo.deleted_at = None
+    await photos_added(db, photos)
     
     await db.commit()
     
@@ -696,6 +848,7 @@ async def restore_photo(photo_id: int, db: AsyncSession = Depends(get_db), _: bo
     # 恢复照片
     photo.is_deleted = False
     photo.deleted_at = None
+    await photos_added(db, [photo])
     
     await db.commit()
     
@@ -704,40 +857,17 @@ async def restore_photo(photo_id: int, db: AsyncSession = Depends(get_db), _: bo
 
 @router.post("/trash/album/{album_id}/delete-permanently", summary="永久删除相册")
 async def delete_album_permanently(album_id: int, db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
-    """永久删除相册（包括所有照片文件）"""
-    # 获取已删除的相册
+    """永久删除相册（包括所有照片文件），由后台任务分批删除，回收站页面显示进度"""
     album_result = await db.execute(
-        select(Album).where(Album.id == album_id, Album.is_deleted == True)
+        select(Album.id).where(Album.id == album_id, Album.is_deleted == True)
     )
-    album = album_result.scalar_one_or_none()
-    
-    if not album:
+    if album_result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="相册不存在或未被删除")
     
-    # 获取该相册下的所有已删除照片
-    photos_result = await db.execute(
-        select(Photo).where(Photo.album_id == album_id, Photo.is_deleted == True)
-    )
-    photos = photos_result.scalars().all()
-    
-    # 删除所有照片文件
-    for photo in photos:
-        try:
-            if os.path.exists(photo.file_path):
-                os.remove(photo.file_path)
-            # 删除缩略图
-            thumbnail_path = os.path.join(settings.upload_dir, f"thumb_{photo.filename}")
-            if os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-        except Exception as e:
-            print(f"删除文件失败: {e}")
-    
-    # 永久删除数据库记录
-    await db.execute(delete(Photo).where(Photo.album_id == album_id, Photo.is_deleted == True))
-    await db.execute(delete(Album).where(Album.id == album_id, Album.is_deleted == True))
+    await enqueue_purge(db, album_id=album_id)
     await db.commit()
     
-    return RedirectResponse(url="/admin/trash?message=相册已永久删除", status_code=303)
+    return RedirectResponse(url="/admin/trash?message=正在永久删除相册", status_code=303)
 
 
 @router.post("/trash/photo/{photo_id}/delete-permanently", summary="永久删除照片")
@@ -752,19 +882,12 @@ async def delete_photo_permanently(photo_id: int, db: AsyncSession = Depends(get
     if not photo:
         raise HTTPException(status_code=404, detail="照片不存在或未被删除")
     
-    # 删除文件
-    try:
-        if os.path.exists(photo.file_path):
-            os.remove(photo.file_path)
-        # 删除缩略图
-        thumbnail_path = os.path.join(settings.upload_dir, f"thumb_{photo.filename}")
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
-    except Exception as e:
-        print(f"删除文件失败: {e}")
-    
-    # 永久删除数据库记录
+    # 永久删除数据库记录，释放对文件的引用
+    unreferenced = await release_blobs(db, [photo])
     await db.execute(delete(Photo).where(Photo.id == photo_id, Photo.is_deleted == True))
+    touch_albums(db, [photo.album_id])
+    # 删除文件由后台任务完成（其他照片内容相同、共用文件时保留）
+    await enqueue_file_deletion(db, unreferenced)
     await db.commit()
     
     return RedirectResponse(url="/admin/trash?message=照片已永久删除", status_code=303)
@@ -772,36 +895,8 @@ async def delete_photo_permanently(photo_id: int, db: AsyncSession = Depends(get
 
 @router.post("/trash/clear", summary="清空回收站")
 async def clear_trash(db: AsyncSession = Depends(get_db), _: bool = Depends(require_admin_auth)):
-    """清空回收站（永久删除所有已删除的相册和照片）"""
-    # 获取所有已删除的照片
-    photos_result = await db.execute(
-        select(Photo).where(Photo.is_deleted == True)
-    )
-    photos = photos_result.scalars().all()
-    
-    # 删除所有照片文件
-    deleted_photos_count = 0
-    for photo in photos:
-        try:
-            if os.path.exists(photo.file_path):
-                os.remove(photo.file_path)
-            # 删除缩略图
-            thumbnail_path = os.path.join(settings.upload_dir, f"thumb_{photo.filename}")
-            if os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-            deleted_photos_count += 1
-        except Exception as e:
-            print(f"删除文件失败: {e}")
-    
-    # 获取已删除的相册数量
-    albums_result = await db.execute(
-        select(func.count(Album.id)).where(Album.is_deleted == True)
-    )
-    deleted_albums_count = albums_result.scalar()
-    
-    # 永久删除数据库记录
-    await db.execute(delete(Photo).where(Photo.is_deleted == True))
-    await db.execute(delete(Album).where(Album.is_deleted == True))
+    """清空回收站（永久删除所有已删除的相册和照片），由后台任务分批删除，回收站页面显示进度"""
+    await enqueue_purge(db)
     await db.commit()
     
-    return RedirectResponse(url=f"/admin/trash?message=已清空回收站，删除了{deleted_albums_count}个相册和{deleted_photos_count}张照片", status_code=303)
\ No newline at end of file
+    return RedirectResponse(url="/admin/trash?message=正在清空回收站", status_code=303)
\ No newline at end of file
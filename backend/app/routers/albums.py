@@ -1,16 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, update, delete
+from sqlalchemy import select, func, update
 from typing import List
+from urllib.parse import quote
 import math
 
-from ..database import get_db, Album, Photo
+from ..database import get_db, get_read_db, Album, Photo
 from ..schemas import (
     AlbumResponse, AlbumListResponse, AlbumDetailResponse, 
     AlbumCreate, AlbumUpdate, MessageResponse, PaginationResponse, PaginatedResponse
 )
 from ..config import settings
 from ..dependencies import get_current_user
+from ..response_cache import response_cache
+from ..album_versions import touch_albums, album_etag, catalog_etag, etag_headers, not_modified
+from ..album_zip import AlbumArchive, album_entries, fill_crc32
+from ..media import parse_range, etag_matches
+from ..ordering import new_album_sort_order
+from ..trash import enqueue_purge, trash_album
+from .photos import photo_to_response
 
 router = APIRouter()
 
@@ -24,19 +33,14 @@ def fix_cover_image_url(cover_image: str) -> str:
 
 
 async def get_album_with_photo_count(db: AsyncSession, album: Album) -> AlbumResponse:
-    """获取包含照片数量的相册信息"""
-    # 计算照片数量
-    photo_count_result = await db.execute(
-        select(func.count(Photo.id)).where(Photo.album_id == album.id)
-    )
-    photo_count = photo_count_result.scalar() or 0
-    
+    """获取包含照片数量的相册信息（照片数量由 album_stats 维护在相册表中）"""
     return AlbumResponse(
         id=album.id,
         name=album.name,
         description=album.description,
         cover_image=fix_cover_image_url(album.cover_image),
-        photo_count=photo_count,
+        photo_count=album.photo_count,
+        total_bytes=album.total_bytes,
         created_at=album.created_at,
         updated_at=album.updated_at
     )
@@ -44,17 +48,37 @@ async def get_album_with_photo_count(db: AsyncSession, album: Album) -> AlbumRes
 
 @router.get("/", response_model=PaginatedResponse[AlbumResponse])
 async def get_albums(
+    request: Request,
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(10, ge=1, le=100, description="每页数量"),
     sort_by: str = Query("default", description="排序方式: default, name, created_at, updated_at"),
     order: str = Query("asc", description="排序顺序: asc, desc"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user = Depends(get_current_user)
 ):
     """
     获取相册列表
     默认排序优先级：自定义排序 → 时间倒序 → 用户选择排序
+    
+    支持 If-None-Match，相册没有变化时返回 304
     """
+    etag = await catalog_etag(db)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    response = await response_cache.respond(
+        "albums.list",
+        {"page": page, "size": size, "sort_by": sort_by, "order": order},
+        lambda: build_album_list(db, page, size, sort_by, order),
+        version=etag
+    )
+    response.headers.update(etag_headers(etag))
+    return response
+
+
+async def build_album_list(db: AsyncSession, page: int, size: int, sort_by: str, order: str):
+    """查询相册列表（缓存未命中时调用）"""
     # 构建排序条件
     if sort_by == "default":
         # 默认排序：先按自定义排序，再按更新时间倒序
@@ -83,24 +107,20 @@ async def get_albums(
     total_result = await db.execute(select(func.count(Album.id)))
     total = total_result.scalar()
     
-    # 为每个相册添加照片数量
+    # 照片数量直接读取相册表中维护的计数
     albums_data = []
     for album in albums:
-        photo_count_result = await db.execute(
-            select(func.count(Photo.id)).where(Photo.album_id == album.id)
+        album_data = AlbumResponse(
+            id=album.id,
+            name=album.name,
+            description=album.description,
+            cover_image=fix_cover_image_url(album.cover_image),
+            sort_order=album.sort_order,
+            photo_count=album.photo_count,
+            total_bytes=album.total_bytes,
+            created_at=album.created_at,
+            updated_at=album.updated_at
         )
-        photo_count = photo_count_result.scalar() or 0
-        
-        album_data = {
-            "id": album.id,
-            "name": album.name,
-            "description": album.description,
-            "cover_image": fix_cover_image_url(album.cover_image),
-            "sort_order": album.sort_order,
-            "photo_count": photo_count,
-            "created_at": album.created_at,
-            "updated_at": album.updated_at
-        }
         albums_data.append(album_data)
     
     return {
@@ -113,12 +133,32 @@ async def get_albums(
 
 
 @router.get("/{album_id}", response_model=AlbumDetailResponse, summary="获取相册详情")
-async def get_album_detail(album_id: int, db: AsyncSession = Depends(get_db)):
+async def get_album_detail(album_id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
     """
     获取相册详情，包括相册信息和照片列表
     
     - **album_id**: 相册ID
+    
+    支持 If-None-Match，相册没有变化时返回 304
     """
+    etag = await album_etag(db, album_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    response = await response_cache.respond(
+        "albums.detail", {"album_id": album_id},
+        lambda: build_album_detail(db, album_id),
+        album_id=album_id,
+        version=etag
+    )
+    if etag:
+        response.headers.update(etag_headers(etag))
+    return response
+
+
+async def build_album_detail(db: AsyncSession, album_id: int) -> AlbumDetailResponse:
+    """查询相册详情（缓存未命中时调用）"""
     # 获取相册
     album_result = await db.execute(
         select(Album).where(Album.id == album_id)
@@ -139,12 +179,10 @@ async def get_album_detail(album_id: int, db: AsyncSession = Depends(get_db)):
     )
     photos = photos_result.scalars().all()
     
-    # 如果相册没有封面且有照片，自动设置第一张照片为封面
-    if not album.cover_image and photos:
-        from .photos import photo_to_response
-        first_photo = photos[0]
-        album.cover_image = photo_to_response(first_photo).url
-        await db.commit()
+    # 相册没有封面且有照片时，用第一张照片作为封面（只读会话，不写回数据库）
+    cover_image = album.cover_image
+    if not cover_image and photos:
+        cover_image = photo_to_response(photos[0]).url
     
     # 计算照片数量
     photo_count = len(photos)
@@ -153,15 +191,80 @@ async def get_album_detail(album_id: int, db: AsyncSession = Depends(get_db)):
         id=album.id,
         name=album.name,
         description=album.description,
-        cover_image=fix_cover_image_url(album.cover_image),
+        cover_image=fix_cover_image_url(cover_image),
         sort_order=album.sort_order,
         photo_count=photo_count,
+        total_bytes=album.total_bytes,
         created_at=album.created_at,
         updated_at=album.updated_at,
         photos=[photo_to_response(photo) for photo in photos]
     )
 
 
+@router.api_route("/{album_id}/download", methods=["GET", "HEAD"], summary="打包下载相册")
+async def download_album(album_id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
+    """
+    把相册中的照片打包成 ZIP 下载（照片按原文件不压缩写入，边读边发送）
+
+    - **album_id**: 相册ID
+
+    同一个相册版本生成的压缩包逐字节相同：响应带强 ETag 和 Content-Length，支持单段
+    Range 请求断点续传（If-Range 与 ETag 不一致时返回完整文件）。
+    """
+    result = await db.execute(
+        select(Album).where(Album.id == album_id, Album.is_deleted == False)
+    )
+    album = result.scalar_one_or_none()
+    if not album:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="相册不存在")
+
+    # 与相册详情相同的顺序，id 保证同一版本的顺序固定
+    photos_result = await db.execute(
+        select(Photo)
+        .where(Photo.album_id == album_id, Photo.is_deleted == False)
+        .order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc())
+    )
+    photos = photos_result.scalars().all()
+    await fill_crc32(photos)
+    archive = AlbumArchive(album_entries(photos))
+
+    # 版本号在照片增删改时都会变化，压缩包内容由版本号唯一确定，可以用强 ETag
+    etag = f'"album-zip-{album_id}-{album.version}"'
+    ascii_name = album.name.encode("ascii", "replace").decode().replace("?", "_").replace('"', "_")
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": (
+            f'attachment; filename="{ascii_name}.zip"; filename*=UTF-8\'\'{quote(album.name + ".zip")}'
+        ),
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    start, end, status_code = 0, archive.size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, archive.size)
+        except ValueError:
+            return Response(
+                status_code=416, headers={**headers, "Content-Range": f"bytes */{archive.size}"}
+            )
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type="application/zip")
+    return StreamingResponse(
+        archive.stream(start, end), status_code=status_code, headers=headers, media_type="application/zip"
+    )
+
+
 @router.post("/", response_model=AlbumResponse, summary="创建相册")
 async def create_album(
     album_data: AlbumCreate,
@@ -173,15 +276,11 @@ async def create_album(
     - **name**: 相册名称（必填）
     - **description**: 相册描述（可选）
     """
-    # 获取当前最大的sort_order，新相册排在最前面
-    max_sort_result = await db.execute(select(func.max(Album.sort_order)))
-    max_sort = max_sort_result.scalar() or 0
-    
-    # 创建相册
+    # 创建相册，排在最前面（排序键之间留出间隔，拖动排序时只需改写被移动的相册，见 ordering.py）
     album = Album(
         name=album_data.name,
         description=album_data.description,
-        sort_order=max_sort + 1
+        sort_order=await new_album_sort_order(db)
     )
     
     db.add(album)
@@ -224,6 +323,7 @@ async def update_album(
             .where(Album.id == album_id)
             .values(**update_data)
         )
+        touch_albums(db, [album_id])
         await db.commit()
         await db.refresh(album)
     
@@ -239,6 +339,9 @@ async def delete_album(
     删除相册（包括其中的所有照片）
     
     - **album_id**: 相册ID
+
+    相册和照片移入回收站后立即入队永久删除任务，由后台任务分批删除照片记录、释放
+    blobs 引用并删除不再被引用的文件（与回收站的永久删除相同）。
     """
     # 检查相册是否存在
     album_result = await db.execute(
@@ -252,11 +355,10 @@ async def delete_album(
             detail="相册不存在"
         )
     
-    # 删除相册中的所有照片
-    await db.execute(delete(Photo).where(Photo.album_id == album_id))
+    if not album.is_deleted:
+        await trash_album(db, album)
     
-    # 删除相册
-    await db.execute(delete(Album).where(Album.id == album_id))
+    await enqueue_purge(db, album_id=album_id)
     await db.commit()
     
     return MessageResponse(message=f"相册 '{album.name}' 已删除")
@@ -279,19 +381,14 @@ async def update_album_sort(
     await db.commit()
     await db.refresh(album)
     
-    # 获取照片数量
-    photo_count_result = await db.execute(
-        select(func.count(Photo.id)).where(Photo.album_id == album.id)
-    )
-    photo_count = photo_count_result.scalar() or 0
-    
     return {
         "id": album.id,
         "name": album.name,
         "description": album.description,
         "cover_image": fix_cover_image_url(album.cover_image),
         "sort_order": album.sort_order,
-        "photo_count": photo_count,
+        "photo_count": album.photo_count,
+        "total_bytes": album.total_bytes,
         "created_at": album.created_at,
         "updated_at": album.updated_at
     } 
\ No newline at end of file
@@ -1,13 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, update, func
-from typing import List
+from typing import List, Optional
 import os
 
-from ..database import get_db, Photo, Album
+from ..database import get_db, get_read_db, Photo, Album, TimelineBucket
 from ..schemas import PhotoResponse, MessageResponse
 from ..config import settings
+from ..derivatives import parse_variants, photo_key, photo_url_path
+from ..storage import get_storage
 from ..dependencies import get_current_user
+from ..album_stats import photos_removed
+from ..blobs import release_blobs
+from ..similarity import MAX_DISTANCE, similar_photos
+from ..ingest import enqueue_file_deletion
+from ..pagination import keyset_paginate, encode_cursor
+from .. import timeline
+from ..image_worker import image_worker
+from ..render_cache import render_cache
+from ..response_cache import response_cache
+from ..album_versions import touch_albums, album_etag, catalog_etag, etag_headers, not_modified
 
 router = APIRouter()
 
@@ -17,18 +30,26 @@ def photo_to_response(photo: Photo) -> PhotoResponse:
     # 构建图片URL
     base_url = f"https://photo.liuenyi.com"
     
-    # 原图URL
-    url = f"{base_url}/uploads/{photo.filename}"
+    # 入库时记录了生成过哪些衍生版本，直接据此拼接URL
+    variants = parse_variants(photo.variants)
     
-    # 缩略图URL
-    thumbnail_url = f"{base_url}/uploads/thumb_{photo.filename}"
+    def absolute_url(url: str) -> str:
+        # 本地存储返回 /uploads/... 路径，对象存储可能直接返回 CDN 地址
+        return f"{base_url}{url}" if url.startswith("/") else url
+    
+    def variant_url(variant: str):
+        if variant in variants:
+            return absolute_url(photo_url_path(photo, variant))
+        return None
+    
+    # 原图URL（文件可能在分片子目录中，以 file_path 为准）
+    original_url = absolute_url(photo_url_path(photo))
+    
+    # 预览图URL（原图不超过预览尺寸时没有预览图，直接使用原图）
+    preview_url = variant_url("preview") or original_url
     
-    # 如果是大文件（>10MB），检查是否有预览图
-    preview_url = url  # 默认使用原图
-    if photo.file_size and photo.file_size > 10 * 1024 * 1024:
-        preview_path = os.path.join(settings.upload_dir, f"preview_{photo.filename}")
-        if os.path.exists(preview_path):
-            preview_url = f"{base_url}/uploads/preview_{photo.filename}"
+    # 缩略图URL
+    thumbnail_url = variant_url("thumb") or preview_url
     
     return PhotoResponse(
         id=photo.id,
@@ -42,26 +63,104 @@ def photo_to_response(photo: Photo) -> PhotoResponse:
         description=photo.description,
         sort_order=photo.sort_order,
         url=preview_url,  # 使用预览图或原图
+        original_url=original_url,
         thumbnail_url=thumbnail_url,
+        preview_webp_url=variant_url("preview_webp"),
+        thumbnail_webp_url=variant_url("thumb_webp"),
+        taken_at=photo.taken_at,
+        camera_make=photo.camera_make,
+        camera_model=photo.camera_model,
+        lens_model=photo.lens_model,
+        orientation=photo.orientation,
         created_at=photo.created_at
     )
 
 
+# 用户可选的排序字段
+PHOTO_SORT_COLUMNS = {
+    "created_at": Photo.created_at,
+    "taken_at": Photo.taken_at,
+    "original_filename": Photo.original_filename,
+    "file_size": Photo.file_size,
+}
+
+
+def photo_sort_keys(sort_by: str, order: str):
+    """返回 (排序模式, 排序列, 是否降序)，排序列最后总是照片ID，保证顺序唯一"""
+    if sort_by == "default":
+        # 默认排序：先按自定义排序，再按创建时间倒序
+        return "default", [Photo.sort_order, Photo.created_at, Photo.id], True
+    
+    sort_column = PHOTO_SORT_COLUMNS.get(sort_by, Photo.created_at)
+    descending = order == "desc"
+    return f"{sort_column.key}:{order}", [sort_column, Photo.id], descending
+
+
+async def list_photos(db: AsyncSession, filters, sort_by: str, order: str, page: int, size: int, cursor, include_total: bool):
+    """按游标分页查询照片，没有游标且 page > 1 时退回 OFFSET 分页"""
+    mode, columns, descending = photo_sort_keys(sort_by, order)
+    
+    total = None
+    if include_total:
+        total_result = await db.execute(select(func.count(Photo.id)).where(*filters))
+        total = total_result.scalar() or 0
+    
+    photos, next_cursor = await keyset_paginate(
+        db, select(Photo).where(*filters), columns, descending, size, cursor, mode,
+        offset=(page - 1) * size
+    )
+    
+    return {
+        "items": [photo_to_response(photo) for photo in photos],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+        "total": total,
+        "page": page,
+        "size": size,
+        "pages": ((total + size - 1) // size if total > 0 else 1) if total is not None else None
+    }
+
+
 @router.get("/album/{album_id}", summary="获取相册中的照片")
 async def get_photos_by_album(
     album_id: int,
-    page: int = Query(1, ge=1, description="页码"),
+    request: Request,
+    page: int = Query(1, ge=1, description="页码（仅兼容旧客户端，翻页请使用 cursor）"),
     size: int = Query(20, ge=1, le=1000, description="每页数量"),
-    db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    include_total: bool = Query(True, description="是否统计总数，滚动加载时可关闭"),
+    db: AsyncSession = Depends(get_read_db),
     current_user = Depends(get_current_user)
 ):
     """
     获取指定相册中的照片列表
     
     - **album_id**: 相册ID
-    - **page**: 页码，从1开始
+    - **cursor**: 翻页游标，第一页不传，之后传上一页返回的 next_cursor
     - **size**: 每页数量，最大1000
+    - **include_total**: 为 false 时不计算 total 和 pages
+    
+    支持 If-None-Match，相册没有变化时返回 304
     """
+    etag = await album_etag(db, album_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    response = await response_cache.respond(
+        "photos.album",
+        {"album_id": album_id, "page": page, "size": size, "cursor": cursor, "include_total": include_total},
+        lambda: build_album_photos(db, album_id, page, size, cursor, include_total),
+        album_id=album_id,
+        version=etag
+    )
+    if etag:
+        response.headers.update(etag_headers(etag))
+    return response
+
+
+async def build_album_photos(db: AsyncSession, album_id: int, page: int, size: int, cursor, include_total: bool):
+    """查询相册中的照片（缓存未命中时调用）"""
     # 检查相册是否存在
     album_result = await db.execute(
         select(Album).where(Album.id == album_id)
@@ -74,38 +173,102 @@ async def get_photos_by_album(
             detail="相册不存在"
         )
     
-    # 计算总数
-    total_result = await db.execute(
-        select(func.count(Photo.id)).where(Photo.album_id == album_id)
+    return await list_photos(
+        db, [Photo.album_id == album_id], "default", "desc", page, size, cursor, include_total
+    )
+
+
+@router.get("/timeline", summary="按拍摄时间分组的时间线")
+async def get_timeline(
+    request: Request,
+    level: str = Query("month", pattern="^(year|month|day)$", description="分组级别: year, month, day"),
+    album_id: Optional[int] = Query(None, description="相册ID，不传表示整个图库"),
+    period: Optional[str] = Query(None, description="只返回这段时间内的分组，如 level=month&period=2023"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    返回各年、月或日的照片数量和封面，按时间倒序
+
+    每个分组的 cursor 可以直接传给照片列表接口（sort_by=taken_at&order=desc，相同的
+    album_id），从该分组的第一张照片开始加载，用于跳转到某个月份。
+
+    支持 If-None-Match，照片没有变化时返回 304
+    """
+    if period is not None:
+        period_level = timeline.period_level(period)
+        if period_level is None or list(timeline.LEVELS).index(period_level) >= list(timeline.LEVELS).index(level):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="period 的格式应为 2023 或 2023-06，且比 level 粗一级以上"
+            )
+
+    etag = await album_etag(db, album_id) if album_id else await catalog_etag(db)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    response = await response_cache.respond(
+        "photos.timeline",
+        {"level": level, "album_id": album_id, "period": period},
+        lambda: build_timeline(db, level, album_id, period),
+        album_id=album_id or None,
+        version=etag
     )
-    total = total_result.scalar() or 0
-    
-    # 计算偏移量
-    offset = (page - 1) * size
-    
-    # 获取照片列表
-    photos_result = await db.execute(
-        select(Photo)
-        .where(Photo.album_id == album_id)
-        .order_by(Photo.sort_order.desc(), Photo.created_at.desc())
-        .offset(offset)
-        .limit(size)
+    if etag:
+        response.headers.update(etag_headers(etag))
+    return response
+
+
+async def build_timeline(db: AsyncSession, level: str, album_id: Optional[int], period: Optional[str]):
+    """读取时间线分组（缓存未命中时调用）"""
+    if album_id:
+        album_result = await db.execute(select(Album.id).where(Album.id == album_id))
+        if album_result.scalar_one_or_none() is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="相册不存在"
+            )
+
+    query = select(TimelineBucket).where(
+        TimelineBucket.album_id == (album_id or timeline.LIBRARY),
+        TimelineBucket.level == level
     )
-    photos = photos_result.scalars().all()
-    
-    return {
-        "items": [photo_to_response(photo) for photo in photos],
-        "total": total,
-        "page": page,
-        "size": size,
-        "pages": (total + size - 1) // size if total > 0 else 1
-    }
+    if period is not None:
+        # period 的下级分组以 "2023-" 开头，按主键范围读取
+        query = query.where(TimelineBucket.period > period, TimelineBucket.period < period + "~")
+    result = await db.execute(query.order_by(TimelineBucket.period.desc()))
+    buckets = result.scalars().all()
+
+    cover_ids = [bucket.cover_photo_id for bucket in buckets if bucket.cover_photo_id]
+    covers = {}
+    if cover_ids:
+        covers_result = await db.execute(select(Photo).where(Photo.id.in_(cover_ids)))
+        covers = {photo.id: photo_to_response(photo) for photo in covers_result.scalars().all()}
+
+    mode, columns, _ = photo_sort_keys("taken_at", "desc")
+    items = []
+    for bucket in buckets:
+        start, end = timeline.period_range(bucket.period)
+        cover = covers.get(bucket.cover_photo_id)
+        items.append({
+            "period": bucket.period,
+            "photo_count": bucket.photo_count,
+            "start": start,
+            "end": end,
+            "cover_photo_id": bucket.cover_photo_id,
+            "cover_thumbnail_url": cover.thumbnail_url if cover else None,
+            # 排序键 (taken_at, id) 小于 (end, 0)，即从分组内最晚的照片开始
+            "cursor": encode_cursor(mode, [end, 0]),
+        })
+
+    return {"level": level, "album_id": album_id, "period": period, "items": items}
 
 
 @router.get("/{photo_id}", response_model=PhotoResponse, summary="获取照片详情")
 async def get_photo_detail(
     photo_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     获取照片详情
@@ -126,6 +289,141 @@ async def get_photo_detail(
     return photo_to_response(photo)
 
 
+@router.get("/{photo_id}/similar", summary="查找相似照片")
+async def get_similar_photos(
+    photo_id: int,
+    max_distance: int = Query(settings.similar_max_distance, ge=0, le=MAX_DISTANCE, description="感知哈希最多相差的位数"),
+    limit: int = Query(50, ge=1, le=200, description="最多返回数量"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    查找与指定照片相似的照片（连拍、重新压缩、缩放导出等），按相似程度排序
+
+    - **photo_id**: 照片ID
+    - **max_distance**: 0 表示几乎一样，越大越宽松
+    """
+    photo_result = await db.execute(
+        select(Photo).where(Photo.id == photo_id)
+    )
+    photo = photo_result.scalar_one_or_none()
+    
+    if not photo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="照片不存在"
+        )
+    
+    matches = await similar_photos(db, photo, max_distance, limit)
+    return {
+        "photo_id": photo_id,
+        "items": [
+            {"distance": distance, "photo": photo_to_response(match)}
+            for match, distance in matches
+        ]
+    }
+
+
+# fmt 参数 -> (Pillow 格式, 扩展名, MIME 类型)
+RENDER_FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "png": ("PNG", ".png", "image/png"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+}
+
+# fmt=auto 时按原图扩展名选择输出格式，其余一律输出 JPEG（GIF 只取第一帧）
+AUTO_RENDER_FORMATS = {".png": "png", ".gif": "png", ".webp": "webp"}
+
+
+def render_source(photo: Photo, width: int, height: int, fit: str) -> str:
+    """选择渲染用的源文件（返回存储键）：预览图分辨率足够时从预览图缩放，省去解码原图"""
+    if "preview" in parse_variants(photo.variants) and photo.width and photo.height:
+        # width、height 是原图存储的尺寸，预览图已按 EXIF 方向转正
+        shown_width, shown_height = (photo.height, photo.width) if photo.orientation in (5, 6, 7, 8) else (photo.width, photo.height)
+        preview_scale = settings.preview_size / max(shown_width, shown_height)
+        ratios = (width / shown_width, height / shown_height)
+        needed_scale = max(ratios) if fit == "cover" else min(ratios)
+        if needed_scale <= preview_scale:
+            return photo_key(photo, "preview")
+    return photo_key(photo)
+
+
+@router.get("/{photo_id}/render", summary="按需渲染指定尺寸的图片")
+async def render_photo(
+    photo_id: int,
+    w: Optional[int] = Query(None, ge=1, description="宽度（像素）"),
+    h: Optional[int] = Query(None, ge=1, description="高度（像素）"),
+    fit: str = Query("contain", pattern="^(contain|cover)$", description="contain: 等比缩放到框内; cover: 缩放并裁剪填满"),
+    fmt: str = Query("auto", pattern="^(auto|jpeg|png|webp)$", description="输出格式，auto 表示沿用原图格式"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    按展示尺寸返回图片，首次请求时生成并缓存，之后直接返回缓存文件
+
+    - **w** / **h**: 目标宽高，contain 模式可以只给一个，cover 模式两个都要给
+    - **fit**: contain 或 cover
+    - **fmt**: auto、jpeg、png 或 webp
+    """
+    if w is None and h is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="至少需要指定 w 或 h")
+    if fit == "cover" and (w is None or h is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cover 模式需要同时指定 w 和 h")
+    if max(w or 0, h or 0) > settings.render_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"尺寸不能超过 {settings.render_max_size}"
+        )
+    width = w or settings.render_max_size
+    height = h or settings.render_max_size
+
+    photo_result = await db.execute(
+        select(Photo).where(Photo.id == photo_id, Photo.is_deleted == False)
+    )
+    photo = photo_result.scalar_one_or_none()
+
+    storage = get_storage()
+    # 对象存储上的文件在渲染时才下载，不存在时由下面的 FileNotFoundError 处理
+    if not photo or (storage.is_local and not os.path.exists(photo.file_path)):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="照片不存在"
+        )
+
+    stem, original_ext = os.path.splitext(photo.filename)
+    if fmt == "auto":
+        fmt = AUTO_RENDER_FORMATS.get(original_ext.lower(), "jpeg")
+    output_format, ext, media_type = RENDER_FORMATS[fmt]
+
+    # 文件名是上传时生成的 UUID，内容不会再变，缓存键和响应都可以永久缓存；
+    # 带 EXIF 方向的照片加上方向，不再使用修复前没有转正的缓存
+    rotated = f"_o{photo.orientation}" if photo.orientation and photo.orientation != 1 else ""
+    key = f"{stem}_{width}x{height}_{fit}{rotated}{ext}"
+    source_key = render_source(photo, width, height, fit)
+
+    async def render(output_path: str):
+        async with storage.open_local(source_key) as source_path:
+            await image_worker.render(source_path, output_path, width, height, fit, output_format)
+
+    try:
+        path = await render_cache.get_or_render(key, render)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="照片不存在"
+        )
+    except Exception as e:
+        print(f"[渲染] 照片 {photo_id} 渲染失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="图片渲染失败"
+        )
+
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
 @router.put("/{photo_id}", response_model=PhotoResponse, summary="更新照片信息")
 async def update_photo(
     photo_id: int,
@@ -157,6 +455,7 @@ async def update_photo(
             .where(Photo.id == photo_id)
             .values(description=description)
         )
+        touch_albums(db, [photo.album_id])
         await db.commit()
         await db.refresh(photo)
     
@@ -205,10 +504,14 @@ async def delete_photo(
             detail="照片不存在"
         )
     
-    # 删除文件 (TODO: 实际删除文件系统中的文件)
-    
-    # 删除数据库记录
+    # 删除数据库记录，释放对文件的引用
+    if not photo.is_deleted:
+        await photos_removed(db, [photo])
+    unreferenced = await release_blobs(db, [photo])
     await db.execute(delete(Photo).where(Photo.id == photo_id))
+    touch_albums(db, [photo.album_id])
+    # 没有其他照片共用时由后台任务删除原图和衍生图
+    await enqueue_file_deletion(db, unreferenced)
     await db.commit()
     
     return MessageResponse(message="照片已删除")
@@ -216,55 +519,48 @@ async def delete_photo(
 
 @router.get("/", summary="获取照片列表")
 async def get_photos(
+    request: Request,
     album_id: int = Query(None, description="相册ID"),
-    page: int = Query(1, ge=1, description="页码"),
+    page: int = Query(1, ge=1, description="页码（仅兼容旧客户端，翻页请使用 cursor）"),
     size: int = Query(20, ge=1, le=1000, description="每页数量"),
-    sort_by: str = Query("default", description="排序方式: default, created_at, original_filename, file_size"),
+    sort_by: str = Query("default", description="排序方式: default, created_at, taken_at, original_filename, file_size"),
     order: str = Query("desc", description="排序顺序: asc, desc"),
-    db: AsyncSession = Depends(get_db),
+    camera_model: Optional[str] = Query(None, description="只返回该相机拍摄的照片"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor 或时间线分组的 cursor"),
+    include_total: bool = Query(True, description="是否统计总数，滚动加载时可关闭"),
+    db: AsyncSession = Depends(get_read_db),
     current_user = Depends(get_current_user)
 ):
     """
     获取照片列表
     默认排序优先级：自定义排序 → 时间倒序 → 用户选择排序
-    """
-    # 构建查询条件
-    query = select(Photo)
-    count_query = select(func.count(Photo.id))
     
+    翻页时传入上一页返回的 next_cursor，next_cursor 为 null 表示已经是最后一页
+    
+    支持 If-None-Match，照片没有变化时返回 304
+    """
+    filters = []
     if album_id:
-        query = query.where(Photo.album_id == album_id)
-        count_query = count_query.where(Photo.album_id == album_id)
+        filters.append(Photo.album_id == album_id)
+    if camera_model:
+        filters.append(Photo.camera_model == camera_model)
     
-    # 计算总数
-    total_result = await db.execute(count_query)
-    total = total_result.scalar() or 0
+    etag = await album_etag(db, album_id) if album_id else await catalog_etag(db)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     
-    # 构建排序条件
-    if sort_by == "default":
-        # 默认排序：先按自定义排序，再按创建时间倒序
-        order_by = [Photo.sort_order.desc(), Photo.created_at.desc()]
-    else:
-        # 用户选择的排序
-        sort_column = getattr(Photo, sort_by, Photo.created_at)
-        if order == "desc":
-            order_by = [sort_column.desc()]
-        else:
-            order_by = [sort_column.asc()]
-    
-    # 计算偏移量
-    offset = (page - 1) * size
-    
-    # 执行查询
-    result = await db.execute(
-        query.order_by(*order_by).offset(offset).limit(size)
+    # 只查一个相册时只随该相册失效，否则任何相册的改动都会使其失效
+    response = await response_cache.respond(
+        "photos.list",
+        {
+            "album_id": album_id, "page": page, "size": size, "sort_by": sort_by, "order": order,
+            "camera_model": camera_model, "cursor": cursor, "include_total": include_total
+        },
+        lambda: list_photos(db, filters, sort_by, order, page, size, cursor, include_total),
+        album_id=album_id or None,
+        version=etag
     )
-    photos = result.scalars().all()
-    
-    return {
-        "items": [photo_to_response(photo) for photo in photos],
-        "total": total,
-        "page": page,
-        "size": size,
-        "pages": (total + size - 1) // size if total > 0 else 1
-    }
+    if etag:
+        response.headers.update(etag_headers(etag))
+    return response
@@ -0,0 +1,315 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from starlette.requests import ClientDisconnect
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import json
+import os
+import re
+import uuid
+
+from ..database import get_db, Photo, Album
+from ..schemas import (
+    UploadSessionCreate, UploadSessionComplete, UploadSessionResponse,
+    UploadResponse, MessageResponse
+)
+from ..config import settings
+from ..ingest import import_local_file, delete_photo_files, discard_new_files, add_photos, file_sha256
+from .photos import photo_to_response
+
+router = APIRouter()
+
+# 断点续传协议：
+#   POST   /api/upload/sessions                创建会话
+#   GET    /api/upload/sessions/{id}           查询已接收的字节数（offset）
+#   PUT    /api/upload/sessions/{id}?offset=N  从 offset 处追加一个分片（请求体为原始字节）
+#   POST   /api/upload/sessions/{id}/complete  完成上传，创建照片记录
+#   DELETE /api/upload/sessions/{id}           放弃上传
+#
+# 会话数据保存在磁盘上，已接收的字节数就是数据文件的大小，服务重启后也能继续上传。
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# 同一会话同时只允许一个分片写入
+session_locks: Dict[str, asyncio.Lock] = {}
+
+
+def session_paths(session_id: str):
+    """返回会话的 (元数据文件, 数据文件) 路径"""
+    base = os.path.join(settings.upload_session_dir, session_id)
+    return f"{base}.json", f"{base}.part"
+
+
+def load_session(session_id: str) -> dict:
+    """读取会话元数据，不存在或已过期时返回 404"""
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="上传会话不存在")
+
+    meta_path, data_path = session_paths(session_id)
+    if not os.path.exists(meta_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="上传会话不存在")
+
+    with open(meta_path) as f:
+        session = json.load(f)
+
+    if datetime.fromisoformat(session["expires_at"]) < datetime.utcnow():
+        discard_session(session_id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="上传会话已过期")
+
+    session["offset"] = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+    return session
+
+
+def discard_session(session_id: str):
+    """删除会话的元数据和数据文件"""
+    for path in session_paths(session_id):
+        if os.path.exists(path):
+            os.remove(path)
+    session_locks.pop(session_id, None)
+
+
+def cleanup_expired_sessions():
+    """清理过期的上传会话（启动时调用）"""
+    if not os.path.isdir(settings.upload_session_dir):
+        return
+
+    removed = 0
+    now = datetime.utcnow()
+    for name in os.listdir(settings.upload_session_dir):
+        session_id, ext = os.path.splitext(name)
+        if ext != ".json":
+            continue
+        try:
+            with open(os.path.join(settings.upload_session_dir, name)) as f:
+                expired = datetime.fromisoformat(json.load(f)["expires_at"]) < now
+        except Exception:
+            expired = True
+        if expired:
+            discard_session(session_id)
+            removed += 1
+
+    if removed:
+        print(f"[上传] 已清理 {removed} 个过期的上传会话")
+
+
+def session_response(session: dict) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        session_id=session["session_id"],
+        album_id=session["album_id"],
+        filename=session["filename"],
+        size=session["size"],
+        offset=session["offset"],
+        chunk_size=settings.upload_session_chunk_size,
+        expires_at=datetime.fromisoformat(session["expires_at"])
+    )
+
+
+@router.post("/", response_model=UploadSessionResponse, summary="创建断点续传会话")
+async def create_upload_session(
+    session_data: UploadSessionCreate,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    创建断点续传会话，之后按 offset 分片上传文件内容
+
+    - **album_id**: 目标相册ID
+    - **filename**: 原始文件名
+    - **size**: 文件总大小（字节）
+    - **description**: 照片描述（可选）
+    """
+    file_ext = os.path.splitext(session_data.filename)[1].lower()
+    if file_ext not in settings.allowed_extensions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的文件类型。支持的类型: {', '.join(settings.allowed_extensions)}"
+        )
+
+    if session_data.size > settings.max_file_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"文件大小超过限制 ({settings.max_file_size / 1024 / 1024}MB)"
+        )
+
+    album_result = await db.execute(
+        select(Album).where(Album.id == session_data.album_id)
+    )
+    if not album_result.scalar_one_or_none():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="相册不存在"
+        )
+
+    os.makedirs(settings.upload_session_dir, exist_ok=True)
+    session = {
+        "session_id": uuid.uuid4().hex,
+        "album_id": session_data.album_id,
+        "filename": session_data.filename,
+        "size": session_data.size,
+        "description": session_data.description,
+        "created_at": datetime.utcnow().isoformat(),
+        "expires_at": (datetime.utcnow() + timedelta(hours=settings.upload_session_ttl_hours)).isoformat()
+    }
+
+    meta_path, data_path = session_paths(session["session_id"])
+    open(data_path, "wb").close()
+    with open(meta_path, "w") as f:
+        json.dump(session, f, ensure_ascii=False)
+
+    session["offset"] = 0
+    return session_response(session)
+
+
+@router.get("/{session_id}", response_model=UploadSessionResponse, summary="查询上传进度")
+async def get_upload_session(session_id: str, response: Response):
+    """
+    查询会话已接收的字节数，客户端断线重连后应从返回的 offset 继续上传
+
+    - **session_id**: 会话ID
+    """
+    session = load_session(session_id)
+    response.headers["Upload-Offset"] = str(session["offset"])
+    return session_response(session)
+
+
+@router.put("/{session_id}", response_model=UploadSessionResponse, summary="上传分片")
+async def upload_session_chunk(
+    session_id: str,
+    request: Request,
+    response: Response,
+    offset: int = Query(..., ge=0, description="本分片在文件中的起始位置")
+):
+    """
+    从 offset 处追加一个分片，请求体为分片的原始字节
+
+    offset 必须等于服务器已接收的字节数，否则返回 409 并在响应头
+    Upload-Offset 中给出正确的位置。分片边读边写入磁盘，不在内存中缓存；
+    连接中断时已写入的部分会保留，客户端查询 offset 后续传即可。
+    """
+    session = load_session(session_id)
+
+    lock = session_locks.setdefault(session_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="该会话正在接收其他分片"
+        )
+
+    async with lock:
+        session = load_session(session_id)
+        if offset != session["offset"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"offset 不匹配，服务器已接收 {session['offset']} 字节",
+                headers={"Upload-Offset": str(session["offset"])}
+            )
+
+        _, data_path = session_paths(session_id)
+        received = session["offset"]
+        buffer = await run_in_threadpool(open, data_path, "ab")
+        try:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if received + len(chunk) > session["size"]:
+                    await run_in_threadpool(buffer.truncate, session["offset"])
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="分片超出了文件的声明大小"
+                    )
+                await run_in_threadpool(buffer.write, chunk)
+                received += len(chunk)
+        except ClientDisconnect:
+            # 连接中断，已写入的数据保留，等待客户端续传
+            pass
+        finally:
+            await run_in_threadpool(buffer.close)
+
+    session["offset"] = received
+    response.headers["Upload-Offset"] = str(received)
+    return session_response(session)
+
+
+@router.post("/{session_id}/complete", response_model=UploadResponse, summary="完成上传")
+async def complete_upload_session(
+    session_id: str,
+    complete_data: Optional[UploadSessionComplete] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    所有分片上传完成后调用，校验文件并创建照片记录
+
+    - **session_id**: 会话ID
+    - **sha256**: 客户端计算的文件哈希（可选），不一致时会清空已上传的数据
+    """
+    session = load_session(session_id)
+    lock = session_locks.setdefault(session_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="该会话正在接收分片"
+        )
+
+    async with lock:
+        session = load_session(session_id)
+        if session["offset"] != session["size"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"文件尚未上传完成 ({session['offset']}/{session['size']})",
+                headers={"Upload-Offset": str(session["offset"])}
+            )
+
+        _, data_path = session_paths(session_id)
+        if complete_data and complete_data.sha256:
+            actual = await run_in_threadpool(file_sha256, data_path)
+            if actual != complete_data.sha256.lower():
+                open(data_path, "wb").close()
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="文件校验失败，请重新上传"
+                )
+
+        fields = await import_local_file(data_path, session["filename"])
+
+        photo = Photo(
+            album_id=session["album_id"],
+            original_filename=session["filename"],
+            description=session["description"],
+            **fields
+        )
+
+        duplicates = []
+        try:
+            duplicates = await add_photos(db, [photo])
+            await db.commit()
+            await db.refresh(photo)
+        except Exception as e:
+            await db.rollback()
+            await discard_new_files([photo] + duplicates)
+            discard_session(session_id)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"上传失败: {str(e)}"
+            )
+
+        discard_session(session_id)
+
+    await delete_photo_files(duplicates)
+    return UploadResponse(
+        message="照片上传成功",
+        photo=photo_to_response(photo)
+    )
+
+
+@router.delete("/{session_id}", response_model=MessageResponse, summary="放弃上传")
+async def delete_upload_session(session_id: str):
+    """
+    放弃上传并删除已接收的数据
+
+    - **session_id**: 会话ID
+    """
+    load_session(session_id)
+    discard_session(session_id)
+    return MessageResponse(message="上传会话已删除")
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+
+from ..database import get_read_db, Photo, Album
+from ..dependencies import get_current_user
+from ..search import search, split_terms, photo_highlights, album_highlights
+from .photos import photo_to_response
+from .albums import get_album_with_photo_count
+
+router = APIRouter()
+
+
+@router.get("/", summary="搜索照片和相册")
+async def search_all(
+    q: str = Query(..., min_length=1, max_length=100, description="关键词，多个关键词用空格分隔"),
+    type: str = Query("photos", pattern="^(photos|albums)$", description="搜索对象: photos, albums"),
+    album_id: Optional[int] = Query(None, description="只搜索该相册中的照片"),
+    page: int = Query(1, ge=1, le=50, description="页码"),
+    size: int = Query(20, ge=1, le=100, description="每页数量"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    按文件名、描述搜索照片，或按名称、描述搜索相册，结果按相关程度排序
+
+    - **q**: 关键词，多个关键词需要同时出现
+    - **type**: photos 或 albums
+    - **album_id**: 只在 type=photos 时有效
+
+    highlights 中的文本已转义 HTML，匹配的关键词用 &lt;mark&gt; 标出，描述只返回匹配处附近的片段
+    """
+    terms = split_terms(q)
+    if not terms:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="请输入关键词")
+
+    if type == "albums":
+        albums, has_more = await search(db, Album, terms, [Album.is_deleted == False], page, size)
+        items = [
+            {"album": await get_album_with_photo_count(db, album), "highlights": album_highlights(album, terms)}
+            for album in albums
+        ]
+    else:
+        filters = [Photo.is_deleted == False]
+        if album_id:
+            filters.append(Photo.album_id == album_id)
+        photos, has_more = await search(db, Photo, terms, filters, page, size)
+        items = [
+            {"photo": photo_to_response(photo), "highlights": photo_highlights(photo, terms)}
+            for photo in photos
+        ]
+
+    return {
+        "query": q,
+        "type": type,
+        "items": items,
+        "page": page,
+        "size": size,
+        "has_more": has_more
+    }
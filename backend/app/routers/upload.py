@@ -1,74 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from PIL import Image
+from fastapi.concurrency import run_in_threadpool
+from jose import jwt, JWTError
+import mimetypes
 import os
 import uuid
-from datetime import datetime
-from typing import Tuple, List
+from datetime import datetime, timedelta
+from typing import List
 
 from ..database import get_db, Photo, Album
-from ..schemas import UploadResponse, MessageResponse
+from ..schemas import (
+    UploadResponse, MessageResponse,
+    DirectUploadCreate, DirectUploadResponse, DirectUploadComplete
+)
 from ..config import settings
+from ..derivatives import layout_path, storage_key
+from ..storage import get_storage
+from ..ingest import (
+    validate_file, save_uploaded_file, ingest_files, batch_progress, delete_photo_files,
+    discard_new_files, process_or_reuse, file_digests, add_photos
+)
 from .photos import photo_to_response
 
 router = APIRouter()
 
 
-def validate_file(file: UploadFile) -> None:
-    """验证上传文件"""
-    # 检查文件大小
-    if file.size and file.size > settings.max_file_size:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"文件大小超过限制 ({settings.max_file_size / 1024 / 1024}MB)"
-        )
-    
-    # 检查文件扩展名
-    if file.filename:
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in settings.allowed_extensions:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"不支持的文件类型。支持的类型: {', '.join(settings.allowed_extensions)}"
-            )
-
-
-async def save_uploaded_file(file: UploadFile) -> Tuple[str, str, int, int, int]:
-    """保存上传的文件并返回文件信息"""
-    # 生成唯一文件名
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(settings.upload_dir, filename)
-    
-    # 确保上传目录存在
-    os.makedirs(settings.upload_dir, exist_ok=True)
-    
-    # 保存文件
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    file_size = len(content)
-    
-    # 获取图片尺寸
-    width, height = None, None
-    try:
-        with Image.open(file_path) as img:
-            width, height = img.size
-            
-            # 生成缩略图
-            thumbnail_size = (300, 300)
-            img.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
-            thumbnail_path = os.path.join(settings.upload_dir, f"thumb_{filename}")
-            img.save(thumbnail_path, optimize=True, quality=85)
-            
-    except Exception as e:
-        print(f"处理图片时出错: {e}")
-    
-    return filename, file_path, file_size, width, height
-
-
 @router.post("/", response_model=UploadResponse, summary="上传照片")
 async def upload_photo(
     album_id: int = Form(..., description="相册ID"),
@@ -98,46 +55,48 @@ async def upload_photo(
             detail="相册不存在"
         )
     
+    photo = None
+    duplicates = []
     try:
-        # 保存文件
-        filename, file_path, file_size, width, height = await save_uploaded_file(file)
+        # 保存文件（内容已存在时直接使用已有文件）
+        fields = await save_uploaded_file(file)
         
         # 创建数据库记录
         photo = Photo(
             album_id=album_id,
-            filename=filename,
             original_filename=file.filename,
-            file_path=file_path,
-            file_size=file_size,
-            width=width,
-            height=height,
-            description=description
+            description=description,
+            **fields
         )
         
-        db.add(photo)
+        duplicates = await add_photos(db, [photo])
         await db.commit()
         await db.refresh(photo)
         
-        return UploadResponse(
-            message="照片上传成功",
-            photo=photo_to_response(photo)
-        )
-        
+    except HTTPException:
+        raise
     except Exception as e:
-        # 如果数据库操作失败，删除已保存的文件
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+        # 如果数据库操作失败，删除新保存的文件
+        if photo is not None:
+            await discard_new_files([photo] + duplicates)
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"上传失败: {str(e)}"
         )
+    
+    await delete_photo_files(duplicates)
+    return UploadResponse(
+        message="照片上传成功",
+        photo=photo_to_response(photo)
+    )
 
 
 @router.post("/multiple", summary="批量上传照片")
 async def upload_multiple_photos(
     album_id: int = Form(..., description="相册ID"),
     files: List[UploadFile] = File(..., description="照片文件列表"),
+    batch_id: str = Form(None, description="批次ID，用于查询处理进度"),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -145,6 +104,7 @@ async def upload_multiple_photos(
     
     - **album_id**: 目标相册ID
     - **files**: 照片文件列表
+    - **batch_id**: 批次ID（可选），可通过 /api/upload/progress/{batch_id} 查询进度
     """
     # 检查相册是否存在
     album_result = await db.execute(
@@ -164,51 +124,199 @@ async def upload_multiple_photos(
             detail="单次最多上传1000张照片"
         )
     
-    successful_uploads = []
-    failed_uploads = []
-    
-    for file in files:
-        try:
-            # 验证文件
-            validate_file(file)
-            
-            # 保存文件
-            filename, file_path, file_size, width, height = await save_uploaded_file(file)
-            
-            # 创建数据库记录
-            photo = Photo(
-                album_id=album_id,
-                filename=filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                file_size=file_size,
-                width=width,
-                height=height
-            )
-            
-            db.add(photo)
-            successful_uploads.append({
-                "filename": file.filename,
-                "status": "success"
-            })
-            
-        except Exception as e:
-            failed_uploads.append({
-                "filename": file.filename,
-                "status": "failed",
-                "error": str(e)
-            })
+    # 并发处理所有文件，最后一次性写入数据库
+    photos, progress = await ingest_files(db, album_id, files, batch_id)
     
-    # 提交成功的上传
-    await db.commit()
+    successful_uploads = [item for item in progress["files"] if item["status"] == "success"]
+    failed_uploads = [item for item in progress["files"] if item["status"] == "failed"]
     
     return {
         "message": f"批量上传完成。成功: {len(successful_uploads)}, 失败: {len(failed_uploads)}",
+        "batch_id": progress["batch_id"],
         "successful": successful_uploads,
         "failed": failed_uploads
     }
 
 
+@router.post("/direct", response_model=DirectUploadResponse, summary="创建直传地址")
+async def create_direct_upload(
+    upload_data: DirectUploadCreate,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取把原图直接上传到对象存储的预签名地址，文件不经过 API 服务器
+
+    客户端按返回的 method、url、headers 上传文件，完成后调用
+    /api/upload/direct/complete。本地存储不支持直传，请使用断点续传接口。
+    """
+    file_ext = os.path.splitext(upload_data.filename)[1].lower()
+    if file_ext not in settings.allowed_extensions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的文件类型。支持的类型: {', '.join(settings.allowed_extensions)}"
+        )
+    if upload_data.size > settings.max_file_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"文件大小超过限制 ({settings.max_file_size / 1024 / 1024}MB)"
+        )
+
+    album_result = await db.execute(
+        select(Album.id).where(Album.id == upload_data.album_id)
+    )
+    if album_result.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="相册不存在"
+        )
+
+    filename = f"{uuid.uuid4()}{file_ext}"
+    key = storage_key(layout_path(filename))
+    content_type = upload_data.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    expires = settings.s3_presign_expires
+
+    target = get_storage().presign_put(key, content_type, expires)
+    if target is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="当前存储后端不支持直传，请使用断点续传接口 /api/upload/sessions"
+        )
+
+    # 上传凭证记录本次上传的全部信息，服务器不需要保存状态
+    expires_at = datetime.utcnow() + timedelta(seconds=expires)
+    upload_token = jwt.encode(
+        {
+            "type": "direct_upload",
+            "key": key,
+            "filename": filename,
+            "original_filename": upload_data.filename,
+            "album_id": upload_data.album_id,
+            "description": upload_data.description,
+            "exp": expires_at
+        },
+        settings.secret_key,
+        algorithm=settings.algorithm
+    )
+
+    return DirectUploadResponse(upload_token=upload_token, expires_at=expires_at, **target)
+
+
+@router.post("/direct/complete", response_model=UploadResponse, summary="完成直传")
+async def complete_direct_upload(
+    complete_data: DirectUploadComplete,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    文件上传到对象存储后调用：生成衍生图并创建照片记录
+
+    - **upload_token**: 创建直传地址时返回的凭证
+    """
+    try:
+        payload = jwt.decode(
+            complete_data.upload_token,
+            settings.secret_key,
+            algorithms=[settings.algorithm]
+        )
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="上传凭证无效或已过期"
+        )
+    if payload.get("type") != "direct_upload":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="上传凭证无效或已过期"
+        )
+
+    storage = get_storage()
+    key = payload["key"]
+    filename = payload["filename"]
+
+    # 重复调用时直接返回已创建的照片
+    existing = await db.execute(select(Photo).where(Photo.filename == filename))
+    photo = existing.scalar_one_or_none()
+    if photo is not None:
+        return UploadResponse(message="照片上传成功", photo=photo_to_response(photo))
+
+    file_size = await storage.size(key)
+    if file_size is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="文件尚未上传"
+        )
+    if file_size > settings.max_file_size:
+        await storage.delete(key)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"文件大小超过限制 ({settings.max_file_size / 1024 / 1024}MB)"
+        )
+
+    album_result = await db.execute(
+        select(Album.id).where(Album.id == payload["album_id"])
+    )
+    if album_result.scalar_one_or_none() is None:
+        await storage.delete(key)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="相册不存在"
+        )
+
+    # 下载到上传目录中键对应的位置生成衍生图，之后只上传衍生图；
+    # 内容与已有照片相同时删除直传的原图，使用已有文件
+    file_path = storage.local_staging_path(key)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    photo = Photo(
+        album_id=payload["album_id"],
+        filename=filename,
+        original_filename=payload["original_filename"],
+        file_path=file_path,
+        file_size=file_size,
+        description=payload.get("description")
+    )
+    duplicates = []
+    try:
+        await storage.get(key, file_path)
+        content_sha256, content_crc32 = await run_in_threadpool(file_digests, file_path)
+        fields = await process_or_reuse(
+            filename, file_path, file_size, content_sha256, content_crc32, original_stored=True
+        )
+        for field, value in fields.items():
+            setattr(photo, field, value)
+
+        duplicates = await add_photos(db, [photo])
+        await db.commit()
+        await db.refresh(photo)
+    except Exception as e:
+        await db.rollback()
+        await discard_new_files([photo] + duplicates)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"上传失败: {str(e)}"
+        )
+
+    await delete_photo_files(duplicates)
+    return UploadResponse(
+        message="照片上传成功",
+        photo=photo_to_response(photo)
+    )
+
+
+@router.get("/progress/{batch_id}", summary="查询批量上传进度")
+async def get_batch_progress(batch_id: str):
+    """
+    查询批量上传的处理进度
+    
+    - **batch_id**: 上传时提交的批次ID
+    """
+    progress = batch_progress.get(batch_id)
+    if not progress:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="上传批次不存在"
+        )
+    return progress
+
+
 @router.get("/info", summary="获取上传配置")
 async def get_upload_info():
     """
@@ -218,5 +326,8 @@ async def get_upload_info():
         "max_file_size": settings.max_file_size,
         "max_file_size_mb": settings.max_file_size / 1024 / 1024,
         "allowed_extensions": settings.allowed_extensions,
-        "upload_dir": settings.upload_dir
+        "upload_dir": settings.upload_dir,
+        "storage_backend": settings.storage_backend,
+        # 为 True 时可以通过 /api/upload/direct 把原图直接上传到对象存储
+        "direct_upload": not get_storage().is_local
     } 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, TypeVar, Generic
+from typing import Optional, List, Dict, TypeVar, Generic
 from datetime import datetime
 
 T = TypeVar('T')
@@ -32,18 +32,19 @@ class AlbumCreate(AlbumBase):
 
 
 class AlbumUpdate(BaseModel):
-    name: str = None
-    description: str = None
-    sort_order: int = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    sort_order: Optional[int] = None
 
 
 class AlbumResponse(BaseModel):
     id: int
     name: str
-    description: str = None
-    cover_image: str = None
+    description: Optional[str] = None
+    cover_image: Optional[str] = None
     sort_order: int = 0
     photo_count: int = 0
+    total_bytes: int = 0
     is_deleted: bool = False
     deleted_at: Optional[datetime] = None
     created_at: datetime
@@ -62,14 +63,22 @@ class PhotoResponse(BaseModel):
     original_filename: str
     file_path: str
     file_size: int
-    width: int = None
-    height: int = None
+    width: Optional[int] = None
+    height: Optional[int] = None
     description: Optional[str] = None
     sort_order: int = 0
     is_deleted: bool = False
     deleted_at: Optional[datetime] = None
-    url: str
+    url: str  # 预览图（无预览图时为原图）
+    original_url: str
     thumbnail_url: str
+    preview_webp_url: Optional[str] = None
+    thumbnail_webp_url: Optional[str] = None
+    taken_at: Optional[datetime] = None  # 拍摄时间（EXIF，没有时为上传时间）
+    camera_make: Optional[str] = None
+    camera_model: Optional[str] = None
+    lens_model: Optional[str] = None
+    orientation: Optional[int] = None  # EXIF 方向，宽高是未旋转的原始尺寸
     created_at: datetime
 
 
@@ -84,6 +93,49 @@ class UploadResponse(BaseModel):
     photo: PhotoResponse
 
 
+# 断点续传
+class UploadSessionCreate(BaseModel):
+    album_id: int = Field(..., description="相册ID")
+    filename: str = Field(..., min_length=1, max_length=255, description="原始文件名")
+    size: int = Field(..., gt=0, description="文件总大小（字节）")
+    description: Optional[str] = Field(None, max_length=500, description="照片描述")
+
+
+class UploadSessionComplete(BaseModel):
+    sha256: Optional[str] = Field(None, description="客户端计算的 SHA-256，用于校验文件完整性")
+
+
+class UploadSessionResponse(BaseModel):
+    session_id: str
+    album_id: int
+    filename: str
+    size: int
+    offset: int
+    chunk_size: int
+    expires_at: datetime
+
+
+# 直传对象存储
+class DirectUploadCreate(BaseModel):
+    album_id: int = Field(..., description="相册ID")
+    filename: str = Field(..., min_length=1, max_length=255, description="原始文件名")
+    size: int = Field(..., gt=0, description="文件大小（字节）")
+    content_type: Optional[str] = Field(None, max_length=100, description="文件类型，不传时按扩展名推断")
+    description: Optional[str] = Field(None, max_length=500, description="照片描述")
+
+
+class DirectUploadResponse(BaseModel):
+    upload_token: str
+    method: str
+    url: str
+    headers: Dict[str, str]
+    expires_at: datetime
+
+
+class DirectUploadComplete(BaseModel):
+    upload_token: str = Field(..., description="创建直传时返回的 upload_token")
+
+
 # 通用响应
 class MessageResponse(BaseModel):
     message: str
@@ -111,8 +163,8 @@ class ErrorResponse(BaseModel):
 class TrashAlbumResponse(BaseModel):
     id: int
     name: str
-    description: str = None
-    cover_image: str = None
+    description: Optional[str] = None
+    cover_image: Optional[str] = None
     photo_count: int = 0
     deleted_at: datetime
     created_at: datetime
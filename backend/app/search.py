@@ -0,0 +1,153 @@
+"""
+照片和相册的全文搜索
+
+索引由迁移 7（search_index）创建，数据库触发器在插入、修改、删除时同步，应用代码
+不需要维护：
+- SQLite：FTS5 外部内容表 photos_fts(original_filename, description) 和
+  albums_fts(name, description)，使用 trigram 分词器，中文和文件名片段都能按子串
+  匹配，按 bm25 排序
+- PostgreSQL：search_vector（tsvector）字段和 GIN 索引，按词前缀匹配，按 ts_rank 排序
+
+关键词按空白拆分，多个关键词需要同时出现。trigram 索引只能查找 3 个字符以上的片段，
+1~2 个字符的关键词在其他关键词的匹配结果上用 LIKE 过滤；只有短关键词时退化为扫描
+索引表（不在 query_plans.py 中登记），结果按 ID 倒序。
+
+匹配片段的高亮在 Python 中完成：先转义 HTML，再把关键词包在 <mark> 中。
+"""
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import column, func, literal_column, or_, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Album, Photo
+
+# trigram 分词器能用于 MATCH 的最短关键词
+MIN_MATCH_LENGTH = 3
+
+# 最多使用的关键词个数
+MAX_TERMS = 8
+
+# 高亮片段的长度（字符数）
+SNIPPET_LENGTH = 64
+
+photos_fts = table("photos_fts", column("rowid"), column("rank"), column("original_filename"), column("description"))
+albums_fts = table("albums_fts", column("rowid"), column("rank"), column("name"), column("description"))
+
+
+def split_terms(query: str) -> List[str]:
+    """按空白拆分关键词，去重并保持顺序"""
+    terms = []
+    for term in query.split():
+        if term.lower() not in (existing.lower() for existing in terms):
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def fts5_phrase(term: str) -> str:
+    """把关键词写成 FTS5 短语，避免其中的引号、星号等被当作查询语法"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def tsquery_text(terms: List[str]) -> str:
+    """PostgreSQL to_tsquery 的参数：每个关键词按前缀匹配，同时出现"""
+    quoted = ["'" + term.replace("\\", "\\\\").replace("'", "''") + "':*" for term in terms]
+    return " & ".join(quoted)
+
+
+def sqlite_search(model, fts, text_columns: Tuple[str, ...], terms: List[str]):
+    """SQLite：返回 (查询, 排序列)，查询以 FTS 表为主表连接模型表"""
+    query = select(model).select_from(fts).join(model, model.id == fts.c.rowid)
+    match_terms = [term for term in terms if len(term) >= MIN_MATCH_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_MATCH_LENGTH]
+    if match_terms:
+        query = query.where(literal_column(fts.name).op("MATCH")(" ".join(fts5_phrase(term) for term in match_terms)))
+    for term in short_terms:
+        pattern = like_pattern(term)
+        query = query.where(or_(*(fts.c[name].like(pattern, escape="\\") for name in text_columns)))
+    # 只按 rank（或 rowid）排序时由 FTS5 内部排序，同分的结果按 rowid 顺序，翻页稳定
+    order_by = [fts.c.rank] if match_terms else [fts.c.rowid.desc()]
+    return query, order_by
+
+
+def postgresql_search(model, terms: List[str]):
+    """PostgreSQL：search_vector 不在模型中定义（SQLite 没有这一列），直接引用列名"""
+    vector = literal_column(f"{model.__tablename__}.search_vector")
+    tsquery = func.to_tsquery("simple", tsquery_text(terms))
+    query = select(model).where(vector.op("@@")(tsquery))
+    return query, [func.ts_rank(vector, tsquery).desc(), model.id.desc()]
+
+
+async def search(
+    db: AsyncSession, model, terms: List[str], filters: list, page: int, size: int
+) -> Tuple[list, bool]:
+    """搜索照片或相册，返回 (本页结果, 是否还有下一页)"""
+    if db.get_bind().dialect.name == "postgresql":
+        query, order_by = postgresql_search(model, terms)
+    elif model is Photo:
+        query, order_by = sqlite_search(Photo, photos_fts, ("original_filename", "description"), terms)
+    else:
+        query, order_by = sqlite_search(Album, albums_fts, ("name", "description"), terms)
+
+    result = await db.execute(
+        query.where(*filters).order_by(*order_by).offset((page - 1) * size).limit(size + 1)
+    )
+    rows = result.scalars().all()
+    return rows[:size], len(rows) > size
+
+
+def term_pattern(terms: List[str]) -> Optional[re.Pattern]:
+    if not terms:
+        return None
+    # 长的关键词优先，避免被其中包含的短关键词截断
+    alternatives = sorted((re.escape(term) for term in terms), key=len, reverse=True)
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
+def highlight(text: Optional[str], terms: List[str], length: Optional[int] = None) -> Optional[str]:
+    """
+    转义 HTML 后用 <mark> 标出关键词；指定 length 时截取第一个关键词附近的片段，
+    没有匹配的关键词时截取开头
+    """
+    if not text:
+        return None
+    pattern = term_pattern(terms)
+    first = pattern.search(text) if pattern else None
+    if length is not None:
+        anchor = first.start() if first else 0
+        start = max(0, min(anchor - length // 4, len(text) - length))
+        end = start + length
+        prefix = "…" if start > 0 else ""
+        suffix = "…" if end < len(text) else ""
+        text = text[start:end]
+    else:
+        prefix = suffix = ""
+
+    parts = []
+    position = 0
+    for match in (pattern.finditer(text) if pattern else ()):
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(html.escape(text[position:]))
+    return prefix + "".join(parts) + suffix
+
+
+def photo_highlights(photo: Photo, terms: List[str]) -> Dict[str, Optional[str]]:
+    return {
+        "original_filename": highlight(photo.original_filename, terms),
+        "description": highlight(photo.description, terms, SNIPPET_LENGTH),
+    }
+
+
+def album_highlights(album: Album, terms: List[str]) -> Dict[str, Optional[str]]:
+    return {
+        "name": highlight(album.name, terms),
+        "description": highlight(album.description, terms, SNIPPET_LENGTH),
+    }
@@ -0,0 +1,163 @@
+"""
+感知哈希（dHash）与相似照片查找
+
+dHash：把图片缩成 9x8 的灰度图，比较每行相邻像素的亮度得到 64 位。连拍、重新
+压缩、缩放导出的照片哈希只差几位，用汉明距离衡量相似程度。哈希在生成衍生图时
+顺便计算（见 image_worker.image_dhash），旧照片用 migrate.py backfill-dhash 补算。
+数据库中按有符号 64 位整数（BIGINT）保存。
+
+查找用多索引哈希：64 位分成 4 段 16 位，分别存在 dhash_0 ~ dhash_3 列上并建索引。
+两张照片的距离不超过 d 时，至少有一段的距离不超过 d // 4（抽屉原理），所以只需要
+对每一段查找「与它相差不超过 r 位」的值（r = d // 4，称为多探针），再对候选计算
+完整的汉明距离。每次查找只读取几个索引桶，与照片总数无关：
+- similar_photos：某张照片的相似照片，在数据库索引上查找
+- album_duplicate_groups：某个相册内的相似照片分组，把相册内照片的哈希按同样的
+  分段方式建成内存中的哈希表后逐张查找，不做两两比较
+"""
+from collections import defaultdict
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Photo
+
+SEGMENTS = 4
+SEGMENT_BITS = 16
+SEGMENT_MASK = (1 << SEGMENT_BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+# 页面和接口允许的最大距离：r = 2 时每段探测 137 个值，再大候选会迅速增多
+MAX_DISTANCE = 11
+
+
+def hash_segments(value: int) -> Tuple[int, ...]:
+    """把哈希分成 4 段 16 位的无符号整数，高位在前"""
+    value &= HASH_MASK
+    return tuple(
+        (value >> (SEGMENT_BITS * (SEGMENTS - 1 - index))) & SEGMENT_MASK
+        for index in range(SEGMENTS)
+    )
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & HASH_MASK).count("1")
+
+
+@lru_cache(maxsize=None)
+def flip_masks(radius: int) -> Tuple[int, ...]:
+    """翻转不超过 radius 位的所有 16 位掩码（含 0）"""
+    masks = [0]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(SEGMENT_BITS), flips):
+            masks.append(sum(1 << bit for bit in bits))
+    return tuple(masks)
+
+
+def probe_values(segment: int, radius: int) -> List[int]:
+    """与 segment 相差不超过 radius 位的所有 16 位值"""
+    return [segment ^ mask for mask in flip_masks(radius)]
+
+
+def probe_radius(max_distance: int) -> int:
+    return max_distance // SEGMENTS
+
+
+def dhash_columns(value: Optional[int]) -> Dict[str, Optional[int]]:
+    """dhash 及其分段列的值（用 update() 语句批量写入时使用）"""
+    segments = hash_segments(value) if value is not None else (None,) * SEGMENTS
+    return {"dhash": value, **{f"dhash_{index}": segment for index, segment in enumerate(segments)}}
+
+
+@event.listens_for(Photo.dhash, "set")
+def _set_segments(photo: Photo, value: Optional[int], oldvalue, initiator):
+    """设置 dhash 时同步更新分段列"""
+    for column, segment in dhash_columns(value).items():
+        if column != "dhash":
+            setattr(photo, column, segment)
+
+
+async def similar_photos(
+    db: AsyncSession, photo: Photo, max_distance: int, limit: int = 100
+) -> List[Tuple[Photo, int]]:
+    """与 photo 相似的未删除照片，返回 [(照片, 距离)]，按距离从近到远"""
+    if photo.dhash is None:
+        return []
+
+    radius = probe_radius(max_distance)
+    conditions = [
+        getattr(Photo, f"dhash_{index}").in_(probe_values(segment, radius))
+        for index, segment in enumerate(hash_segments(photo.dhash))
+    ]
+    result = await db.execute(
+        select(Photo).where(or_(*conditions), Photo.id != photo.id, Photo.is_deleted == False)
+    )
+
+    matches = []
+    for candidate in result.scalars().all():
+        distance = hamming(photo.dhash, candidate.dhash)
+        if distance <= max_distance:
+            matches.append((candidate, distance))
+    matches.sort(key=lambda item: (item[1], item[0].id))
+    return matches[:limit]
+
+
+def group_similar(hashes: Dict[int, int], max_distance: int) -> List[List[int]]:
+    """
+    把 {照片ID: 哈希} 按相似关系分组（相似关系可以传递），返回各组的照片ID
+
+    只返回至少两张照片的组，组内按 ID 排序，组按第一张照片的 ID 排序。
+    """
+    radius = probe_radius(max_distance)
+    tables = [defaultdict(list) for _ in range(SEGMENTS)]
+    for photo_id, value in hashes.items():
+        for index, segment in enumerate(hash_segments(value)):
+            tables[index][segment].append(photo_id)
+
+    # 并查集
+    parent = {photo_id: photo_id for photo_id in hashes}
+
+    def find(photo_id: int) -> int:
+        while parent[photo_id] != photo_id:
+            parent[photo_id] = parent[parent[photo_id]]
+            photo_id = parent[photo_id]
+        return photo_id
+
+    for photo_id, value in hashes.items():
+        checked = {photo_id}
+        for index, segment in enumerate(hash_segments(value)):
+            for probe in probe_values(segment, radius):
+                for other_id in tables[index].get(probe, ()):
+                    if other_id in checked:
+                        continue
+                    checked.add(other_id)
+                    if hamming(value, hashes[other_id]) <= max_distance:
+                        parent[find(other_id)] = find(photo_id)
+
+    groups = defaultdict(list)
+    for photo_id in hashes:
+        groups[find(photo_id)].append(photo_id)
+    return sorted(
+        (sorted(members) for members in groups.values() if len(members) > 1),
+        key=lambda members: members[0]
+    )
+
+
+async def album_duplicate_groups(
+    db: AsyncSession, album_id: int, max_distance: int
+) -> List[List[Photo]]:
+    """相册内相似的未删除照片分组"""
+    result = await db.execute(
+        select(Photo.id, Photo.dhash)
+        .where(Photo.album_id == album_id, Photo.is_deleted == False, Photo.dhash.is_not(None))
+    )
+    groups = group_similar(dict(result.all()), max_distance)
+    if not groups:
+        return []
+
+    ids = [photo_id for members in groups for photo_id in members]
+    photos_result = await db.execute(select(Photo).where(Photo.id.in_(ids)))
+    photos = {photo.id: photo for photo in photos_result.scalars().all()}
+    return [[photos[photo_id] for photo_id in members] for members in groups]
@@ -0,0 +1,40 @@
+"""
+媒体文件存储
+
+通过 settings.storage_backend 选择：
+- local：文件保存在本地上传目录（默认）
+- s3：S3 兼容的对象存储，支持客户端预签名直传
+
+使用方式：
+    from app.storage import get_storage
+    storage = get_storage()
+    await storage.publish([key])
+"""
+from typing import Optional
+
+from ..config import settings
+from .base import StorageBackend
+from .local import LocalStorage
+
+_storage: Optional[StorageBackend] = None
+
+
+def create_storage(backend: str) -> StorageBackend:
+    if backend == "local":
+        return LocalStorage()
+    if backend == "s3":
+        # boto3 是可选依赖，只在使用 S3 时导入
+        from .s3 import S3Storage
+        return S3Storage()
+    raise ValueError(f"未知的存储后端: {backend}")
+
+
+def get_storage() -> StorageBackend:
+    """返回按配置创建的存储后端（进程内单例）"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage(settings.storage_backend)
+    return _storage
+
+
+__all__ = ["StorageBackend", "LocalStorage", "create_storage", "get_storage"]
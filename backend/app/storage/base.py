@@ -0,0 +1,80 @@
+"""
+存储后端接口
+
+对象用键（key）标识，键是文件相对上传目录的路径，如 "ab/cd/<uuid>.jpg"、
+"ab/cd/thumb_<uuid>.jpg"。照片的键由 Photo.file_path 推出（见 derivatives.photo_key），
+因此切换后端不需要修改数据库。
+
+图片处理（生成衍生图、按需渲染）需要本地文件：入库时文件先写到上传目录下键对应的
+位置，处理完成后调用 publish() 交给存储后端；本地后端什么都不用做，远程后端上传后
+删除本地副本。读取时用 open_local() 取得一个本地路径。
+"""
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from ..config import settings
+
+
+class StorageBackend:
+    """存储后端基类，子类实现各个方法"""
+
+    # 文件是否就在本地上传目录中（此时 /uploads 直接由本进程提供静态文件服务）
+    is_local = False
+
+    async def put(self, key: str, local_path: str, content_type: Optional[str] = None):
+        """把本地文件保存为 key"""
+        raise NotImplementedError
+
+    async def get(self, key: str, local_path: str):
+        """把 key 下载到本地文件，不存在时抛出 FileNotFoundError"""
+        raise NotImplementedError
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """按块读取 [start, end]（含 end）范围的内容"""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        """删除 key，不存在时忽略"""
+        raise NotImplementedError
+
+    async def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            await self.delete(key)
+
+    async def size(self, key: str) -> Optional[int]:
+        """返回对象大小，不存在时返回 None"""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    def url(self, key: str) -> str:
+        """客户端访问 key 的地址：以 / 开头的路径（相对 API 域名）或完整 URL"""
+        return f"/uploads/{key}"
+
+    def presign_get(self, key: str, expires: int) -> str:
+        """限时下载地址，本地后端直接返回 url()"""
+        return self.url(key)
+
+    def presign_put(self, key: str, content_type: str, expires: int) -> Optional[Dict]:
+        """
+        客户端直传的限时上传地址，返回 {"method", "url", "headers"}
+
+        不支持直传的后端返回 None（本地后端请使用断点续传接口）。
+        """
+        return None
+
+    def local_staging_path(self, key: str) -> str:
+        """入库和处理时 key 在本地的位置"""
+        return os.path.join(settings.upload_dir, *key.split("/"))
+
+    async def publish(self, keys: Iterable[str]):
+        """入库处理完成后，把本地暂存的文件交给存储后端"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def open_local(self, key: str):
+        """取得 key 的本地路径，用完后远程后端会删除临时文件"""
+        raise NotImplementedError
+        yield  # pragma: no cover
@@ -0,0 +1,67 @@
+"""
+本地文件系统存储（默认）
+
+文件就放在上传目录中，由 /uploads 的静态文件服务（app/media.py）直接提供。
+"""
+import os
+import shutil
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, Optional
+
+import anyio
+from fastapi.concurrency import run_in_threadpool
+
+from .base import StorageBackend
+
+
+class LocalStorage(StorageBackend):
+    is_local = True
+    chunk_size = 64 * 1024
+
+    def path(self, key: str) -> str:
+        return self.local_staging_path(key)
+
+    async def put(self, key: str, local_path: str, content_type: Optional[str] = None):
+        target = self.path(key)
+        if os.path.abspath(local_path) == os.path.abspath(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        await run_in_threadpool(shutil.copyfile, local_path, target)
+
+    async def get(self, key: str, local_path: str):
+        await run_in_threadpool(shutil.copyfile, self.path(key), local_path)
+
+    async def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(self.path(key), mode="rb") as file:
+            await file.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+                chunk = await file.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    async def publish(self, keys: Iterable[str]):
+        # 文件已经在最终位置
+        return None
+
+    @asynccontextmanager
+    async def open_local(self, key: str):
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        yield path
@@ -0,0 +1,175 @@
+"""
+S3 兼容对象存储（AWS S3、MinIO、Cloudflare R2 等）
+
+需要安装 boto3。图片由客户端直接从存储（或前面的 CDN）下载，原图可以通过预签名
+地址直接上传到存储，API 服务器不再承担媒体流量。
+
+本地用 MinIO 测试：
+    docker run -p 9000:9000 minio/minio server /data
+    STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:9000 S3_BUCKET=photos \
+    S3_ACCESS_KEY=minioadmin S3_SECRET_KEY=minioadmin python main.py
+"""
+import mimetypes
+import os
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from ..config import settings
+from .base import StorageBackend
+
+# delete_objects 每次最多删除 1000 个对象
+DELETE_BATCH = 1000
+
+
+class S3Storage(StorageBackend):
+    is_local = False
+    chunk_size = 256 * 1024
+
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("使用 S3 存储需要安装 boto3: pip install boto3")
+
+        if not settings.s3_bucket:
+            raise RuntimeError("使用 S3 存储需要配置 S3_BUCKET")
+
+        self.bucket = settings.s3_bucket
+        self.prefix = settings.s3_prefix.strip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.s3_endpoint_url or None,
+            region_name=settings.s3_region,
+            aws_access_key_id=settings.s3_access_key or None,
+            aws_secret_access_key=settings.s3_secret_key or None,
+            config=Config(
+                signature_version="s3v4",
+                # MinIO 等自建服务通常不支持虚拟主机风格的桶地址
+                s3={"addressing_style": "path" if settings.s3_endpoint_url else "auto"},
+                max_pool_connections=settings.s3_max_connections,
+            ),
+        )
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @staticmethod
+    def content_type(key: str) -> str:
+        return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    async def put(self, key: str, local_path: str, content_type: Optional[str] = None):
+        await run_in_threadpool(
+            self.client.upload_file,
+            local_path,
+            self.bucket,
+            self.object_key(key),
+            ExtraArgs={
+                "ContentType": content_type or self.content_type(key),
+                # 文件名是 UUID，内容不会变
+                "CacheControl": f"public, max-age={settings.media_max_age}, immutable",
+            },
+        )
+
+    async def get(self, key: str, local_path: str):
+        from botocore.exceptions import ClientError
+        try:
+            await run_in_threadpool(self.client.download_file, self.bucket, self.object_key(key), local_path)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise FileNotFoundError(key)
+            raise
+
+    async def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = await run_in_threadpool(
+            self.client.get_object, Bucket=self.bucket, Key=self.object_key(key), Range=byte_range
+        )
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await run_in_threadpool(body.read, self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        for index in range(0, len(keys), DELETE_BATCH):
+            batch = keys[index:index + DELETE_BATCH]
+            await run_in_threadpool(
+                self.client.delete_objects,
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self.object_key(key)} for key in batch], "Quiet": True},
+            )
+
+    async def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+        try:
+            response = await run_in_threadpool(
+                self.client.head_object, Bucket=self.bucket, Key=self.object_key(key)
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["ContentLength"]
+
+    def url(self, key: str) -> str:
+        if settings.s3_public_url:
+            return f"{settings.s3_public_url.rstrip('/')}/{self.object_key(key)}"
+        # 私有桶：由 /uploads 重定向到预签名地址
+        return f"/uploads/{key}"
+
+    def presign_get(self, key: str, expires: int) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key)},
+            ExpiresIn=expires,
+        )
+
+    def presign_put(self, key: str, content_type: str, expires: int) -> Optional[Dict]:
+        headers = {
+            "Content-Type": content_type,
+            "Cache-Control": f"public, max-age={settings.media_max_age}, immutable",
+        }
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.object_key(key),
+                "ContentType": headers["Content-Type"],
+                "CacheControl": headers["Cache-Control"],
+            },
+            ExpiresIn=expires,
+        )
+        # 签名包含这两个请求头，客户端上传时必须原样带上
+        return {"method": "PUT", "url": url, "headers": headers}
+
+    async def publish(self, keys: Iterable[str]):
+        for key in keys:
+            local_path = self.local_staging_path(key)
+            if not os.path.exists(local_path):
+                continue
+            await self.put(key, local_path)
+            os.remove(local_path)
+
+    @asynccontextmanager
+    async def open_local(self, key: str):
+        suffix = os.path.splitext(key)[1]
+        path = os.path.join(tempfile.gettempdir(), f"photo-{uuid.uuid4().hex}{suffix}")
+        try:
+            await self.get(key, path)
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
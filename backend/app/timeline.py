@@ -0,0 +1,218 @@
+"""
+时间线：按拍摄时间分组的照片数量（timeline_buckets 表）
+
+每张未删除的照片计入 6 个分组：所在相册和整个图库（album_id 为 0）各自的年、月、日。
+照片入库、移入回收站、恢复和删除时由 album_stats 调用这里的函数，在同一个事务里
+增量更新计数和封面，时间线接口直接读取分组，不对照片表做 GROUP BY。
+
+- photos_added：INSERT ... ON CONFLICT 累加计数，新照片比原封面晚时替换封面
+- photos_removed：扣减计数，删除计数归零的分组；封面被移除的分组按索引
+  （ix_photos_album_taken / ix_photos_taken）找出剩余照片中最晚的一张作为新封面
+- rebuild_timeline：按照片表重建全部分组（迁移和 reconcile_album_stats.py 使用）
+
+拍摄时间是 EXIF 中的相机本地时间，没有 EXIF 的照片按上传时间（UTC）归档。
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import Photo, TimelineBucket
+
+# 分组级别 -> period 的格式
+LEVELS = {"year": "%Y", "month": "%Y-%m", "day": "%Y-%m-%d"}
+
+# 整个图库的分组
+LIBRARY = 0
+
+# 批量写入时每条语句的行数（SQLite 限制单条语句的参数个数）
+BATCH_ROWS = 500
+
+BucketKey = Tuple[int, str, str]
+
+
+def bucket_keys(album_id: int, taken_at: datetime) -> List[BucketKey]:
+    """照片所属的分组 [(album_id, level, period)]"""
+    return [
+        (scope, level, taken_at.strftime(period_format))
+        for scope in (album_id, LIBRARY)
+        for level, period_format in LEVELS.items()
+    ]
+
+
+def period_level(period: str) -> Optional[str]:
+    """由 period 的格式判断分组级别，格式不对时返回 None"""
+    for level, period_format in LEVELS.items():
+        try:
+            datetime.strptime(period, period_format)
+        except ValueError:
+            continue
+        if len(period) == len(datetime(2000, 1, 1).strftime(period_format)):
+            return level
+    return None
+
+
+def period_range(period: str) -> Tuple[datetime, datetime]:
+    """分组覆盖的时间范围 [start, end)"""
+    level = period_level(period)
+    start = datetime.strptime(period, LEVELS[level])
+    if level == "year":
+        end = start.replace(year=start.year + 1)
+    elif level == "month":
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    else:
+        end = datetime.fromordinal(start.toordinal() + 1)
+    return start, end
+
+
+def aggregate(rows: Iterable[Tuple[int, int, datetime]]) -> Dict[BucketKey, List]:
+    """把 [(照片ID, 相册ID, 拍摄时间)] 汇总为 {分组: [数量, 封面照片ID, 封面拍摄时间, 照片ID列表]}"""
+    buckets: Dict[BucketKey, List] = {}
+    for photo_id, album_id, taken_at in rows:
+        for key in bucket_keys(album_id, taken_at):
+            entry = buckets.get(key)
+            if entry is None:
+                buckets[key] = [1, photo_id, taken_at, [photo_id]]
+                continue
+            entry[0] += 1
+            entry[3].append(photo_id)
+            if (taken_at, photo_id) > (entry[2], entry[1]):
+                entry[1], entry[2] = photo_id, taken_at
+    return buckets
+
+
+def bucket_values(buckets: Dict[BucketKey, List]) -> List[Dict]:
+    return [
+        {
+            "album_id": album_id, "level": level, "period": period, "photo_count": count,
+            "cover_photo_id": cover_photo_id, "cover_taken_at": cover_taken_at,
+        }
+        for (album_id, level, period), (count, cover_photo_id, cover_taken_at, _) in buckets.items()
+    ]
+
+
+def upsert_buckets(dialect_name: str, values: List[Dict]):
+    """新增分组，分组已存在时累加数量，新照片更晚时替换封面"""
+    insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    statement = insert(TimelineBucket).values(values)
+    excluded = statement.excluded
+    newer = or_(
+        TimelineBucket.cover_photo_id.is_(None),
+        excluded.cover_taken_at > TimelineBucket.cover_taken_at,
+        and_(
+            excluded.cover_taken_at == TimelineBucket.cover_taken_at,
+            excluded.cover_photo_id > TimelineBucket.cover_photo_id
+        ),
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[TimelineBucket.album_id, TimelineBucket.level, TimelineBucket.period],
+        set_={
+            "photo_count": TimelineBucket.photo_count + excluded.photo_count,
+            "cover_photo_id": case((newer, excluded.cover_photo_id), else_=TimelineBucket.cover_photo_id),
+            "cover_taken_at": case((newer, excluded.cover_taken_at), else_=TimelineBucket.cover_taken_at),
+        }
+    )
+
+
+def bucket_filter(key: BucketKey):
+    album_id, level, period = key
+    return and_(
+        TimelineBucket.album_id == album_id,
+        TimelineBucket.level == level,
+        TimelineBucket.period == period
+    )
+
+
+def latest_photo_query(key: BucketKey, exclude_ids: List[int]):
+    """分组内拍摄时间最晚的未删除照片（按索引倒序取第一条）"""
+    album_id, _, period = key
+    start, end = period_range(period)
+    query = select(Photo.id, Photo.taken_at).where(
+        Photo.taken_at >= start, Photo.taken_at < end,
+        Photo.is_deleted == False, Photo.id.not_in(exclude_ids)
+    )
+    if album_id != LIBRARY:
+        query = query.where(Photo.album_id == album_id)
+    return query.order_by(Photo.taken_at.desc(), Photo.id.desc()).limit(1)
+
+
+async def photos_added(db: AsyncSession, photos: List[Photo]):
+    """照片计入时间线（在 commit 之前调用）；没有拍摄时间的新照片按上传时间归档"""
+    for photo in photos:
+        if photo.taken_at is None:
+            if photo.created_at is None:
+                photo.created_at = datetime.utcnow()
+            photo.taken_at = photo.created_at
+    if any(photo.id is None for photo in photos):
+        # 封面记录照片ID，新照片需要先写入数据库
+        await db.flush()
+
+    values = bucket_values(aggregate((photo.id, photo.album_id, photo.taken_at) for photo in photos))
+    dialect_name = db.get_bind().dialect.name
+    for index in range(0, len(values), BATCH_ROWS):
+        await db.execute(upsert_buckets(dialect_name, values[index:index + BATCH_ROWS]))
+
+
+async def photos_removed(db: AsyncSession, photos: List[Photo]):
+    """照片移出时间线（在 commit 之前调用）"""
+    buckets = aggregate(
+        (photo.id, photo.album_id, photo.taken_at) for photo in photos if photo.taken_at is not None
+    )
+    if not buckets:
+        return
+
+    for key, (count, _, _, photo_ids) in buckets.items():
+        removed_cover = TimelineBucket.cover_photo_id.in_(photo_ids)
+        await db.execute(
+            update(TimelineBucket)
+            .where(bucket_filter(key))
+            .values(
+                photo_count=TimelineBucket.photo_count - count,
+                cover_photo_id=case((removed_cover, None), else_=TimelineBucket.cover_photo_id),
+                cover_taken_at=case((removed_cover, None), else_=TimelineBucket.cover_taken_at),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    album_ids = {album_id for album_id, _, _ in buckets}
+    await db.execute(
+        delete(TimelineBucket)
+        .where(TimelineBucket.album_id.in_(album_ids), TimelineBucket.photo_count <= 0)
+        .execution_options(synchronize_session=False)
+    )
+
+    # 封面被移除的分组重新选封面
+    result = await db.execute(
+        select(TimelineBucket.album_id, TimelineBucket.level, TimelineBucket.period)
+        .where(TimelineBucket.album_id.in_(album_ids), TimelineBucket.cover_photo_id.is_(None))
+    )
+    for key in result.all():
+        key = tuple(key)
+        photo_ids = buckets[key][3] if key in buckets else []
+        latest = (await db.execute(latest_photo_query(key, photo_ids))).first()
+        if latest is None:
+            continue
+        await db.execute(
+            update(TimelineBucket)
+            .where(bucket_filter(key))
+            .values(cover_photo_id=latest.id, cover_taken_at=latest.taken_at)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def rebuild_timeline(conn: Connection) -> int:
+    """按照片表重建全部时间线分组（同步连接，通过 run_sync 调用），返回分组数"""
+    rows = conn.execute(
+        select(Photo.id, Photo.album_id, Photo.taken_at)
+        .where(Photo.is_deleted == False, Photo.taken_at.is_not(None))
+    )
+    values = bucket_values(aggregate(rows))
+
+    conn.execute(delete(TimelineBucket))
+    for index in range(0, len(values), BATCH_ROWS):
+        conn.execute(TimelineBucket.__table__.insert(), values[index:index + BATCH_ROWS])
+    return len(values)
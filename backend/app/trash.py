@@ -0,0 +1,183 @@
+"""
+回收站的永久删除和自动清理
+
+清空回收站、永久删除相册可能涉及上万张照片，请求中只入队一个 purge_trash 任务就返回，
+由后台任务分批删除：每批 trash_purge_batch_size 张照片一个事务（删除照片记录、释放
+blobs 引用、入队 delete_files 任务删除文件），批与批之间其他请求可以写入，不会长时间
+占用数据库写锁；文件由 delete_files 任务在数据库删除的同时并行删除。进度写入 jobs 表，
+回收站页面轮询显示。
+
+任务只删除入队时（deleted_before）已经在回收站中的项目，之后删除的不受影响；
+执行期间被恢复的照片也不会被删除。
+
+trash_retention_days 大于 0 时，后台任务维护时检查回收站，删除时间超过该天数的
+相册和照片由同一类任务清理。
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import Album, AsyncSessionLocal, Photo, ReadSessionLocal
+from .album_versions import touch_albums
+from .album_stats import photos_removed
+from .blobs import release_blobs
+from .ingest import enqueue_file_deletion
+from .jobs import active_jobs, enqueue, job_handler, on_maintenance, report_progress
+
+PURGE_JOB = "purge_trash"
+RETENTION_DEDUP_KEY = "purge_trash:retention"
+
+
+async def enqueue_purge(db: AsyncSession, album_id: Optional[int] = None, retention: bool = False):
+    """
+    入队永久删除任务（在 commit 之前调用）：album_id 为空时清空整个回收站，
+    retention 为 True 时只清理超过保留期限的项目
+    """
+    if retention:
+        deleted_before = datetime.utcnow() - timedelta(days=settings.trash_retention_days)
+        dedup_key = RETENTION_DEDUP_KEY
+    else:
+        deleted_before = datetime.utcnow()
+        dedup_key = PURGE_JOB if album_id is None else f"{PURGE_JOB}:album:{album_id}"
+    payload = {"album_id": album_id, "deleted_before": deleted_before.isoformat(), "retention": retention}
+    await enqueue(db, PURGE_JOB, payload, dedup_key=dedup_key)
+
+
+async def trash_album(db: AsyncSession, album: Album):
+    """
+    把相册和其中未删除的照片移入回收站（在 commit 之前调用），同时从相册统计和
+    时间线分组中减去这些照片
+    """
+    deleted_at = datetime.utcnow()
+    result = await db.execute(
+        select(Photo).where(Photo.album_id == album.id, Photo.is_deleted == False)
+    )
+    photos = result.scalars().all()
+    album.is_deleted = True
+    album.deleted_at = deleted_at
+    for photo in photos:
+        photo.is_deleted = True
+        photo.deleted_at = deleted_at
+    await photos_removed(db, photos)
+
+
+def photo_filter(album_id: Optional[int], deleted_before: datetime) -> List:
+    conditions = [Photo.is_deleted == True, Photo.deleted_at <= deleted_before]
+    if album_id is not None:
+        conditions.append(Photo.album_id == album_id)
+    return conditions
+
+
+def album_filter(album_id: Optional[int], deleted_before: datetime) -> List:
+    conditions = [Album.is_deleted == True, Album.deleted_at <= deleted_before]
+    if album_id is not None:
+        conditions.append(Album.id == album_id)
+    return conditions
+
+
+def without_trashed_photos():
+    """相册最后删除；回收站中还留有照片（保留期限内单独删除的）的相册留到下次"""
+    return ~exists().where(Photo.album_id == Album.id, Photo.is_deleted == True)
+
+
+async def purge_photo_batch(conditions: List, batch_size: int) -> int:
+    """在一个事务中永久删除一批照片，返回删除的数量"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Photo).where(*conditions).limit(batch_size)
+        )
+        photos = {photo.id: photo for photo in result.scalars().all()}
+        if not photos:
+            return 0
+        # 先删除再释放引用：选出之后被恢复的照片不会被删除，也不会少算引用数
+        result = await db.execute(
+            delete(Photo)
+            .where(Photo.id.in_(photos), Photo.is_deleted == True)
+            .returning(Photo.id)
+            .execution_options(synchronize_session=False)
+        )
+        deleted = [photos[photo_id] for photo_id in result.scalars().all()]
+        unreferenced = await release_blobs(db, deleted)
+        touch_albums(db, {photo.album_id for photo in deleted})
+        await enqueue_file_deletion(db, unreferenced)
+        await db.commit()
+        # 全部被恢复时也返回非 0：它们不再满足条件，下一批不会重复选出
+        return len(deleted) or len(photos)
+
+
+@job_handler(PURGE_JOB, concurrency=1)
+async def purge_trash_job(payload: Dict):
+    album_id = payload.get("album_id")
+    deleted_before = datetime.fromisoformat(payload["deleted_before"])
+    photo_conditions = photo_filter(album_id, deleted_before)
+    album_conditions = album_filter(album_id, deleted_before)
+
+    async with ReadSessionLocal() as db:
+        photo_total = (await db.execute(select(func.count(Photo.id)).where(*photo_conditions))).scalar()
+        album_total = (await db.execute(select(func.count(Album.id)).where(*album_conditions))).scalar()
+    total = photo_total + album_total
+    done = 0
+    await report_progress(done, total)
+
+    while True:
+        count = await purge_photo_batch(photo_conditions, settings.trash_purge_batch_size)
+        if count == 0:
+            break
+        done = min(done + count, total)
+        await report_progress(done, total)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            delete(Album)
+            .where(*album_conditions, without_trashed_photos())
+            .returning(Album.id)
+            .execution_options(synchronize_session=False)
+        )
+        album_ids = result.scalars().all()
+        touch_albums(db, album_ids)
+        await db.commit()
+
+    await report_progress(total, total)
+    reason = "超过保留期限的" if payload.get("retention") else ""
+    print(f"[回收站] 永久删除了{reason} {done} 张照片和 {len(album_ids)} 个相册")
+
+
+@on_maintenance
+async def schedule_retention_purge():
+    """回收站中有超过保留期限的项目时入队清理任务"""
+    if settings.trash_retention_days <= 0:
+        return
+    deleted_before = datetime.utcnow() - timedelta(days=settings.trash_retention_days)
+    async with ReadSessionLocal() as db:
+        photo = await db.execute(select(Photo.id).where(*photo_filter(None, deleted_before)).limit(1))
+        album = await db.execute(select(Album.id).where(*album_filter(None, deleted_before), without_trashed_photos()).limit(1))
+        if photo.first() is None and album.first() is None:
+            return
+    async with AsyncSessionLocal() as db:
+        await enqueue_purge(db, retention=True)
+        await db.commit()
+
+
+async def purge_progress(db: AsyncSession) -> List[Dict]:
+    """尚未完成的永久删除任务，回收站页面显示进度"""
+    items = []
+    for job in await active_jobs(db, PURGE_JOB):
+        payload = json.loads(job.payload)
+        if payload.get("retention"):
+            label = "清理超过保留期限的项目"
+        elif payload.get("album_id") is not None:
+            label = f"永久删除相册 #{payload['album_id']}"
+        else:
+            label = "清空回收站"
+        items.append({
+            "id": job.id,
+            "label": label,
+            "status": job.status,
+            "progress": job.progress or 0,
+            "progress_total": job.progress_total,
+        })
+    return items
@@ -0,0 +1,83 @@
+"""
+事件循环延迟基准测试：生成缩略图和预览图期间测量事件循环的响应延迟
+
+用法（在 backend 目录下运行）:
+    python benchmarks/event_loop_latency.py                 # 通过图片处理进程池生成衍生图
+    python benchmarks/event_loop_latency.py --mode inline   # 在事件循环中直接调用 Pillow（旧实现的做法）
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from app.derivatives import variant_specs, variant_filename
+from app.image_worker import image_worker, generate_derivatives
+
+
+async def probe_latency(samples: list, stop: asyncio.Event, interval: float = 0.01):
+    """模拟其他 API 请求：每隔 interval 被调度一次，记录实际调度延迟"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def run(mode: str, images: int, megapixels: int):
+    work_dir = tempfile.mkdtemp(prefix="loop_bench_")
+    try:
+        side = int((megapixels * 1_000_000) ** 0.5)
+        sources = []
+        for i in range(images):
+            path = os.path.join(work_dir, f"{i}.jpg")
+            Image.effect_noise((side, side), 64).convert("RGB").save(path, quality=90)
+            sources.append(path)
+
+        image_worker.start()
+        samples = []
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe_latency(samples, stop))
+
+        started = time.perf_counter()
+        for path in sources:
+            filename = os.path.basename(path)
+            if mode == "inline":
+                outputs = [
+                    (variant, os.path.join(work_dir, variant_filename(filename, variant)), size, output_format)
+                    for variant, size, output_format in variant_specs()
+                ]
+                generate_derivatives(path, outputs)
+                await asyncio.sleep(0)
+            else:
+                await image_worker.make_derivatives(path, filename)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await prober
+        samples.sort()
+
+        print(f"模式: {mode}")
+        print(f"图片: {images} 张 {megapixels}MP，耗时 {elapsed:.2f}s")
+        if samples:
+            p50 = samples[len(samples) // 2]
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+            print(f"事件循环延迟 p50={p50:.1f}ms p99={p99:.1f}ms max={samples[-1]:.1f}ms")
+    finally:
+        image_worker.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="衍生图生成期间的事件循环延迟")
+    parser.add_argument("--mode", choices=["worker", "inline"], default="worker")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--megapixels", type=int, default=24)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.mode, args.images, args.megapixels))
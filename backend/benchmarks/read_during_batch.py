@@ -0,0 +1,112 @@
+"""
+批量写入期间的读延迟基准测试：模拟 1000 张照片的批量上传事务，同时不断查询相册照片列表
+
+用法（在 backend 目录下运行）:
+    python benchmarks/read_during_batch.py                  # WAL 模式（默认配置）
+    python benchmarks/read_during_batch.py --journal delete # 回滚日志模式（旧配置）
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def reader(samples: list, stop: asyncio.Event, album_id: int):
+    """模拟相册页面请求：每次取一页照片并记录耗时"""
+    from sqlalchemy import select
+    from app.database import ReadSessionLocal, Photo
+
+    while not stop.is_set():
+        started = time.perf_counter()
+        async with ReadSessionLocal() as session:
+            result = await session.execute(
+                select(Photo)
+                .where(Photo.album_id == album_id)
+                .order_by(Photo.sort_order.desc(), Photo.created_at.desc(), Photo.id.desc())
+                .limit(60)
+            )
+            result.scalars().all()
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+
+
+async def writer(album_id: int, batches: int, batch_size: int, hold: float):
+    """模拟批量上传：在一个事务中插入 batch_size 张照片并更新相册计数"""
+    from app.database import AsyncSessionLocal, Photo
+    from app.album_stats import photos_added
+
+    for batch in range(batches):
+        async with AsyncSessionLocal() as session:
+            photos = [
+                Photo(
+                    album_id=album_id,
+                    filename=f"{batch}_{i}.jpg",
+                    original_filename=f"IMG_{i:04d}.jpg",
+                    file_path=f"uploads/{batch}_{i}.jpg",
+                    file_size=3 * 1024 * 1024,
+                    width=4000,
+                    height=3000,
+                    variants="preview,thumb"
+                )
+                for i in range(batch_size)
+            ]
+            session.add_all(photos)
+            await photos_added(session, photos)
+            await session.flush()
+            # 事务持有写锁的时间（生成衍生图、提交前的其他工作）
+            await asyncio.sleep(hold)
+            await session.commit()
+
+
+async def run(batches: int, batch_size: int, hold: float):
+    from app.database import init_db, close_db, AsyncSessionLocal, Album
+
+    await init_db()
+    async with AsyncSessionLocal() as session:
+        album = Album(name="bench")
+        session.add(album)
+        await session.commit()
+        album_id = album.id
+
+    samples = []
+    stop = asyncio.Event()
+    readers = [asyncio.create_task(reader(samples, stop, album_id)) for _ in range(4)]
+
+    started = time.perf_counter()
+    await writer(album_id, batches, batch_size, hold)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await asyncio.gather(*readers)
+    await close_db()
+
+    samples.sort()
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"写入: {batches} 批 x {batch_size} 张，耗时 {elapsed:.2f}s")
+    print(f"读取: {len(samples)} 次，p50={p50:.1f}ms p99={p99:.1f}ms max={samples[-1]:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量写入期间的读延迟")
+    parser.add_argument("--journal", choices=["wal", "delete"], default="wal")
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--hold", type=float, default=0.5, help="每个写事务在提交前持有锁的秒数")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sqlite_bench_")
+    # 引擎在导入 app.database 时创建，先通过环境变量指定数据库和日志模式
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["SQLITE_JOURNAL_MODE"] = args.journal.upper()
+    os.environ["DEBUG"] = "false"
+    try:
+        print(f"日志模式: {args.journal.upper()}")
+        asyncio.run(run(args.batches, args.batch_size, args.hold))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
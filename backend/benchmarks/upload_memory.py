@@ -0,0 +1,102 @@
+"""
+上传内存基准测试：模拟多个大文件并发上传，记录进程 RSS 峰值
+
+用法（在 backend 目录下运行）:
+    python benchmarks/upload_memory.py                      # 10 个 100MB 并发上传，流式写盘
+    python benchmarks/upload_memory.py --mode legacy        # 旧实现：整个文件读入内存后写盘
+    python benchmarks/upload_memory.py --files 4 --size-mb 50
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.datastructures import UploadFile
+
+from app.config import settings
+from app.ingest import stream_upload_to_path
+
+
+def current_rss_mb() -> float:
+    """读取当前进程的常驻内存（MB）"""
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+async def sample_rss(samples: list, stop: asyncio.Event, interval: float = 0.02):
+    """后台定时采样 RSS"""
+    while not stop.is_set():
+        samples.append(current_rss_mb())
+        await asyncio.sleep(interval)
+
+
+def make_upload(work_dir: str, index: int, size_mb: int) -> UploadFile:
+    """构造一个落盘的 UploadFile，与 python-multipart 解析大文件后的形态一致"""
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, dir=work_dir)
+    block = os.urandom(1024 * 1024)
+    for _ in range(size_mb):
+        spool.write(block)
+    spool.seek(0)
+    return UploadFile(file=spool, filename=f"bench_{index}.jpg", size=size_mb * 1024 * 1024)
+
+
+async def legacy_save(file: UploadFile, file_path: str):
+    """旧实现：一次性读入整个文件"""
+    with open(file_path, "wb") as buffer:
+        content = await file.read()
+        buffer.write(content)
+    return len(content)
+
+
+async def run(mode: str, files: int, size_mb: int):
+    work_dir = tempfile.mkdtemp(prefix="upload_bench_")
+    settings.upload_dir = os.path.join(work_dir, "uploads")
+    settings.max_file_size = max(settings.max_file_size, size_mb * 1024 * 1024)
+    os.makedirs(settings.upload_dir, exist_ok=True)
+
+    try:
+        uploads = [make_upload(work_dir, i, size_mb) for i in range(files)]
+        baseline = current_rss_mb()
+
+        samples = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(samples, stop))
+
+        started = time.perf_counter()
+        tasks = []
+        for i, upload in enumerate(uploads):
+            target = os.path.join(settings.upload_dir, f"{i}.jpg")
+            if mode == "legacy":
+                tasks.append(legacy_save(upload, target))
+            else:
+                tasks.append(stream_upload_to_path(upload, target))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await sampler
+        peak = max(samples + [current_rss_mb()])
+
+        print(f"模式: {mode}")
+        print(f"并发上传: {files} x {size_mb}MB")
+        print(f"耗时: {elapsed:.2f}s")
+        print(f"基线 RSS: {baseline:.1f}MB")
+        print(f"峰值 RSS: {peak:.1f}MB (增长 {peak - baseline:.1f}MB)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并发上传内存基准测试")
+    parser.add_argument("--mode", choices=["stream", "legacy"], default="stream")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--size-mb", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.mode, args.files, args.size_mb))
@@ -1,14 +1,18 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import uvicorn
 import os
 from datetime import datetime
 
 # 导入路由
-from app.routers import auth, albums, photos, upload, admin
-from app.database import init_db
+from app.routers import auth, albums, photos, upload, resumable, search, admin
+from app.database import init_db, close_db
+from app.image_worker import image_worker
+from app.jobs import job_queue
+from app.render_cache import render_cache
+from app.media import MediaFiles, redirect_to_storage
+from app.storage import get_storage
 from app.config import settings
 
 
@@ -23,6 +27,18 @@ async def lifespan(app: FastAPI):
     # 创建上传目录
     os.makedirs("uploads", exist_ok=True)
     
+    # 清理过期的断点续传会话
+    resumable.cleanup_expired_sessions()
+    
+    # 加载按需渲染的缓存索引
+    render_cache.load()
+    
+    # 启动图片处理进程池
+    image_worker.start()
+    
+    # 开始执行后台任务（包括上次关闭或崩溃时没有完成的任务）
+    await job_queue.start()
+    
     print(f"[地址] 服务地址: http://localhost:{settings.port}")
     print(f"[文档] API 文档: http://localhost:{settings.port}/docs")
     print(f"[管理] 管理后台: http://localhost:{settings.port}/admin/")
@@ -31,6 +47,9 @@ async def lifespan(app: FastAPI):
     yield
     
     # 关闭时执行
+    await job_queue.stop()
+    image_worker.shutdown()
+    await close_db()
     print("[关闭] 小宇相册 API 服务已关闭")
 
 
@@ -51,14 +70,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 静态文件服务
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+if get_storage().is_local:
+    # 静态文件服务（UUID 命名的图片长期缓存，支持 Range）
+    app.mount("/uploads", MediaFiles(directory="uploads"), name="uploads")
+else:
+    # 文件在对象存储中：旧地址和私有桶的地址重定向到预签名下载地址
+    app.add_api_route(
+        "/uploads/{key:path}", redirect_to_storage, methods=["GET", "HEAD"], include_in_schema=False
+    )
 
 # 注册 API 路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(albums.router, prefix="/api/albums", tags=["相册"])
 app.include_router(photos.router, prefix="/api/photos", tags=["照片"])
 app.include_router(upload.router, prefix="/api/upload", tags=["上传"])
+app.include_router(resumable.router, prefix="/api/upload/sessions", tags=["上传"])
+app.include_router(search.router, prefix="/api/search", tags=["搜索"])
 
 # 注册管理后台路由
 app.include_router(admin.router, prefix="/admin", tags=["管理后台"])
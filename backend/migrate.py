@@ -0,0 +1,550 @@
+"""
+数据库迁移工具
+
+启动服务时会自动执行未执行的迁移，这个脚本用于手动执行、查看状态和检查索引。
+运行前请确保备份数据库。
+
+用法:
+    python migrate.py                     # 执行所有未执行的迁移
+    python migrate.py status              # 查看各个迁移的执行状态
+    python migrate.py check               # 检查热点查询的执行计划是否都走索引
+    python migrate.py backfill-variants   # 为旧照片补生成衍生图，重新生成版本较旧（未按 EXIF 方向转正）的衍生图
+    python migrate.py shard-uploads [N]   # 把上传文件移到分片子目录，每批 N 张（默认 500）
+    python migrate.py sync-storage        # 把本地上传目录中的照片文件上传到配置的对象存储
+    python migrate.py hash-uploads        # 为旧照片补算内容哈希和 CRC32，内容相同的照片合并为一份文件
+    python migrate.py backfill-dhash      # 为旧照片补算感知哈希（用于查找相似照片）
+    python migrate.py backfill-exif       # 为旧照片读取拍摄时间、相机等 EXIF 信息并更新时间线
+    python migrate.py jobs                # 查看后台任务的队列长度和最近失败的任务
+    python migrate.py run-jobs            # 在当前进程中执行已到时间的后台任务，直到队列为空
+
+shard-uploads 可以在服务运行时执行，中断后重新运行会从头检查、跳过已迁移的照片；
+backfill-variants 中断后重新运行只处理还没有完成的照片。
+backfill-variants、shard-uploads、hash-uploads、backfill-dhash 和 backfill-exif 只处理本地存储；改用对象存储前先执行它们，
+再用 sync-storage 上传（已存在的对象会跳过，可以重复执行），本地文件不会被删除。
+"""
+import asyncio
+import importlib
+import os
+import shutil
+import sys
+
+from app.database import engine
+from app.migrations import run_migrations, migration_status
+
+
+def load_side_effects(*modules: str):
+    """导入只为了副作用的模块（导入时注册 ORM 事件监听或后台任务类型）"""
+    for module in modules:
+        importlib.import_module(module)
+
+
+async def upgrade():
+    executed = await run_migrations(engine)
+    if not executed:
+        print("数据库已是最新版本")
+    else:
+        print(f"已执行 {len(executed)} 个迁移")
+
+
+async def status():
+    for version, name, applied_at in await migration_status(engine):
+        state = f"已执行 {applied_at:%Y-%m-%d %H:%M:%S}" if applied_at else "未执行"
+        print(f"{version:04d}_{name:<30} {state}")
+
+
+async def check():
+    """EXPLAIN QUERY PLAN 检查，有查询没走索引时以非零状态退出"""
+    from app.query_plans import check_query_plans
+
+    if engine.dialect.name != "sqlite":
+        print(f"执行计划检查只支持 SQLite，当前数据库: {engine.dialect.name}")
+        return True
+
+    async with engine.connect() as conn:
+        results = await conn.run_sync(check_query_plans)
+
+    failed = 0
+    for name, plan, ok in results:
+        print(f"[{'通过' if ok else '失败'}] {name}")
+        for step in plan:
+            print(f"        {step}")
+        failed += 0 if ok else 1
+
+    print(f"共 {len(results)} 个查询，{failed} 个未走索引")
+    return failed == 0
+
+
+async def backfill_variants(batch_size: int = 100):
+    """
+    为衍生图版本较旧的照片重新生成衍生图（variants 为空的旧照片、生成时还没有按
+    EXIF 方向转正的照片），完成后记录 variants_version，重新运行时跳过
+
+    按 ID 分批，每批一个事务：同时更新共用这份文件的照片和 blobs 记录（之后按内容
+    去重的上传直接沿用新的衍生图），并登记相册版本号，ETag 和响应缓存随之失效。
+    """
+    from sqlalchemy import or_, select, update
+    from app.database import AsyncSessionLocal, Photo, Blob
+    from app.album_versions import touch_albums
+    from app.derivatives import DERIVATIVES_VERSION, format_variants
+    from app.image_worker import image_worker
+    from app.ingest import PENDING_VARIANTS
+    from app.similarity import dhash_columns
+
+    image_worker.start()
+    last_id = 0
+    processed = missing = failed = 0
+    try:
+        while True:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Photo)
+                    .where(
+                        Photo.id > last_id,
+                        # 衍生图还在由 derivatives 任务生成的照片不重复处理
+                        or_(Photo.variants.is_(None), Photo.variants != PENDING_VARIANTS),
+                        or_(Photo.variants_version.is_(None), Photo.variants_version < DERIVATIVES_VERSION)
+                    )
+                    .order_by(Photo.id)
+                    .limit(batch_size)
+                )
+                photos = result.scalars().all()
+                if not photos:
+                    break
+                last_id = photos[-1].id
+
+                # 共用同一份文件的照片只生成一次
+                files = {}
+                for photo in photos:
+                    if not os.path.exists(photo.file_path):
+                        print(f"跳过缺失的文件: {photo.file_path}")
+                        missing += 1
+                        continue
+                    files.setdefault(photo.filename, photo)
+
+                async def generate(photo):
+                    try:
+                        return await image_worker.make_derivatives(photo.file_path, photo.filename)
+                    except Exception as e:
+                        print(f"处理 {photo.filename} 失败: {e}")
+                        return None
+
+                # 一批同时提交给进程池，由内存额度控制并发
+                outputs = await asyncio.gather(*(generate(photo) for photo in files.values()))
+                album_ids = set()
+                for photo, output in zip(files.values(), outputs):
+                    if output is None:
+                        failed += 1
+                        continue
+                    variants, fields = output
+                    # 拍摄信息会影响时间线，由 backfill-exif 处理
+                    values = {
+                        "width": fields["width"], "height": fields["height"],
+                        "variants": format_variants(variants), "variants_version": DERIVATIVES_VERSION,
+                    }
+                    same_file = (
+                        [Photo.content_sha256 == photo.content_sha256, Photo.filename == photo.filename]
+                        if photo.content_sha256 else [Photo.id == photo.id]
+                    )
+                    result = await session.execute(
+                        update(Photo)
+                        .where(*same_file)
+                        .values(**values, **dhash_columns(fields["dhash"]))
+                        .returning(Photo.album_id)
+                        .execution_options(synchronize_session=False)
+                    )
+                    album_ids.update(result.scalars().all())
+                    if photo.content_sha256:
+                        await session.execute(
+                            update(Blob)
+                            .where(Blob.content_sha256 == photo.content_sha256, Blob.filename == photo.filename)
+                            .values(**values, dhash=fields["dhash"])
+                        )
+                    processed += 1
+
+                touch_albums(session, album_ids)
+                await session.commit()
+            print(f"已检查到照片 {last_id}：生成 {processed} 份，缺失 {missing} 张，失败 {failed} 份")
+    finally:
+        image_worker.shutdown()
+
+    print(f"完成：生成 {processed} 份，缺失 {missing} 张，失败 {failed} 份")
+
+
+def link_or_copy(source: str, target: str):
+    """同一文件系统上用硬链接（瞬间完成，修改时间不变，ETag 也不变），否则复制"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+async def shard_uploads(batch_size: int = 500):
+    """
+    把原图和衍生图移到 upload_shard_depth 对应的目录，并分批更新 Photo.file_path
+
+    每批先把文件链接到新位置，提交新路径之后才删除旧文件，迁移期间新旧地址都能
+    访问。平铺的旧 URL 在迁移后由 /uploads 的静态文件服务按分片目录查找。
+    """
+    from sqlalchemy import select
+    from app.config import settings
+    from app.database import AsyncSessionLocal, Photo
+    from app.derivatives import layout_path, photo_file_paths
+    # 注册版本号监听：路径变化后相册的 ETag 和响应缓存随之失效
+    load_side_effects("app.album_versions")
+
+    print(f"目标布局: 每个文件 {settings.upload_shard_depth} 级子目录")
+    last_id = 0
+    moved = unchanged = missing = 0
+    while True:
+        stale_files = []
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Photo).where(Photo.id > last_id).order_by(Photo.id).limit(batch_size)
+            )
+            photos = result.scalars().all()
+            if not photos:
+                break
+            last_id = photos[-1].id
+
+            for photo in photos:
+                target = layout_path(photo.filename)
+                if os.path.normpath(photo.file_path) == os.path.normpath(target):
+                    unchanged += 1
+                    continue
+                if not os.path.exists(photo.file_path) and not os.path.exists(target):
+                    print(f"跳过缺失的文件: {photo.file_path}")
+                    missing += 1
+                    continue
+
+                target_dir = os.path.dirname(target)
+                os.makedirs(target_dir, exist_ok=True)
+                for source in photo_file_paths(photo):
+                    if not os.path.exists(source):
+                        continue
+                    destination = os.path.join(target_dir, os.path.basename(source))
+                    # 上次中断时可能已经链接过
+                    if not os.path.exists(destination):
+                        link_or_copy(source, destination)
+                    stale_files.append(source)
+                photo.file_path = target
+                moved += 1
+
+            await session.commit()
+
+        for path in stale_files:
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"已检查到照片 {last_id}：迁移 {moved} 张，无需迁移 {unchanged} 张，缺失 {missing} 张")
+
+    print(f"完成：迁移 {moved} 张，无需迁移 {unchanged} 张，缺失 {missing} 张")
+
+
+async def sync_storage():
+    """把本地上传目录中的原图和衍生图上传到当前配置的存储后端"""
+    from sqlalchemy import select
+    from app.database import AsyncSessionLocal, Photo
+    from app.derivatives import photo_file_paths, storage_key
+    from app.storage import get_storage
+
+    storage = get_storage()
+    if storage.is_local:
+        print("当前是本地存储，无需同步（请先配置 STORAGE_BACKEND）")
+        return False
+
+    uploaded = skipped = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Photo).where(Photo.id > last_id).order_by(Photo.id).limit(500)
+            )
+            photos = result.scalars().all()
+        if not photos:
+            break
+        last_id = photos[-1].id
+
+        for photo in photos:
+            for path in photo_file_paths(photo):
+                if not os.path.exists(path):
+                    continue
+                key = storage_key(path)
+                if await storage.exists(key):
+                    skipped += 1
+                    continue
+                await storage.put(key, path)
+                uploaded += 1
+        print(f"已检查到照片 {last_id}：上传 {uploaded} 个文件，跳过 {skipped} 个")
+
+    print(f"完成：上传 {uploaded} 个文件，跳过已存在的 {skipped} 个")
+    return True
+
+
+def require_local_storage() -> bool:
+    from app.storage import get_storage
+
+    if not get_storage().is_local:
+        print("该命令只能处理本地存储的文件，请在 STORAGE_BACKEND=local 时执行")
+        return False
+    return True
+
+
+async def hash_uploads(batch_size: int = 500):
+    """
+    为 content_sha256 或 content_crc32 为空的旧照片计算哈希，新算出 SHA-256 的照片登记到 blobs 表
+
+    内容与更早的照片相同时改为指向那张照片的文件，提交后删除自己的文件。
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from sqlalchemy import select, or_
+    from app.database import AsyncSessionLocal, Photo
+    from app.blobs import attach_blobs
+    from app.ingest import file_digests, delete_photo_files
+    # 注册版本号监听：合并重复文件后相册的 ETag 和响应缓存随之失效
+    load_side_effects("app.album_versions")
+
+    last_id = 0
+    hashed = merged = missing = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Photo)
+                .where(Photo.id > last_id, or_(Photo.content_sha256.is_(None), Photo.content_crc32.is_(None)))
+                .order_by(Photo.id)
+                .limit(batch_size)
+            )
+            photos = result.scalars().all()
+            if not photos:
+                break
+            last_id = photos[-1].id
+
+            present = []
+            unregistered = []
+            for photo in photos:
+                if not os.path.exists(photo.file_path):
+                    missing += 1
+                    continue
+                if photo.content_sha256 is None:
+                    unregistered.append(photo)
+                photo.content_sha256, photo.content_crc32 = await run_in_threadpool(file_digests, photo.file_path)
+                present.append(photo)
+
+            duplicates = await attach_blobs(session, unregistered)
+            await session.commit()
+
+        await delete_photo_files(duplicates)
+        hashed += len(present)
+        merged += len(duplicates)
+        print(f"已检查到照片 {last_id}：计算 {hashed} 张，合并重复文件 {merged} 份，缺失 {missing} 张")
+
+    print(f"完成：计算 {hashed} 张，合并重复文件 {merged} 份，缺失 {missing} 张")
+
+
+async def backfill_dhash(batch_size: int = 500):
+    """为 dhash 为空的照片计算感知哈希，优先读取缩略图"""
+    from sqlalchemy import select, update
+    from app.database import AsyncSessionLocal, Photo, Blob
+    from app.derivatives import photo_file_path, parse_variants
+    from app.image_worker import image_worker
+    # 注册监听：设置 dhash 时同步分段列
+    load_side_effects("app.similarity")
+
+    image_worker.start()
+    last_id = 0
+    hashed = failed = 0
+    try:
+        while True:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Photo)
+                    .where(Photo.id > last_id, Photo.dhash.is_(None))
+                    .order_by(Photo.id)
+                    .limit(batch_size)
+                )
+                photos = result.scalars().all()
+                if not photos:
+                    break
+                last_id = photos[-1].id
+
+                async def compute(photo):
+                    source = photo_file_path(photo, "thumb") if "thumb" in parse_variants(photo.variants) else photo.file_path
+                    try:
+                        return await image_worker.dhash(source)
+                    except Exception as e:
+                        print(f"处理 {photo.filename} 失败: {e}")
+                        return None
+
+                # 一批同时提交给进程池，由内存额度控制并发
+                values = await asyncio.gather(*(compute(photo) for photo in photos))
+                for photo, hash_value in zip(photos, values):
+                    if hash_value is None:
+                        failed += 1
+                        continue
+                    photo.dhash = hash_value
+                    hashed += 1
+                    if photo.content_sha256:
+                        await session.execute(
+                            update(Blob)
+                            .where(Blob.content_sha256 == photo.content_sha256, Blob.dhash.is_(None))
+                            .values(dhash=hash_value)
+                        )
+                await session.commit()
+            print(f"已检查到照片 {last_id}：计算 {hashed} 张，失败 {failed} 张")
+    finally:
+        image_worker.shutdown()
+
+    print(f"完成：计算 {hashed} 张，失败 {failed} 张")
+
+
+async def backfill_exif(batch_size: int = 500):
+    """
+    为还没有读取过 EXIF 的照片（orientation 为空）读取拍摄信息
+
+    读到拍摄时间的照片从原来按上传时间归档的时间线分组移到拍摄时间所在的分组。
+    """
+    from sqlalchemy import select, update
+    from app.database import AsyncSessionLocal, Photo, Blob
+    from app.image_worker import image_worker
+    from app import timeline
+    # 注册版本号监听：拍摄信息变化后相册的 ETag 和响应缓存随之失效
+    load_side_effects("app.album_versions")
+
+    image_worker.start()
+    last_id = 0
+    read = moved = failed = 0
+    try:
+        while True:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Photo)
+                    .where(Photo.id > last_id, Photo.orientation.is_(None))
+                    .order_by(Photo.id)
+                    .limit(batch_size)
+                )
+                photos = result.scalars().all()
+                if not photos:
+                    break
+                last_id = photos[-1].id
+
+                async def read_exif(photo):
+                    try:
+                        return await image_worker.exif(photo.file_path)
+                    except Exception as e:
+                        print(f"处理 {photo.filename} 失败: {e}")
+                        return None
+
+                values = await asyncio.gather(*(read_exif(photo) for photo in photos))
+                changed = [
+                    photo for photo, fields in zip(photos, values)
+                    if fields and fields["taken_at"] and fields["taken_at"] != photo.taken_at
+                    and not photo.is_deleted
+                ]
+                await timeline.photos_removed(session, changed)
+                for photo, fields in zip(photos, values):
+                    if fields is None:
+                        failed += 1
+                        continue
+                    read += 1
+                    if photo.content_sha256:
+                        await session.execute(
+                            update(Blob)
+                            .where(Blob.content_sha256 == photo.content_sha256, Blob.orientation.is_(None))
+                            .values(**fields)
+                        )
+                    # 没有拍摄时间时保留按上传时间填充的值
+                    if fields["taken_at"] is None:
+                        fields["taken_at"] = photo.taken_at
+                    for field, value in fields.items():
+                        setattr(photo, field, value)
+                await timeline.photos_added(session, changed)
+                moved += len(changed)
+                await session.commit()
+            print(f"已检查到照片 {last_id}：读取 {read} 张，更新拍摄时间 {moved} 张，失败 {failed} 张")
+    finally:
+        image_worker.shutdown()
+
+    print(f"完成：读取 {read} 张，更新拍摄时间 {moved} 张，失败 {failed} 张")
+
+
+async def show_jobs():
+    from app.database import ReadSessionLocal
+    from app.jobs import job_queue
+    load_side_effects("app.ingest", "app.trash")  # 注册任务类型
+
+    async with ReadSessionLocal() as session:
+        stats = await job_queue.stats(session)
+    for item in stats["types"]:
+        print(
+            f"{item['type']:<16} 排队 {item['pending']:>6}  执行中 {item['running']:>4}  "
+            f"失败 {item['failed']:>4}  最长等待 {item['oldest_pending_seconds']} 秒"
+        )
+    for job in stats["recent_failures"]:
+        print(f"失败: {job['type']} #{job['id']}（{job['attempts']} 次）{job['error']}")
+
+
+async def run_jobs():
+    """执行队列中已到时间的任务（服务设置了 JOBS_ENABLED=false 时，可以由定时任务调用）"""
+    from app.image_worker import image_worker
+    from app.jobs import job_queue
+    load_side_effects("app.ingest", "app.trash")  # 注册任务类型
+
+    image_worker.start()
+    try:
+        await job_queue.run_until_idle()
+    finally:
+        image_worker.shutdown()
+    print(f"完成：成功 {job_queue.succeeded} 个，等待重试 {job_queue.retried} 个，失败 {job_queue.failed} 个")
+
+
+async def main(command: str) -> bool:
+    if command == "upgrade":
+        await upgrade()
+    elif command == "status":
+        await status()
+    elif command == "check":
+        await upgrade()
+        return await check()
+    elif command == "backfill-variants":
+        if not require_local_storage():
+            return False
+        await upgrade()
+        await backfill_variants()
+    elif command == "shard-uploads":
+        if not require_local_storage():
+            return False
+        await upgrade()
+        batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        await shard_uploads(batch_size)
+    elif command == "backfill-dhash":
+        if not require_local_storage():
+            return False
+        await upgrade()
+        await backfill_dhash()
+    elif command == "backfill-exif":
+        if not require_local_storage():
+            return False
+        await upgrade()
+        await backfill_exif()
+    elif command == "hash-uploads":
+        if not require_local_storage():
+            return False
+        await upgrade()
+        await hash_uploads()
+    elif command == "sync-storage":
+        await upgrade()
+        return await sync_storage()
+    elif command == "jobs":
+        await upgrade()
+        await show_jobs()
+    elif command == "run-jobs":
+        await upgrade()
+        await run_jobs()
+    else:
+        print(__doc__)
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    ok = asyncio.run(main(command))
+    sys.exit(0 if ok else 1)
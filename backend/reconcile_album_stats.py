@@ -0,0 +1,31 @@
+"""
+相册统计修复脚本：按照片表重新计算每个相册的 photo_count 和 total_bytes，
+并重建时间线分组（timeline_buckets）
+
+计数由上传、删除、恢复等操作增量维护，正常情况下不会出错；
+如果手工修改过数据库或怀疑计数有偏差，运行本脚本修复。
+
+用法:
+    python reconcile_album_stats.py
+"""
+import asyncio
+from app.database import AsyncSessionLocal, engine
+from app.album_stats import reconcile_album_stats
+from app.timeline import rebuild_timeline
+
+
+async def main():
+    async with AsyncSessionLocal() as session:
+        fixed = await reconcile_album_stats(session)
+
+    for album_id, old_count, new_count, old_bytes, new_bytes in fixed:
+        print(f"相册 {album_id}: 照片数 {old_count} -> {new_count}，总大小 {old_bytes} -> {new_bytes}")
+    print(f"已修正 {len(fixed)} 个相册的统计数据")
+
+    async with engine.begin() as conn:
+        buckets = await conn.run_sync(rebuild_timeline)
+    print(f"已重建时间线，共 {buckets} 个分组")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
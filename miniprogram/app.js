@@ -4,7 +4,9 @@ App({
     // imageBaseUrl: 'http://192.168.3.94:8000',
     apiBaseUrl: 'https://photo.liuenyi.com/api',
     imageBaseUrl: 'https://photo.liuenyi.com',
-    isLoggedIn: false
+    isLoggedIn: false,
+    // GET 响应缓存 { 请求键: { etag, data } }，服务端返回 304 时直接使用
+    etagCache: {}
   },
 
   onLaunch: function() {
@@ -52,11 +54,14 @@ App({
   request: function(options) {
     var self = this
     var token = wx.getStorageSync('token')
+    var method = options.method || 'GET'
+    var cacheKey = method === 'GET' ? options.url + '?' + JSON.stringify(options.data || {}) : null
+    var cached = cacheKey ? self.globalData.etagCache[cacheKey] : null
     
     return new Promise(function(resolve, reject) {
       var requestData = {
         url: self.globalData.apiBaseUrl + options.url,
-        method: options.method || 'GET',
+        method: method,
         data: options.data || {},
         header: {
           'Content-Type': 'application/json'
@@ -64,7 +69,11 @@ App({
         success: function(res) {
           console.log('[请求] 响应状态:', res.statusCode, '数据:', res.data)
           
-          if (res.statusCode === 200) {
+          if (res.statusCode === 304 && cached) {
+            // 数据没有变化，使用上次的响应
+            console.log('[请求] 数据未变化，使用缓存:', options.url)
+            resolve(cached.data)
+          } else if (res.statusCode === 200) {
             // 检查响应内容是否包含认证错误信息
             if (res.data && typeof res.data === 'object') {
               var responseStr = JSON.stringify(res.data).toLowerCase()
@@ -80,6 +89,10 @@ App({
                 return
               }
             }
+            var etag = res.header && (res.header['ETag'] || res.header['etag'])
+            if (cacheKey && etag) {
+              self.globalData.etagCache[cacheKey] = { etag: etag, data: res.data }
+            }
             resolve(res.data)
           } else if (res.statusCode === 401 || res.statusCode === 403) {
             // HTTP 401/403 认证失效
@@ -102,6 +115,11 @@ App({
         requestData.header['Authorization'] = 'Bearer ' + token
       }
       
+      // 带上上次的 ETag，数据没有变化时服务端只返回 304
+      if (cached) {
+        requestData.header['If-None-Match'] = cached.etag
+      }
+      
       wx.request(requestData)
     })
   },
@@ -119,6 +137,7 @@ App({
     wx.removeStorageSync('isLoggedIn')
     wx.removeStorageSync('loginTime')
     this.globalData.isLoggedIn = false
+    this.globalData.etagCache = {}
     
     console.log('[认证] ✅ 登录状态已清除，页面将自动检测并跳转')
     
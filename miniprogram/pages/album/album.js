@@ -5,7 +5,7 @@ Page({
     albumId: null,
     albumName: '',
     photos: [],
-    page: 1,
+    cursor: null,
     hasMore: true,
     loading: false,
     refreshing: false,
@@ -72,7 +72,7 @@ Page({
     wx.showNavigationBarLoading()
     this.setData({ 
       refreshing: true,
-      page: 1,
+      cursor: null,
       hasMore: true 
     })
     
@@ -102,14 +102,20 @@ Page({
     
     this.setData({ loading: true })
     
+    // 游标分页：每次只取一屏多一点，滚动到底部时用 next_cursor 继续加载
+    var params = {
+      album_id: this.data.albumId,
+      size: 60,
+      include_total: false
+    }
+    if (!isRefresh && this.data.cursor) {
+      params.cursor = this.data.cursor
+    }
+    
     return app.request({
       url: '/photos/',
       method: 'GET',
-      data: {
-        album_id: this.data.albumId,
-        page: this.data.page,
-        size: 1000
-      }
+      data: params
     }).then(function(response) {
       console.log('✅ API响应:', response)
       
@@ -124,15 +130,13 @@ Page({
 
       var photos = self.processPhotosData(photosData)
       var newPhotos = isRefresh ? photos : self.data.photos.concat(photos)
-      var currentPage = isRefresh ? 1 : self.data.page
-      var nextPage = currentPage + 1
-      var hasMorePages = response.pages ? currentPage < response.pages : false
+      var nextCursor = response && response.next_cursor ? response.next_cursor : null
       
       self.setData({
         photos: newPhotos,
         loading: false,
-        hasMore: hasMorePages || photosData.length === 1000,
-        page: nextPage
+        hasMore: !!nextCursor,
+        cursor: nextCursor
       })
       
       console.log('✅ 照片加载完成，共 ' + newPhotos.length + ' 张照片')
@@ -163,18 +167,27 @@ Page({
     
     return photos.map(function(photo, index) {
       var baseUrl = getApp().globalData.imageBaseUrl || 'https://photo.liuenyi.com'
+      // url 为适合屏幕尺寸的预览图，original_url 为原图（仅保存到相册时使用）
       var fullUrl = photo.url
-      var thumbnailUrl = photo.thumbnail_url || photo.url
+      var originalUrl = photo.original_url || photo.url
+      // 网格中每格约 250rpx，按 3 倍屏请求正方形裁剪的 WebP，由服务器按需生成并缓存
+      var thumbnailUrl = photo.id
+        ? '/api/photos/' + photo.id + '/render?w=360&h=360&fit=cover&fmt=webp'
+        : (photo.thumbnail_url || photo.url)
       
       if (fullUrl && !fullUrl.startsWith('http')) {
         fullUrl = baseUrl + '/' + fullUrl
       }
+      if (originalUrl && !originalUrl.startsWith('http')) {
+        originalUrl = baseUrl + '/' + originalUrl
+      }
       if (thumbnailUrl && !thumbnailUrl.startsWith('http')) {
-        thumbnailUrl = baseUrl + '/' + thumbnailUrl
+        thumbnailUrl = baseUrl + (thumbnailUrl.startsWith('/') ? '' : '/') + thumbnailUrl
       }
       
       return Object.assign({}, photo, {
         fullUrl: fullUrl,
+        originalUrl: originalUrl,
         thumbnailUrl: thumbnailUrl,
         displayName: photo.original_filename || '照片',
         sizeText: self.formatFileSize(photo.file_size),
@@ -232,7 +245,7 @@ Page({
     console.log('🔄 用户点击重试')
     this.setData({ 
       error: false,
-      page: 1,
+      cursor: null,
       hasMore: true
     })
     this.loadPhotos(true)
@@ -301,7 +314,7 @@ Page({
     wx.showLoading({ title: '保存中...' })
     
     wx.downloadFile({
-      url: photo.fullUrl,
+      url: photo.originalUrl || photo.fullUrl,
       success: function(res) {
         if (res.statusCode === 200) {
           wx.saveImageToPhotosAlbum({